@@ -2,8 +2,10 @@ from rest_framework import serializers
 from django.contrib.auth.models import User
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 
+from transactions.timing import TimedSerializerMixin
 
-class UserRegisterSerializer(serializers.ModelSerializer):
+
+class UserRegisterSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     password = serializers.CharField(write_only=True, min_length=8)
     password2 = serializers.CharField(write_only=True, min_length=8)
 
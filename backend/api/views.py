@@ -7,6 +7,7 @@ from django.core.exceptions import ValidationError
 from rest_framework import status
 from rest_framework.parsers import JSONParser
 from rest_framework.views import APIView
+from transactions.parsers import MessagePackParser
 from django.db.models import Sum
 
 class CustomTokenObtainPairView(TokenObtainPairView):
@@ -28,7 +29,7 @@ class CustomTokenObtainPairView(TokenObtainPairView):
 
 class RegisterDriverView(APIView):
     permission_classes = [AllowAny]
-    parser_classes = [JSONParser]
+    parser_classes = [JSONParser, MessagePackParser]
 
     def post(self, request):
         """Register a new driver."""
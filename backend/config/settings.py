@@ -56,7 +56,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "transactions.middleware.MetricsMiddleware",
+    "transactions.middleware.ServerTimingMiddleware",
     "django.middleware.security.SecurityMiddleware",
+    "transactions.middleware.CompressionMiddleware",
     "whitenoise.middleware.WhiteNoiseMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -94,6 +97,26 @@ DATABASES = {
     'default': dj_database_url.config(default=os.environ.get('DATABASE_URL', f'sqlite:///{BASE_DIR / "db.sqlite3"}'))
 }
 
+# Read replicas (transactions.replicas): comma-separated database URLs,
+# added as replica1, replica2, ... Summaries, lists, exports and analytics
+# read from them; writes and SMS ingestion stay on the primary. A user's
+# reads stay on the primary for STICKY_SECONDS after their data changes, and
+# an unreachable (or, on PostgreSQL, further behind) replica is skipped for
+# RETRY_SECONDS. Locally, point one at a second SQLite file and copy the
+# primary into it with `manage.py refresh_replica`
+DATABASE_REPLICAS = {
+    'ALIASES': [],
+    'STICKY_SECONDS': int(os.environ.get('REPLICA_STICKY_SECONDS', '10')),
+    'RETRY_SECONDS': int(os.environ.get('REPLICA_RETRY_SECONDS', '30')),
+    'CHECK_INTERVAL': int(os.environ.get('REPLICA_CHECK_INTERVAL', '5')),
+}
+for index, url in enumerate(filter(None, os.environ.get('DATABASE_REPLICA_URLS', '').split(',')), start=1):
+    alias = f'replica{index}'
+    # Tests never create a database for a replica; the suite reads from the primary
+    DATABASES[alias] = {**dj_database_url.parse(url.strip()), 'TEST': {'MIRROR': 'default'}}
+    DATABASE_REPLICAS['ALIASES'].append(alias)
+DATABASE_ROUTERS = ['transactions.replicas.ReplicaRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
@@ -141,15 +164,142 @@ CORS_ALLOWED_ORIGINS = os.environ.get(
 
 # Django REST Framework settings
 REST_FRAMEWORK = {
+    # JWTAuthentication that reports its time to the Server-Timing header
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'transactions.timing.TimedJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
     ),
     'DEFAULT_PARSER_CLASSES': (
         'rest_framework.parsers.JSONParser',
+        'transactions.parsers.MessagePackParser',
     ),
+    # orjson-backed JSON; falls back to DRF's encoder when orjson is missing.
+    # Mobile clients may ask for Accept: application/msgpack (integer money
+    # in minor units, epoch-millisecond timestamps)
+    'DEFAULT_RENDERER_CLASSES': (
+        'transactions.renderers.FastJSONRenderer',
+        'transactions.renderers.MessagePackRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    # Keyset pagination on (created_at, id); clients may pass ?page_size=N
+    # (capped) or ?page_size=all for the legacy unpaginated list
+    'DEFAULT_PAGINATION_CLASS': 'transactions.pagination.KeysetPagination',
+    'PAGE_SIZE': int(os.environ.get('API_PAGE_SIZE', '50')),
+}
+
+# Upper bound on items accepted by POST /api/transactions/bulk/
+TRANSACTION_BULK_MAX_ITEMS = int(os.environ.get('TRANSACTION_BULK_MAX_ITEMS', '5000'))
+
+# How long a stored Idempotency-Key response is replayed for retries
+IDEMPOTENCY_KEY_TTL_HOURS = int(os.environ.get('IDEMPOTENCY_KEY_TTL_HOURS', '24'))
+# How long a key stays reserved for a request that never finished (a killed
+# or timed-out worker); a few times gunicorn's 30s worker timeout
+IDEMPOTENCY_PENDING_LEASE_SECONDS = int(os.environ.get('IDEMPOTENCY_PENDING_LEASE_SECONDS', '120'))
+
+# Per-worker Bloom filter over stored tx_ids (transactions.txfilter); sized
+# to at least twice the Transaction table when it warms up
+TX_ID_FILTER = {
+    'ENABLED': os.environ.get('TX_ID_FILTER_ENABLED', 'True').lower() == 'true',
+    'CAPACITY': int(os.environ.get('TX_ID_FILTER_CAPACITY', '1000000')),
+    'ERROR_RATE': float(os.environ.get('TX_ID_FILTER_ERROR_RATE', '0.001')),
+}
+
+# Delta sync (GET /api/sync/): rows newer than the settle window are held
+# back until the next call so late-committing writes are never skipped;
+# tombstones older than the retention window are purged by purge_tombstones
+# and clients with older cursors must resync from scratch
+SYNC_PAGE_SIZE = int(os.environ.get('SYNC_PAGE_SIZE', '500'))
+SYNC_MAX_PAGE_SIZE = 5000
+SYNC_SETTLE_SECONDS = int(os.environ.get('SYNC_SETTLE_SECONDS', '2'))
+SYNC_TOMBSTONE_RETENTION_DAYS = int(os.environ.get('SYNC_TOMBSTONE_RETENTION_DAYS', '90'))
+
+# Brotli/gzip compression of non-streaming responses at least MIN_SIZE
+# bytes long (transactions.middleware.CompressionMiddleware)
+RESPONSE_COMPRESSION = {
+    'ENABLED': os.environ.get('RESPONSE_COMPRESSION_ENABLED', 'True').lower() == 'true',
+    'MIN_SIZE': int(os.environ.get('RESPONSE_COMPRESSION_MIN_SIZE', '1024')),
+    'GZIP_LEVEL': 6,
+    'BROTLI_QUALITY': 4,
+}
+
+# Server-Timing header (auth, view, serializer, sql, render and total) on a
+# sampled share of requests (transactions.middleware.ServerTimingMiddleware):
+# 0 disables it, 1 times every request. LOG also writes one JSON line per
+# sampled request to the transactions logger
+SERVER_TIMING = {
+    'SAMPLE_RATE': float(os.environ.get('SERVER_TIMING_SAMPLE_RATE', '0')),
+    'LOG': os.environ.get('SERVER_TIMING_LOG', 'False').lower() == 'true',
+}
+
+# Prometheus metrics (GET /api/metrics/, transactions.metrics). With several
+# worker processes set METRICS_DIR: each worker writes its counters there
+# every FLUSH_INTERVAL seconds and a scrape sums them (start.sh empties it
+# on boot). Prometheus authenticates with "Authorization: Bearer
+# <METRICS_TOKEN>"; staff users' JWTs are accepted too
+METRICS = {
+    'DIRECTORY': os.environ.get('METRICS_DIR') or None,
+    'FLUSH_INTERVAL': float(os.environ.get('METRICS_FLUSH_INTERVAL', '5')),
+    'TOKEN': os.environ.get('METRICS_TOKEN') or None,
+}
+
+# Rows fetched per server-side cursor round trip by GET /api/export/
+EXPORT_CHUNK_SIZE = int(os.environ.get('EXPORT_CHUNK_SIZE', '2000'))
+
+# Most buckets GET /api/summary/timeseries/ returns in one response
+TIMESERIES_MAX_BUCKETS = int(os.environ.get('TIMESERIES_MAX_BUCKETS', '1000'))
+
+# List endpoints encode value rows directly instead of going through the
+# serializer (transactions.rows); output is identical, set False to compare
+FAST_LIST_SERIALIZATION = os.environ.get('FAST_LIST_SERIALIZATION', 'True').lower() == 'true'
+
+# Timezone for drivers who have not set one (PATCH /api/profile/); decides
+# where "today", "this week" and "this month" start in summaries
+DEFAULT_USER_TIMEZONE = os.environ.get('DEFAULT_USER_TIMEZONE', 'Africa/Accra')
+
+# Dashboard (GET /api/dashboard/): how many recent transactions and expenses
+# it embeds by default (?limit=) and the most a client may ask for
+DASHBOARD_RECENT_ITEMS = int(os.environ.get('DASHBOARD_RECENT_ITEMS', '20'))
+DASHBOARD_MAX_RECENT_ITEMS = 100
+
+# Cache backend. The per-user data version behind the summary cache and the
+# ETags lives here, so set REDIS_URL when running more than one worker
+# process (needs the redis package); the default is per-process memory.
+REDIS_URL = os.environ.get('REDIS_URL')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Summary push stream (GET /api/stream/summary/, served through ASGI). The
+# in-process broker only reaches streams in the worker that handled the
+# write; use transactions.events.RedisBroker with several workers.
+SUMMARY_EVENTS_BROKER = os.environ.get(
+    'SUMMARY_EVENTS_BROKER',
+    'transactions.events.RedisBroker' if REDIS_URL else 'transactions.events.InProcessBroker',
+)
+SUMMARY_STREAM_HEARTBEAT = int(os.environ.get('SUMMARY_STREAM_HEARTBEAT', '15'))
+SUMMARY_STREAM_MAX_PER_USER = int(os.environ.get('SUMMARY_STREAM_MAX_PER_USER', '5'))
+# Lifetime of the single-use tokens EventSource clients pass as ?token=
+SUMMARY_STREAM_TOKEN_LIFETIME = int(os.environ.get('SUMMARY_STREAM_TOKEN_LIFETIME', '60'))
+
+# Summary result cache (transactions.cache). Entries are keyed by the user's
+# data version, which lives in the default CACHES backend; point CACHES at a
+# shared backend when running several workers.
+SUMMARY_CACHE = {
+    'ENABLED': os.environ.get('SUMMARY_CACHE_ENABLED', 'True').lower() == 'true',
+    'MAX_ENTRIES': int(os.environ.get('SUMMARY_CACHE_MAX_ENTRIES', '2048')),
+    'TTL': int(os.environ.get('SUMMARY_CACHE_TTL', '300')),
 }
 
 # JWT settings
@@ -8,8 +8,10 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 django.setup()
 
+from transactions import rollups
 from transactions.models import Transaction, Expense
 from django.contrib.auth.models import User
+from django.db import transaction
 import datetime
 
 def create_sample_data():
@@ -30,7 +32,11 @@ def create_sample_data():
     ]
 
     for data in transactions_data:
-        tx, created = Transaction.objects.get_or_create(tx_id=data['tx_id'], defaults={**data, 'user': user, 'created_at': datetime.datetime.now()})
+        # Rows and their rollup/debt ledger updates land together, as in the API
+        with transaction.atomic():
+            tx, created = Transaction.objects.get_or_create(tx_id=data['tx_id'], defaults={**data, 'user': user, 'created_at': datetime.datetime.now()})
+            if created:
+                rollups.apply_transaction(tx)
         if created:
             print(f'Created transaction {data["tx_id"]}')
 
@@ -43,12 +49,15 @@ def create_sample_data():
     ]
 
     for data in expenses_data:
-        exp, created = Expense.objects.get_or_create(
-            user=user,
-            amount=data['amount'],
-            category=data['category'],
-            defaults={'description': data['description'], 'created_at': datetime.datetime.now()}
-        )
+        with transaction.atomic():
+            exp, created = Expense.objects.get_or_create(
+                user=user,
+                amount=data['amount'],
+                category=data['category'],
+                defaults={'description': data['description'], 'created_at': datetime.datetime.now()}
+            )
+            if created:
+                rollups.apply_expense(exp)
         if created:
             print(f'Created expense {data["category"]}')
 
@@ -0,0 +1,25 @@
+"""
+Gunicorn server hooks (see start.sh).
+
+post_worker_init runs in each worker once the application is loaded and
+before it accepts requests: the per-worker tx_id filter
+(transactions.txfilter) is warmed there, so the first write request does not
+read the whole tx_id column while holding the filter's lock.
+"""
+import logging
+
+logger = logging.getLogger('gunicorn.error')
+
+
+def post_worker_init(worker):
+    from django.db import DatabaseError, connections
+    from transactions.txfilter import tx_id_filter
+
+    try:
+        tx_id_filter.preload()
+    except DatabaseError as exc:
+        # Not fatal: the filter warms on first use instead
+        logger.warning(f"tx_id filter not warmed at boot: {exc}")
+    finally:
+        # Requests open their own connections
+        connections.close_all()
@@ -2,5 +2,12 @@
 # Run migrations
 python manage.py migrate --noinput
 
-# Start the application
-gunicorn --bind 0.0.0.0:8000 config.wsgi:application
\ No newline at end of file
+# Every worker writes its metrics here and GET /api/metrics/ sums the files;
+# start empty so a previous run's workers are not counted again
+export METRICS_DIR="${METRICS_DIR:-/tmp/sidekick-metrics}"
+rm -rf "$METRICS_DIR"
+mkdir -p "$METRICS_DIR"
+
+# Start the application (ASGI, so summary streams do not pin a worker each);
+# gunicorn.conf.py warms each worker's tx_id filter before it takes requests
+gunicorn -c gunicorn.conf.py --bind 0.0.0.0:8000 -k uvicorn.workers.UvicornWorker config.asgi:application
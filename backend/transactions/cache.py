@@ -0,0 +1,123 @@
+"""
+Per-user summary result cache.
+
+Summary results are stored in a small in-process LRU keyed by user, range
+and the user's data version. Ranges are absolute (aware datetimes resolved
+in the driver's timezone, see transactions.periods), so the result does not
+depend on a timezone of its own. The version lives in Django's cache
+framework and is bumped after every committed Transaction/Expense write (see
+transactions.signals), so stale entries are never read again and simply age
+out. Configure a shared CACHES backend (Redis, Memcached) when running
+several workers so that a write in one worker invalidates the others.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+
+from . import metrics, rollups
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = 'summary-version:{user_id}'
+
+
+def get_user_version(user_id):
+    """Current data version for a user, without touching the database."""
+    key = VERSION_KEY.format(user_id=user_id)
+    version = cache.get(key)
+    if version is None:
+        # Seed from the clock so a version evicted from the cache can never
+        # come back with a value an older cache entry was stored under
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_user_version(user_id):
+    """Invalidate every cached summary for a user."""
+    key = VERSION_KEY.format(user_id=user_id)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        version = time.time_ns()
+        cache.set(key, version, timeout=None)
+        return version
+
+
+class SummaryCache:
+    """Thread-safe LRU cache with a per-entry TTL and hit/miss counters."""
+
+    def __init__(self, max_entries=2048, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._entries),
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+            }
+
+
+_config = getattr(settings, 'SUMMARY_CACHE', {})
+summary_cache = SummaryCache(
+    max_entries=_config.get('MAX_ENTRIES', 2048),
+    ttl=_config.get('TTL', 300),
+)
+metrics.register_collector(lambda: [
+    ('sidekick_cache_requests_total', {'cache': 'summary', 'result': 'hit'}, summary_cache.hits),
+    ('sidekick_cache_requests_total', {'cache': 'summary', 'result': 'miss'}, summary_cache.misses),
+])
+
+
+def cached_summarize(user, start, end):
+    """rollups.summarize() served from summary_cache when the user's data is unchanged."""
+    if not _config.get('ENABLED', True):
+        return rollups.summarize(user, start, end)
+
+    key = (user.id, get_user_version(user.id), start.isoformat(), end.isoformat())
+    summary = summary_cache.get(key)
+    if summary is None:
+        summary = rollups.summarize(user, start, end)
+        summary_cache.set(key, summary)
+    else:
+        logger.debug(f"Summary cache hit for user {user.id}")
+    return summary
@@ -0,0 +1,59 @@
+"""
+Conditional GET support (ETag / If-None-Match).
+
+ETags are derived from the user's data version (transactions.cache), which is
+bumped after every Transaction/Expense write, plus whatever else shapes the
+response (path, query string, negotiated format). Answering a matching
+If-None-Match therefore needs neither a query nor serialization.
+"""
+import hashlib
+
+from django.utils.http import parse_etags
+from rest_framework.response import Response
+
+from . import metrics
+from .cache import get_user_version
+
+
+def user_etag(request, scope, *parts):
+    """Strong ETag for `scope` that changes whenever the user's data does."""
+    raw = '|'.join(str(part) for part in (
+        scope,
+        request.user.id,
+        get_user_version(request.user.id),
+        request.get_full_path(),
+        request.META.get('HTTP_ACCEPT', ''),
+        *parts,
+    ))
+    return '"%s"' % hashlib.sha256(raw.encode('utf-8')).hexdigest()[:32]
+
+
+def etag_matches(request, etag):
+    header = request.META.get('HTTP_IF_NONE_MATCH')
+    if not header:
+        return False
+    etags = parse_etags(header)
+    if '*' in etags:
+        return True
+    # If-None-Match uses weak comparison; compressed responses carry W/ tags
+    return etag.removeprefix('W/') in {tag.removeprefix('W/') for tag in etags}
+
+
+def conditional_response(request, scope, handler, *parts):
+    """
+    Return 304 Not Modified if the client already holds the current
+    representation, otherwise handler()'s response tagged with its ETag.
+    """
+    etag = user_etag(request, scope, *parts)
+    if etag_matches(request, etag):
+        metrics.cache_requests.inc(cache='etag', result='hit')
+        response = Response(status=304)
+    else:
+        metrics.cache_requests.inc(cache='etag', result='miss')
+        response = handler()
+        if response.status_code != 200:
+            return response
+    response['ETag'] = etag
+    # Clients may keep the body but must revalidate before reusing it
+    response['Cache-Control'] = 'private, no-cache'
+    return response
@@ -0,0 +1,145 @@
+"""
+Per-user change notifications.
+
+notify_change() is called after every committed Transaction/Expense write.
+It invalidates the user's cached summaries and publishes a message on the
+configured broker, which wakes the user's open summary streams
+(transactions.streams).
+
+The broker is pluggable through SUMMARY_EVENTS_BROKER. InProcessBroker only
+reaches streams held by the same worker process; RedisBroker (requires the
+redis package and REDIS_URL) fans out across processes and hosts.
+"""
+import asyncio
+import json
+import logging
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .cache import bump_user_version
+from .replicas import mark_recent_write
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription:
+    """A single stream's inbox. Messages coalesce: only "something changed" matters."""
+
+    def __init__(self, broker, user_id):
+        self.broker = broker
+        self.user_id = user_id
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=1)
+
+    def deliver(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            pass
+
+    async def get(self, timeout):
+        """Next message, or None if nothing arrived within timeout seconds."""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def close(self):
+        self.broker.unsubscribe(self)
+
+
+class InProcessBroker:
+    """Fan-out to subscriptions held by this process."""
+
+    def __init__(self):
+        self._subscriptions = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def publish(self, user_id, message):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(user_id, ()))
+        for subscription in subscriptions:
+            # Writes happen on worker threads; hand over to the stream's loop
+            subscription.loop.call_soon_threadsafe(subscription.deliver, message)
+
+    async def subscribe(self, user_id):
+        subscription = Subscription(self, user_id)
+        with self._lock:
+            self._subscriptions[user_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscriptions.get(subscription.user_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscriptions[subscription.user_id]
+
+    def subscriber_count(self, user_id=None):
+        with self._lock:
+            if user_id is not None:
+                return len(self._subscriptions.get(user_id, ()))
+            return sum(len(subscribers) for subscribers in self._subscriptions.values())
+
+
+class RedisBroker(InProcessBroker):
+    """
+    Publishes through Redis pub/sub so streams in every worker are reached.
+
+    Each process runs one listener task over a pattern subscription and
+    hands messages to its local subscriptions.
+    """
+    CHANNEL = 'sidekick:user-changes:{user_id}'
+
+    def __init__(self, url=None):
+        super().__init__()
+        import redis  # optional dependency, only needed for this backend
+
+        self.url = url or settings.REDIS_URL
+        self._client = redis.Redis.from_url(self.url)
+        self._listener = None
+
+    def publish(self, user_id, message):
+        self._client.publish(self.CHANNEL.format(user_id=user_id), json.dumps(message))
+
+    async def subscribe(self, user_id):
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.get_running_loop().create_task(self._listen())
+        return await super().subscribe(user_id)
+
+    async def _listen(self):
+        import redis.asyncio
+
+        client = redis.asyncio.Redis.from_url(self.url)
+        pubsub = client.pubsub()
+        await pubsub.psubscribe(self.CHANNEL.format(user_id='*'))
+        async for item in pubsub.listen():
+            if item['type'] != 'pmessage':
+                continue
+            user_id = int(item['channel'].decode().rsplit(':', 1)[1])
+            super().publish(user_id, json.loads(item['data']))
+
+
+_broker = None
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        _broker = import_string(getattr(settings, 'SUMMARY_EVENTS_BROKER', 'transactions.events.InProcessBroker'))()
+    return _broker
+
+
+def notify_change(user_id):
+    """Invalidate cached summaries and wake the user's streams. Call after commit."""
+    mark_recent_write(user_id)
+    version = bump_user_version(user_id)
+    try:
+        get_broker().publish(user_id, {'user_id': user_id, 'version': version})
+    except Exception as e:
+        # Streams fall back to their heartbeat refresh; never fail the write
+        logger.error(f"Failed to publish change for user {user_id}: {e}")
@@ -0,0 +1,172 @@
+"""
+Streaming ledger export (GET /api/export/).
+
+A user's transactions and expenses are read through server-side cursors
+(QuerySet.iterator), merged by (created_at, id) and written out as CSV or
+NDJSON a batch of rows at a time, so memory stays flat however long the
+history is and the first bytes go out before the whole ledger is read.
+"""
+import csv
+import heapq
+import io
+import json
+import logging
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import models
+
+from .models import Expense, Transaction
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+TRANSACTION_FIELDS = (
+    'id', 'created_at', 'tx_id', 'platform', 'amount_received', 'rider_profit', 'platform_debt',
+    'is_tip', 'tip_amount', 'trip_price', 'bonuses', 'system_fees', 'gross_total',
+)
+EXPENSE_FIELDS = ('id', 'created_at', 'category', 'amount', 'description')
+CSV_COLUMNS = ('type',) + TRANSACTION_FIELDS + tuple(f for f in EXPENSE_FIELDS if f not in TRANSACTION_FIELDS)
+# Free text a spreadsheet could otherwise evaluate as a formula
+TEXT_FIELDS = ('tx_id', 'description')
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def _format_decimal(value):
+    return None if value is None else f'{value:f}'
+
+
+def _format_datetime(value):
+    if value is None:
+        return None
+    value = value.isoformat()
+    return value[:-6] + 'Z' if value.endswith('+00:00') else value
+
+
+def _formatters(model, fields):
+    formatters = []
+    for name in fields:
+        field = model._meta.get_field(name)
+        if isinstance(field, models.DecimalField):
+            formatters.append(_format_decimal)
+        elif isinstance(field, models.DateTimeField):
+            formatters.append(_format_datetime)
+        else:
+            formatters.append(None)
+    return formatters
+
+
+def _rows(queryset, kind, fields):
+    """(created_at, id, kind, values) per row, values formatted for output in `fields` order."""
+    formatters = _formatters(queryset.model, fields)
+    for values in queryset.values_list(*fields).iterator(chunk_size=export_chunk_size()):
+        formatted = tuple(
+            value if format_value is None else format_value(value)
+            for format_value, value in zip(formatters, values)
+        )
+        yield values[1], values[0], kind, formatted
+
+
+def ledger(user, start=None, end=None, using=None):
+    """
+    The user's transactions and expenses, oldest first, as (kind, values)
+    pairs with values in TRANSACTION_FIELDS or EXPENSE_FIELDS order, read
+    from the `using` database (default: the router's choice).
+    """
+    filters = {'user': user}
+    if start is not None:
+        filters['created_at__gte'] = start
+    if end is not None:
+        filters['created_at__lt'] = end
+    transactions = Transaction.objects.using(using).filter(**filters).order_by('created_at', 'id')
+    expenses = Expense.objects.using(using).filter(**filters).order_by('created_at', 'id')
+    merged = heapq.merge(
+        _rows(transactions, 'transaction', TRANSACTION_FIELDS),
+        _rows(expenses, 'expense', EXPENSE_FIELDS),
+        key=lambda row: row[:3],
+    )
+    for _, _, kind, values in merged:
+        yield kind, values
+
+
+def export_chunk_size():
+    return getattr(settings, 'EXPORT_CHUNK_SIZE', 2000)
+
+
+def _csv_chunks(records, batch_size):
+    # Position of each model field in a CSV row
+    positions = {
+        'transaction': [CSV_COLUMNS.index(name) for name in TRANSACTION_FIELDS],
+        'expense': [CSV_COLUMNS.index(name) for name in EXPENSE_FIELDS],
+    }
+    text_positions = {
+        kind: [i for i, name in enumerate(fields) if name in TEXT_FIELDS]
+        for kind, fields in (('transaction', TRANSACTION_FIELDS), ('expense', EXPENSE_FIELDS))
+    }
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_COLUMNS)
+    # The header goes out before the first query runs
+    yield buffer.getvalue().encode('utf-8')
+    while True:
+        batch = list(islice(records, batch_size))
+        if not batch:
+            return
+        buffer.seek(0)
+        buffer.truncate()
+        for kind, values in batch:
+            for i in text_positions[kind]:
+                if values[i] and values[i].startswith(FORMULA_PREFIXES):
+                    values = values[:i] + ("'" + values[i],) + values[i + 1:]
+            row = [kind] + [None] * (len(CSV_COLUMNS) - 1)
+            for position, value in zip(positions[kind], values):
+                row[position] = value
+            writer.writerow(row)
+        yield buffer.getvalue().encode('utf-8')
+
+
+def _ndjson_chunks(records, batch_size):
+    keys = {'transaction': ('type',) + TRANSACTION_FIELDS, 'expense': ('type',) + EXPENSE_FIELDS}
+    while True:
+        batch = list(islice(records, batch_size))
+        if not batch:
+            return
+        yield ''.join(
+            json.dumps(dict(zip(keys[kind], (kind,) + values)), separators=(',', ':')) + '\n'
+            for kind, values in batch
+        ).encode('utf-8')
+
+
+def export_chunks(user, fmt, start=None, end=None, batch_size=500, using=None):
+    """Encoded byte chunks of the user's ledger in `fmt` (a key of FORMATS)."""
+    records = ledger(user, start, end, using)
+    chunks = _csv_chunks(records, batch_size) if fmt == 'csv' else _ndjson_chunks(records, batch_size)
+    count = 0
+    try:
+        for chunk in chunks:
+            count += 1
+            yield chunk
+    finally:
+        # Also runs when the client disconnects and the generator is closed
+        records.close()
+        logger.info(f"Export for user {user.id} ({fmt}) finished after {count} chunk(s)")
+
+
+async def aiter_chunks(chunks):
+    """
+    Serve a sync chunk generator from an async iterator, so ASGI streams it
+    instead of buffering it. Every step runs in the same thread, which keeps
+    the server-side cursors on one database connection.
+    """
+    try:
+        while True:
+            chunk = await sync_to_async(next)(chunks, None)
+            if chunk is None:
+                return
+            yield chunk
+    finally:
+        await sync_to_async(chunks.close)()
@@ -0,0 +1,111 @@
+"""
+Idempotency-Key support for write endpoints.
+
+A client that sends an Idempotency-Key header gets the stored response of the
+first successful request with that key replayed on every retry. The key is
+reserved (a pending row under unique_idempotency_key) before the write runs,
+so concurrent retries cannot both perform it. A reservation whose request
+never finished is taken over after IDEMPOTENCY_PENDING_LEASE_SECONDS.
+"""
+import hashlib
+import json
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+logger = logging.getLogger(__name__)
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+
+def _fingerprint(request):
+    payload = json.dumps(request.data, sort_keys=True, cls=DjangoJSONEncoder)
+    message = f"{request.method}:{request.path}:{payload}"
+    return hashlib.sha256(message.encode('utf-8')).hexdigest()
+
+
+def key_ttl():
+    return timedelta(hours=getattr(settings, 'IDEMPOTENCY_KEY_TTL_HOURS', 24))
+
+
+def pending_lease():
+    return timedelta(seconds=getattr(settings, 'IDEMPOTENCY_PENDING_LEASE_SECONDS', 120))
+
+
+def _expired(record):
+    lifetime = pending_lease() if record.response_status is None else key_ttl()
+    return record.created_at < timezone.now() - lifetime
+
+
+def _reserve(user, key, fingerprint):
+    """
+    Insert a pending row for (user, key). Returns (record, True) when this
+    request holds the key, or (existing record, False) when another does.
+    """
+    for attempt in range(2):
+        try:
+            with transaction.atomic():
+                return IdempotencyKey.objects.create(user=user, key=key, fingerprint=fingerprint), True
+        except IntegrityError:
+            record = IdempotencyKey.objects.filter(user=user, key=key).first()
+            if record is None and not attempt:
+                # Released by a failed request in between
+                continue
+            if record is not None and _expired(record) and not attempt:
+                # Expired keys, and reservations abandoned by a dead worker, can be used again
+                record.delete()
+                continue
+            return record, False
+    return None, False
+
+
+def idempotent_response(request, user, handler):
+    """
+    Run handler() once per (user, Idempotency-Key) and replay its response.
+
+    Requests without the header, or without a resolved user, just run the
+    handler. Reusing a key with a different payload is rejected with 422, and
+    a retry that arrives while the first request still runs with 409.
+    """
+    key = request.headers.get(HEADER)
+    if not key or user is None:
+        return handler()
+    if len(key) > MAX_KEY_LENGTH:
+        return Response({'error': f'{HEADER} must be at most {MAX_KEY_LENGTH} characters'}, status=400)
+
+    fingerprint = _fingerprint(request)
+    record, reserved = _reserve(user, key, fingerprint)
+    if not reserved:
+        if record is not None and record.fingerprint != fingerprint:
+            return Response({'error': f'{HEADER} was already used for a different request'}, status=422)
+        if record is None or record.response_status is None:
+            logger.info(f"{HEADER} {key} is still in progress for user {user.id}")
+            return Response({'error': f'A request with this {HEADER} is still in progress'}, status=409)
+        logger.info(f"Replaying stored response for {HEADER} {key} (user {user.id})")
+        response = Response(record.response_body, status=record.response_status)
+        response['Idempotent-Replayed'] = 'true'
+        return response
+
+    try:
+        response = handler()
+    except Exception:
+        record.delete()
+        raise
+    if 200 <= response.status_code < 300:
+        stored = IdempotencyKey.objects.filter(pk=record.pk).update(
+            response_status=response.status_code, response_body=response.data,
+        )
+        if not stored:
+            logger.warning(f"{HEADER} {key} outlived its lease and was taken over by a retry (user {user.id})")
+    else:
+        # Only successful responses are replayed; a corrected retry may reuse the key
+        record.delete()
+    return response
@@ -0,0 +1,236 @@
+"""
+Bulk transaction ingestion.
+
+Used by the SMS backlog sync endpoint (POST /api/transactions/bulk/) and the
+import_transactions command: items are validated in one pass, de-duplicated
+against the batch and the database with a single tx_id lookup, and inserted
+with bulk_create (or COPY on PostgreSQL, see copy_transactions).
+"""
+import csv
+import io
+import logging
+
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+from rest_framework import serializers
+
+from . import metrics, rollups
+from .events import notify_change
+from .models import Transaction
+from .serializers import TransactionSerializer
+from .txfilter import tx_id_filter
+
+logger = logging.getLogger(__name__)
+
+STATUS_CREATED = 'created'
+STATUS_DUPLICATE = 'duplicate'
+STATUS_INVALID = 'invalid'
+
+# Stay well under SQLite's bound-parameter limit
+LOOKUP_CHUNK_SIZE = 900
+
+
+def existing_tx_ids(tx_ids, user):
+    """
+    Map of tx_id -> id for the given tx_ids that are already stored. The id
+    is None when the row belongs to a different user.
+    """
+    tx_ids = list(tx_ids)
+    found = {}
+    for offset in range(0, len(tx_ids), LOOKUP_CHUNK_SIZE):
+        chunk = tx_ids[offset:offset + LOOKUP_CHUNK_SIZE]
+        for tx_id, pk, user_id in Transaction.objects.filter(tx_id__in=chunk).values_list('tx_id', 'id', 'user_id'):
+            found[tx_id] = pk if user_id == user.id else None
+    return found
+
+
+def validate_items(items, context=None):
+    """
+    Validate raw items with a single serializer instance.
+
+    Returns (validated, errors): validated maps item index -> validated data,
+    errors maps item index -> error detail.
+    """
+    child = TransactionSerializer(context=context or {})
+    validated = {}
+    errors = {}
+    for index, item in enumerate(items):
+        try:
+            validated[index] = child.run_validation(item)
+        except serializers.ValidationError as exc:
+            errors[index] = exc.detail
+    return validated, errors
+
+
+def _build(user, data):
+    data = dict(data)
+    data.pop('request_hash', None)
+    if data.get('created_at') is None:
+        data['created_at'] = timezone.now()
+    # bulk_create skips Transaction.save, so apply its department mapping here
+    data['department'] = Transaction.department_for(data.get('platform', 'YANGO'))
+    return Transaction(user=user, **data)
+
+
+def insert_transactions(user, validated, batch_size=500):
+    """
+    Insert validated transactions for user, skipping tx_ids already stored.
+
+    validated maps item index -> validated data. Returns a map of item index ->
+    (status, id). Rollups are updated and the user's summary cache invalidated
+    in the same database transaction.
+    """
+    for attempt in range(2):
+        outcome = {}
+        first_index = {}
+        candidates = {data['tx_id'] for data in validated.values()}
+        if attempt == 0 and tx_id_filter.enabled:
+            # Only tx_ids the filter may have seen need the duplicate lookup
+            candidates = {tx_id for tx_id in candidates if tx_id_filter.might_contain(tx_id)}
+        existing = existing_tx_ids(candidates, user) if candidates else {}
+        if attempt == 0 and tx_id_filter.enabled:
+            for _ in candidates - existing.keys():
+                tx_id_filter.record_false_positive()
+        new_rows = []
+        for index, data in validated.items():
+            tx_id = data['tx_id']
+            if tx_id in existing:
+                outcome[index] = (STATUS_DUPLICATE, existing[tx_id])
+            elif tx_id in first_index:
+                outcome[index] = (STATUS_DUPLICATE, None)
+            else:
+                first_index[tx_id] = index
+                new_rows.append((index, _build(user, data)))
+
+        try:
+            with transaction.atomic():
+                created = Transaction.objects.bulk_create(
+                    [row for _, row in new_rows], batch_size=batch_size
+                )
+                rollups.apply_transactions(created)
+                if created:
+                    transaction.on_commit(lambda: notify_change(user.id))
+        except IntegrityError:
+            # A concurrent request (or another worker the filter doesn't know
+            # about) inserted one of our tx_ids; look all of them up and retry once
+            if attempt:
+                raise
+            logger.warning(f"Bulk insert for user {user.id} raced on tx_id, retrying")
+            continue
+        break
+
+    ids = {}
+    for index, row in new_rows:
+        outcome[index] = (STATUS_CREATED, row.pk)
+        ids[row.tx_id] = row.pk
+        tx_id_filter.add(row.tx_id)
+    for index, (status, pk) in outcome.items():
+        if pk is None and validated[index]['tx_id'] in ids:
+            outcome[index] = (status, ids[validated[index]['tx_id']])
+    _count(outcome)
+    return outcome
+
+
+COPY_COLUMNS = (
+    'user_id', 'tx_id', 'amount_received', 'trip_price', 'bonuses', 'system_fees', 'gross_total',
+    'rider_profit', 'platform_debt', 'platform', 'department', 'is_tip', 'tip_amount',
+    'created_at', 'updated_at',
+)
+
+
+def _copy_rows(cursor, sql, buffer):
+    if hasattr(cursor.cursor, 'copy_expert'):
+        cursor.cursor.copy_expert(sql, buffer)  # psycopg2
+    else:
+        with cursor.cursor.copy(sql) as copy:  # psycopg 3
+            copy.write(buffer.getvalue())
+
+
+def copy_transactions(user, validated):
+    """
+    PostgreSQL counterpart of insert_transactions for large imports.
+
+    Rows are streamed with COPY into a temporary staging table and moved
+    over with INSERT ... ON CONFLICT (tx_id) DO NOTHING, so duplicates
+    (including ones inserted concurrently) are skipped by the database.
+    Returns the same index -> (status, id) map; duplicates have id None.
+    """
+    outcome = {}
+    new_rows = {}
+    for index, data in validated.items():
+        if data['tx_id'] in new_rows:
+            outcome[index] = (STATUS_DUPLICATE, None)
+        else:
+            new_rows[data['tx_id']] = (index, _build(user, data))
+
+    now = timezone.now()
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for _, row in new_rows.values():
+        row.updated_at = now
+        # None is written as an unquoted empty field, which COPY reads as NULL
+        writer.writerow([getattr(row, column) for column in COPY_COLUMNS])
+    buffer.seek(0)
+
+    quote = connection.ops.quote_name
+    table = quote(Transaction._meta.db_table)
+    columns = ', '.join(quote(column) for column in COPY_COLUMNS)
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE TEMP TABLE transaction_import ON COMMIT DROP AS "
+                f"SELECT {columns} FROM {table} WITH NO DATA"
+            )
+            _copy_rows(cursor, f"COPY transaction_import ({columns}) FROM STDIN WITH (FORMAT csv)", buffer)
+            cursor.execute(
+                f"INSERT INTO {table} ({columns}) SELECT {columns} FROM transaction_import "
+                f"ON CONFLICT ({quote('tx_id')}) DO NOTHING RETURNING {quote('id')}, {quote('tx_id')}"
+            )
+            inserted = cursor.fetchall()
+
+        created = []
+        for pk, tx_id in inserted:
+            index, row = new_rows[tx_id]
+            row.pk = pk
+            created.append(row)
+            outcome[index] = (STATUS_CREATED, pk)
+        rollups.apply_transactions(created)
+        if created:
+            transaction.on_commit(lambda: notify_change(user.id))
+
+    for index, _ in new_rows.values():
+        outcome.setdefault(index, (STATUS_DUPLICATE, None))
+    for row in created:
+        tx_id_filter.add(row.tx_id)
+    _count(outcome)
+    return outcome
+
+
+def _count(outcome):
+    created = sum(1 for status, _ in outcome.values() if status == STATUS_CREATED)
+    metrics.transactions_ingested.inc(created, path='bulk')
+    metrics.transaction_duplicates.inc(len(outcome) - created, path='bulk')
+
+
+def bulk_ingest_transactions(user, items, context=None, batch_size=500):
+    """Validate, de-duplicate and insert items; returns one result per item, in order."""
+    validated, errors = validate_items(items, context)
+    outcome = insert_transactions(user, validated, batch_size=batch_size)
+
+    results = []
+    for index in range(len(items)):
+        if index in errors:
+            results.append({'index': index, 'status': STATUS_INVALID, 'errors': errors[index]})
+        else:
+            status, pk = outcome[index]
+            results.append({
+                'index': index,
+                'status': status,
+                'id': pk,
+                'tx_id': validated[index]['tx_id'],
+            })
+    logger.info(
+        f"Bulk ingest for user {user.id}: {len(items)} items, "
+        f"{sum(1 for r in results if r['status'] == STATUS_CREATED)} created"
+    )
+    return results
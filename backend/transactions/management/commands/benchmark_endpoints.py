@@ -0,0 +1,378 @@
+import io
+import itertools
+import json
+import logging
+import math
+import subprocess
+import sys
+import time
+from collections import Counter, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from datetime import timedelta
+from importlib import import_module
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.core.wsgi import get_wsgi_application
+from django.db import connections
+from django.db.models import Count
+from django.urls import URLResolver, reverse
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from transactions.events import notify_change
+from transactions.models import DriverProfile, Expense, Transaction
+from transactions.periods import user_timezone
+from transactions.rollups import rebuild_debt_balances, rebuild_rollups
+
+URLCONFS = ('transactions.urls', 'api.urls')
+# Routes the harness cannot drive through WSGI, with the reason
+SKIPPED = {
+    'summary-stream': 'endless SSE stream, only served through ASGI (config.asgi)',
+}
+# Password hashing makes these deliberately slow; cap their request count
+HASHING_ROUTES = ('register_driver', 'token_obtain_pair')
+HASHING_MAX_REQUESTS = 20
+
+Scenario = namedtuple('Scenario', 'route method build auth prepare', defaults=('user', None))
+
+
+def _transaction(ctx, i):
+    return {
+        'tx_id': f'{ctx.prefix}-{next(ctx.counter)}', 'amount_received': '50.00', 'rider_profit': '40.00',
+        'platform_debt': '10.00', 'platform': 'BOLT', 'created_at': timezone.now().isoformat(),
+    }
+
+
+def _expense(ctx, i):
+    return {'amount': '12.50', 'category': 'FUEL', 'description': ctx.prefix, 'created_at': timezone.now().isoformat()}
+
+
+# In order: creates run before the deletes that consume their rows, and
+# registration before the login that uses a registered account
+SCENARIOS = (
+    Scenario('api-root', 'GET', lambda ctx, i: (reverse('api-root'), None)),
+    Scenario('transaction-list', 'GET', lambda ctx, i: (reverse('transaction-list'), None)),
+    Scenario('transaction-list', 'POST', lambda ctx, i: (reverse('transaction-list'), _transaction(ctx, i))),
+    Scenario('transaction-detail', 'GET', lambda ctx, i: (reverse('transaction-detail', args=[ctx.transaction.pk]), None)),
+    Scenario('transaction-detail', 'PATCH', lambda ctx, i: (
+        reverse('transaction-detail', args=[ctx.transaction.pk]), {'platform_debt': str(ctx.transaction.platform_debt)},
+    )),
+    Scenario('transaction-detail', 'DELETE', lambda ctx, i: (
+        reverse('transaction-detail', args=[ctx.pool[i % len(ctx.pool)]]), None,
+    ), prepare=lambda ctx: ctx.fill_pool(Transaction.objects.filter(tx_id__startswith=f'{ctx.prefix}-'))),
+    Scenario('transaction-bulk', 'POST', lambda ctx, i: (
+        reverse('transaction-bulk'), [_transaction(ctx, i) for _ in range(50)],
+    )),
+    Scenario('expense-list', 'GET', lambda ctx, i: (reverse('expense-list'), None)),
+    Scenario('expense-list', 'POST', lambda ctx, i: (reverse('expense-list'), _expense(ctx, i))),
+    Scenario('expense-detail', 'GET', lambda ctx, i: (reverse('expense-detail', args=[ctx.expense.pk]), None)),
+    Scenario('expense-detail', 'PATCH', lambda ctx, i: (
+        reverse('expense-detail', args=[ctx.expense.pk]), {'amount': str(ctx.expense.amount)},
+    )),
+    Scenario('expense-detail', 'DELETE', lambda ctx, i: (
+        reverse('expense-detail', args=[ctx.pool[i % len(ctx.pool)]]), None,
+    ), prepare=lambda ctx: ctx.fill_pool(Expense.objects.filter(description=ctx.prefix))),
+    Scenario('daily-summary', 'GET', lambda ctx, i: (reverse('daily-summary'), None)),
+    Scenario('period-summary', 'GET', lambda ctx, i: (f"{reverse('period-summary')}?period=this_month", None)),
+    Scenario('summary-timeseries', 'GET', lambda ctx, i: (
+        f"{reverse('summary-timeseries')}?bucket=day&start={ctx.month_ago}&end={ctx.today}", None,
+    )),
+    Scenario('dashboard', 'GET', lambda ctx, i: (reverse('dashboard'), None)),
+    Scenario('clear-debt', 'POST', lambda ctx, i: (reverse('clear-debt'), None)),
+    Scenario('profile', 'GET', lambda ctx, i: (reverse('profile'), None)),
+    Scenario('profile', 'PUT', lambda ctx, i: (reverse('profile'), {'timezone': ctx.timezone})),
+    # A month of history: whole-history exports are measured in rows/s, not latency
+    Scenario('export', 'GET', lambda ctx, i: (f"{reverse('export')}?format=csv&start={ctx.month_ago}", None)),
+    Scenario('sync', 'GET', lambda ctx, i: (f"{reverse('sync')}?limit=500", None)),
+    Scenario('stats', 'GET', lambda ctx, i: (reverse('stats'), None), auth='staff'),
+    Scenario('metrics', 'GET', lambda ctx, i: (reverse('metrics'), None), auth='staff'),
+    Scenario('health_check', 'GET', lambda ctx, i: (reverse('health_check'), None), auth=None),
+    Scenario('register_driver', 'POST', lambda ctx, i: (reverse('register_driver'), {
+        'email': f'{ctx.prefix}-{next(ctx.counter)}@example.com', 'password': ctx.password, 'password2': ctx.password,
+    }), auth=None),
+    Scenario('token_obtain_pair', 'POST', lambda ctx, i: (reverse('token_obtain_pair'), {
+        'username': ctx.login, 'password': ctx.password,
+    }), auth=None, prepare=lambda ctx: ctx.find_login()),
+    Scenario('token_refresh', 'POST', lambda ctx, i: (reverse('token_refresh'), {'refresh': ctx.refresh}), auth=None),
+)
+
+
+class Context:
+    """What the scenarios need to build their requests for one run."""
+
+    def __init__(self, user, staff):
+        self.user = user
+        self.prefix = f'bench-{int(time.time())}'
+        self.counter = itertools.count()
+        self.password = 'benchmark-password'
+        self.started = timezone.now()
+        self.today = self.started.date().isoformat()
+        self.month_ago = (self.started - timedelta(days=30)).date().isoformat()
+        self.transaction = Transaction.objects.filter(user=user).order_by('-created_at', '-id').first()
+        self.expense = Expense.objects.filter(user=user).order_by('-created_at', '-id').first()
+        if self.transaction is None or self.expense is None:
+            raise CommandError(f"User {user.id} needs at least one transaction and one expense; run seed_scale")
+        self.had_profile = DriverProfile.objects.filter(user=user).exists()
+        self.timezone = user_timezone(user).key
+        refresh = RefreshToken.for_user(user)
+        self.refresh = str(refresh)
+        self.tokens = {'user': str(refresh.access_token)}
+        if staff is not None:
+            self.tokens['staff'] = str(RefreshToken.for_user(staff).access_token)
+        self.pool = []
+        self.login = None
+
+    def fill_pool(self, queryset):
+        self.pool = list(queryset.filter(user=self.user).values_list('id', flat=True))
+        return bool(self.pool) or 'nothing left to delete (run the matching POST scenario first)'
+
+    def find_login(self):
+        self.login = User.objects.filter(username__startswith=f'{self.prefix}-').values_list('username', flat=True).first()
+        return self.login is not None or 'no account was registered (register_driver failed or was skipped)'
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive every route of transactions/urls.py and api/urls.py through the WSGI application at the "
+        "given concurrency and report latency percentiles, throughput and SQL query counts as JSON"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='Id or username to benchmark as (default: the one with the most transactions)')
+        parser.add_argument('--requests', type=int, default=200, help='Measured requests per route (default 200)')
+        parser.add_argument('--concurrency', type=int, default=4, help='Concurrent requests (default 4)')
+        parser.add_argument('--warmup', type=int, default=5, help='Unmeasured requests per route first (default 5)')
+        parser.add_argument('--route', action='append', dest='routes',
+                            help='Only run this route name (repeatable)')
+        parser.add_argument('--read-only', action='store_true', help='Skip routes that write')
+        parser.add_argument('--output', help='Write the JSON report here (default: stdout)')
+        parser.add_argument('--compare', help='Earlier JSON report to compare p95 latency and query counts against')
+
+    def handle(self, *args, **options):
+        user = self.get_user(options['user'])
+        staff = User.objects.filter(is_staff=True, is_active=True).order_by('id').first()
+        ctx = Context(user, staff)
+        self.application = get_wsgi_application()
+        self.accept_encoding = 'gzip'
+
+        scenarios = [
+            scenario for scenario in SCENARIOS
+            if (not options['routes'] or scenario.route in options['routes'])
+            and not (options['read_only'] and scenario.method != 'GET')
+        ]
+        report = {
+            'meta': self.meta(user, options),
+            'routes': {},
+            'skipped': dict(SKIPPED),
+            'uncovered': sorted(self.route_names() - {s.route for s in SCENARIOS} - SKIPPED.keys()),
+        }
+        if options['verbosity'] < 2:
+            # Per-request INFO lines would mostly measure the terminal
+            logging.disable(logging.INFO)
+        try:
+            for scenario in scenarios:
+                key = f'{scenario.method} {scenario.route}'
+                skipped = self.prepare(scenario, ctx)
+                if skipped:
+                    report['skipped'][key] = skipped
+                    self.stderr.write(f"{key}: skipped ({skipped})")
+                    continue
+                requests = options['requests']
+                if scenario.route in HASHING_ROUTES:
+                    requests = min(requests, HASHING_MAX_REQUESTS)
+                result = self.run(scenario, ctx, requests, options['warmup'], options['concurrency'])
+                report['routes'][key] = result
+                self.stderr.write(
+                    f"{key:<28} p50 {result['p50_ms']:8.2f}ms  p95 {result['p95_ms']:8.2f}ms  "
+                    f"p99 {result['p99_ms']:8.2f}ms  {result['throughput_rps']:8.1f} req/s  "
+                    f"{result['queries_mean']:5.1f} queries  errors {result['errors']}"
+                )
+        finally:
+            logging.disable(logging.NOTSET)
+            self.clean_up(ctx, options['read_only'])
+
+        if report['uncovered']:
+            self.stderr.write(self.style.WARNING(f"Routes without a scenario: {', '.join(report['uncovered'])}"))
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as handle:
+                handle.write(output + '\n')
+            self.stderr.write(self.style.SUCCESS(f"Report written to {options['output']}"))
+        else:
+            self.stdout.write(output)
+        if options['compare']:
+            self.compare(report, options['compare'])
+
+    def get_user(self, value):
+        if value is None:
+            user = User.objects.annotate(n=Count('transactions')).order_by('-n').first()
+            if user is None:
+                raise CommandError("No users; run seed_scale first")
+            return user
+        lookup = {'pk': int(value)} if value.isdigit() else {'username': value}
+        try:
+            return User.objects.get(**lookup)
+        except User.DoesNotExist:
+            raise CommandError(f"User {value} does not exist")
+
+    def meta(self, user, options):
+        try:
+            commit = subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                capture_output=True, text=True, check=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            commit = None
+        return {
+            'commit': commit,
+            'created_at': timezone.now().isoformat(),
+            'database': connections['default'].vendor,
+            'user_id': user.id,
+            'transactions': Transaction.objects.filter(user=user).count(),
+            'expenses': Expense.objects.filter(user=user).count(),
+            'requests': options['requests'],
+            'concurrency': options['concurrency'],
+            'warmup': options['warmup'],
+        }
+
+    def route_names(self):
+        def names(patterns):
+            for pattern in patterns:
+                if isinstance(pattern, URLResolver):
+                    yield from names(pattern.url_patterns)
+                elif pattern.name:
+                    yield pattern.name
+        return {name for urlconf in URLCONFS for name in names(import_module(urlconf).urlpatterns)}
+
+    def prepare(self, scenario, ctx):
+        """None when the scenario can run, else why it is skipped."""
+        if scenario.auth and scenario.auth not in ctx.tokens:
+            return f'needs a {scenario.auth} user'
+        if scenario.prepare is not None:
+            ready = scenario.prepare(ctx)
+            if ready is not True:
+                return ready
+        return None
+
+    def run(self, scenario, ctx, requests, warmup, concurrency):
+        for i in range(warmup):
+            self.request(scenario, ctx, i)
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            samples = list(executor.map(lambda i: self.request(scenario, ctx, warmup + i), range(requests)))
+        elapsed = time.perf_counter() - started
+        for alias in connections:
+            connections[alias].close()
+
+        latencies = sorted(latency for latency, _, _, _ in samples)
+        queries = [count for _, _, count, _ in samples]
+        statuses = Counter(str(status) for _, status, _, _ in samples)
+        return {
+            'path': scenario.build(ctx, 0)[0] if scenario.prepare is None else None,
+            'requests': requests,
+            'errors': sum(count for status, count in statuses.items() if not status.startswith(('2', '3'))),
+            'status': dict(statuses),
+            'p50_ms': self.percentile(latencies, 50),
+            'p95_ms': self.percentile(latencies, 95),
+            'p99_ms': self.percentile(latencies, 99),
+            'mean_ms': round(sum(latencies) / len(latencies), 3),
+            'max_ms': round(latencies[-1], 3),
+            'throughput_rps': round(requests / elapsed, 1),
+            'queries_mean': round(sum(queries) / len(queries), 2),
+            'queries_max': max(queries),
+            'sql_ms_mean': round(sum(sql for _, _, _, sql in samples) / len(samples), 3),
+        }
+
+    def percentile(self, ordered, p):
+        """Nearest-rank percentile of an ascending list."""
+        return round(ordered[max(math.ceil(p / 100 * len(ordered)) - 1, 0)], 3)
+
+    def request(self, scenario, ctx, i):
+        """(latency ms, status, query count, SQL ms) of one request through the WSGI app."""
+        path, body = scenario.build(ctx, i)
+        path, _, query = path.partition('?')
+        payload = b'' if body is None else json.dumps(body).encode('utf-8')
+        environ = {
+            'REQUEST_METHOD': scenario.method,
+            'PATH_INFO': path,
+            'QUERY_STRING': query,
+            'SERVER_NAME': 'localhost',
+            'SERVER_PORT': '80',
+            'SERVER_PROTOCOL': 'HTTP/1.1',
+            # Not loopback, which the SMS bridge permission treats specially
+            'REMOTE_ADDR': '203.0.113.10',
+            'HTTP_ACCEPT': 'application/json',
+            'HTTP_ACCEPT_ENCODING': self.accept_encoding,
+            'CONTENT_TYPE': 'application/json',
+            'CONTENT_LENGTH': str(len(payload)),
+            'wsgi.input': io.BytesIO(payload),
+            'wsgi.errors': sys.stderr,
+            'wsgi.url_scheme': 'http',
+            'wsgi.version': (1, 0),
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        if scenario.auth:
+            environ['HTTP_AUTHORIZATION'] = f'Bearer {ctx.tokens[scenario.auth]}'
+
+        sql = {'count': 0, 'seconds': 0.0}
+
+        def count_queries(execute, sql_text, params, many, context):
+            started = time.perf_counter()
+            try:
+                return execute(sql_text, params, many, context)
+            finally:
+                sql['count'] += 1
+                sql['seconds'] += time.perf_counter() - started
+
+        status = []
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(count_queries))
+            started = time.perf_counter()
+            response = self.application(environ, lambda line, headers, exc_info=None: status.append(line))
+            try:
+                for _ in response:
+                    pass
+            finally:
+                if hasattr(response, 'close'):
+                    response.close()
+            latency = time.perf_counter() - started
+        return latency * 1000, int(status[0].split()[0]), sql['count'], sql['seconds'] * 1000
+
+    def clean_up(self, ctx, read_only):
+        """Remove what the run wrote and rebuild the user's derived tables."""
+        if read_only:
+            return
+        Transaction.objects.filter(user=ctx.user, tx_id__startswith=f'{ctx.prefix}-').delete()
+        Transaction.objects.filter(
+            user=ctx.user, tx_id__startswith='debt-clear-', created_at__gte=ctx.started,
+        ).delete()
+        Expense.objects.filter(user=ctx.user, description=ctx.prefix).delete()
+        User.objects.filter(username__startswith=f'{ctx.prefix}-').delete()
+        if not ctx.had_profile:
+            DriverProfile.objects.filter(user=ctx.user).delete()
+        rebuild_rollups([ctx.user.id])
+        rebuild_debt_balances([ctx.user.id])
+        notify_change(ctx.user.id)
+        self.stderr.write("Removed the rows written by the run")
+
+    def compare(self, report, path):
+        with open(path) as handle:
+            baseline = json.load(handle)
+        self.stderr.write(f"Compared with {path} (commit {baseline['meta'].get('commit')}):")
+        for key, result in report['routes'].items():
+            before = baseline['routes'].get(key)
+            if before is None:
+                self.stderr.write(f"{key:<28} new")
+                continue
+            change = (result['p95_ms'] - before['p95_ms']) / before['p95_ms'] if before['p95_ms'] else 0
+            self.stderr.write(
+                f"{key:<28} p95 {before['p95_ms']:8.2f}ms -> {result['p95_ms']:8.2f}ms ({change:+.0%})  "
+                f"queries {before['queries_mean']:5.1f} -> {result['queries_mean']:5.1f}"
+            )
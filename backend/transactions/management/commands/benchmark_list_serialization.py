@@ -0,0 +1,69 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+
+from transactions.models import Transaction
+from transactions.rows import row_encoder_for
+from transactions.serializers import TransactionSerializer
+
+
+class Command(BaseCommand):
+    help = "Compare per-row cost of the transaction list serializer and the fast row encoder"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, dest='user_id',
+                            help='User whose transactions to list (default: the one with the most)')
+        parser.add_argument('--rows', type=int, default=500, help='Rows per list (default 500)')
+        parser.add_argument('--repeat', type=int, default=20, help='Timed runs per path (default 20)')
+
+    def handle(self, *args, **options):
+        user = self.get_user(options['user_id'])
+        queryset = Transaction.objects.filter(user=user).order_by('-created_at', '-id')[:options['rows']]
+
+        names = tuple(TransactionSerializer.readable_fields())
+        encoder = row_encoder_for(TransactionSerializer, names, ('created_at', 'id'))
+        if encoder is None:
+            raise CommandError("TransactionSerializer has fields the row encoder cannot handle")
+
+        def serializer_path():
+            return TransactionSerializer(list(queryset.select_related('user')), many=True).data
+
+        def encoder_path():
+            return encoder.encode(queryset.values_list(*encoder.columns, named=True))
+
+        rows = len(serializer_path())
+        if rows == 0:
+            raise CommandError(f"User {user.id} has no transactions")
+        if [dict(row) for row in serializer_path()] != encoder_path():
+            raise CommandError("Row encoder output differs from the serializer")
+
+        self.stdout.write(f"user={user.id} rows={rows} repeat={options['repeat']}")
+        baseline = None
+        for label, run in (('serializer', serializer_path), ('row encoder', encoder_path)):
+            per_row = self.time_per_row(run, rows, options['repeat'])
+            speedup = f" ({baseline / per_row:.1f}x faster)" if baseline else ''
+            self.stdout.write(f"{label:>12}: {per_row:8.2f} us/row{speedup}")
+            baseline = baseline or per_row
+
+    def get_user(self, user_id):
+        if user_id is not None:
+            try:
+                return User.objects.get(pk=user_id)
+            except User.DoesNotExist:
+                raise CommandError(f"User {user_id} does not exist")
+        user = User.objects.annotate(n=Count('transactions')).order_by('-n').first()
+        if user is None:
+            raise CommandError("No users; seed some data first")
+        return user
+
+    def time_per_row(self, run, rows, repeat):
+        """Best of `repeat` runs, in microseconds per row (query included)."""
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best / rows * 1e6
@@ -0,0 +1,98 @@
+import gzip
+import json
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from transactions.models import Transaction
+from transactions.renderers import FastJSONRenderer, MessagePackRenderer, msgpack, orjson
+from transactions.serializers import TransactionSerializer
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class Command(BaseCommand):
+    help = "Compare render time, response size and client parse time of the response formats on a transaction list"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000, help='Transactions in the list (default 10000)')
+        parser.add_argument('--repeat', type=int, default=10, help='Timed runs per measurement (default 10)')
+
+    def handle(self, *args, **options):
+        repeat = options['repeat']
+        transactions = self.build_transactions(options['rows'])
+        json_data = self.serialize(transactions, FastJSONRenderer())
+
+        if JSONRenderer().render(json_data) != FastJSONRenderer().render(json_data):
+            raise CommandError("JSON renderers produced different output")
+
+        formats = [
+            ('JSONRenderer', JSONRenderer(), json_data, json.loads),
+            ('FastJSONRenderer', FastJSONRenderer(), json_data, orjson.loads if orjson else json.loads),
+        ]
+        if msgpack is not None:
+            formats.append((
+                'MessagePackRenderer', MessagePackRenderer(), self.serialize(transactions, MessagePackRenderer()),
+                msgpack.unpackb,
+            ))
+
+        self.stdout.write(f"rows={options['rows']} repeat={repeat}")
+        self.stdout.write(f"{'':>20} {'render':>10} {'parse':>10} {'bytes':>11} {'gzip':>9} {'br':>9}")
+        json_size = None
+        for label, renderer, data, parse in formats:
+            body = renderer.render(data, renderer.media_type)
+            render_time = self.best_of(lambda: renderer.render(data, renderer.media_type), repeat)
+            parse_time = self.best_of(lambda: parse(body), repeat)
+            gzip_size = len(gzip.compress(body, compresslevel=6, mtime=0))
+            br_size = f"{len(brotli.compress(body, quality=4)):9,d}" if brotli else f"{'-':>9}"
+            json_size = json_size or len(body)
+            self.stdout.write(
+                f"{label:>20} {render_time * 1000:8.2f}ms {parse_time * 1000:8.2f}ms "
+                f"{len(body):11,d} {gzip_size:9,d} {br_size}  ({len(body) / json_size:.0%} of JSON)"
+            )
+
+    def build_transactions(self, rows):
+        """Unsaved transactions shaped like real history rows (no database needed)."""
+        user = User(id=1, username='benchmark')
+        now = timezone.now()
+        platforms = ['YANGO', 'BOLT', 'PRIVATE']
+        return [
+            Transaction(
+                id=i + 1,
+                user=user,
+                tx_id=f'TX{i:08d}',
+                amount_received=Decimal('50.00') + i % 100,
+                rider_profit=Decimal('40.00') + i % 100,
+                platform_debt=Decimal('10.00'),
+                platform=platforms[i % 3],
+                tip_amount=Decimal('0.00'),
+                bonuses=Decimal('0.00'),
+                created_at=now - timedelta(minutes=i),
+            )
+            for i in range(rows)
+        ]
+
+    def serialize(self, transactions, renderer):
+        """Serializer output as the list endpoint produces it for `renderer`."""
+        request = Request(APIRequestFactory().get('/api/transactions/'))
+        request.accepted_renderer = renderer
+        return TransactionSerializer(transactions, many=True, context={'request': request}).data
+
+    def best_of(self, run, repeat):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from transactions.rollups import find_rollup_mismatches
+
+
+class Command(BaseCommand):
+    help = "Verify the DailyRollup table against the raw Transaction and Expense rows"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', dest='user_ids',
+                            help='Only check rollups for this user id (repeatable)')
+
+    def handle(self, *args, **options):
+        mismatches = find_rollup_mismatches(options['user_ids'])
+        for user_id, day, platform, column, stored, expected in mismatches:
+            self.stdout.write(
+                f"user={user_id} day={day} platform={platform or 'EXPENSES'} "
+                f"{column}: stored={stored} expected={expected}"
+            )
+        if mismatches:
+            raise CommandError(f"{len(mismatches)} rollup mismatch(es); run rebuild_rollups to repair")
+        self.stdout.write(self.style.SUCCESS("Daily rollups are consistent"))
@@ -0,0 +1,196 @@
+import json
+import os
+import sys
+import time
+from csv import DictReader
+from itertools import islice
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from transactions.ingest import (
+    STATUS_CREATED, copy_transactions, insert_transactions, validate_items,
+)
+from transactions.txfilter import tx_id_filter
+
+FORMATS = ('csv', 'ndjson')
+# Errors echoed to stderr; the rest are only counted
+MAX_REPORTED_ERRORS = 20
+
+
+class Command(BaseCommand):
+    help = (
+        "Import a user's transactions from CSV or NDJSON (a file, or - for stdin). "
+        "Rows are streamed and validated in batches, duplicate tx_ids are skipped, "
+        "and progress is checkpointed so an interrupted import can be resumed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to import, or - to read stdin")
+        parser.add_argument('--user', required=True, help='Id or username of the owner')
+        parser.add_argument('--format', choices=FORMATS, help='Input format (default: from the file extension)')
+        parser.add_argument('--batch-size', type=int, default=2000, help='Rows per batch (default 2000)')
+        parser.add_argument('--checkpoint', help='Progress file (default: <path>.progress; stdin needs one to resume)')
+        parser.add_argument('--resume', action='store_true', help='Skip the rows a previous run already committed')
+        parser.add_argument('--no-copy', action='store_true', help='Use bulk_create on PostgreSQL instead of COPY')
+
+    def handle(self, *args, **options):
+        user = self.get_user(options['user'])
+        path = options['path']
+        fmt = options['format'] or self.detect_format(path)
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError("--batch-size must be positive")
+        checkpoint = options['checkpoint'] or (None if path == '-' else f'{path}.progress')
+        if options['resume'] and checkpoint is None:
+            raise CommandError("--resume from stdin needs --checkpoint")
+
+        progress = {'records': 0, 'created': 0, 'duplicates': 0, 'invalid': 0, 'skipped': 0}
+        if options['resume']:
+            progress.update(self.read_checkpoint(checkpoint, user))
+        use_copy = connection.vendor == 'postgresql' and not options['no_copy']
+        insert = copy_transactions if use_copy else (lambda u, v: insert_transactions(u, v, batch_size))
+
+        stream = sys.stdin if path == '-' else self.open(path)
+        try:
+            records = self.read_records(stream, fmt)
+            # Rows committed by the previous run; their tx_ids would be skipped
+            # as duplicates anyway, this just avoids validating them again
+            for _ in islice(records, progress['records']):
+                pass
+            if progress['records']:
+                self.stdout.write(f"Resuming after {progress['records']} row(s)")
+
+            if not use_copy and tx_id_filter.enabled:
+                # Load the duplicate filter up front rather than inside the first batch's timing
+                tx_id_filter.warm()
+            started = time.monotonic()
+            last_report = started
+            imported = 0
+            while True:
+                batch = list(islice(records, batch_size))
+                if not batch:
+                    break
+                self.import_batch(user, batch, insert, progress)
+                imported += len(batch)
+                if checkpoint:
+                    self.write_checkpoint(checkpoint, user, progress)
+                now = time.monotonic()
+                if now - last_report >= 5 or options['verbosity'] > 1:
+                    last_report = now
+                    self.stdout.write(self.report(progress, imported, now - started))
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        if checkpoint and os.path.exists(checkpoint):
+            os.remove(checkpoint)
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {path} ({fmt}, {'COPY' if use_copy else 'bulk_create'}): "
+            + self.report(progress, imported, elapsed)
+        ))
+
+    def get_user(self, value):
+        lookup = {'pk': int(value)} if value.isdigit() else {'username': value}
+        try:
+            return User.objects.get(**lookup)
+        except User.DoesNotExist:
+            raise CommandError(f"User {value} does not exist")
+
+    def detect_format(self, path):
+        extension = os.path.splitext(path)[1].lower().lstrip('.')
+        if extension == 'jsonl':
+            extension = 'ndjson'
+        if extension not in FORMATS:
+            raise CommandError("Cannot tell the input format; pass --format csv or --format ndjson")
+        return extension
+
+    def open(self, path):
+        try:
+            # utf-8-sig drops the byte order mark spreadsheet exports start with
+            return open(path, newline='', encoding='utf-8-sig')
+        except OSError as exc:
+            raise CommandError(f"Cannot open {path}: {exc}")
+
+    def read_records(self, stream, fmt):
+        """(line number, item or None, error) per input row, streamed."""
+        if fmt == 'csv':
+            reader = DictReader(stream)
+            for row in reader:
+                # Empty cells mean "not given", so model defaults and nulls apply
+                yield reader.line_num, {key: value for key, value in row.items() if value not in ('', None)}, None
+            return
+        for line_number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError as exc:
+                yield line_number, None, f"invalid JSON: {exc}"
+                continue
+            if not isinstance(item, dict):
+                yield line_number, None, "expected a JSON object"
+                continue
+            yield line_number, item, None
+
+    def import_batch(self, user, batch, insert, progress):
+        items = []
+        lines = []
+        errors = []
+        for line_number, item, error in batch:
+            if error is not None:
+                errors.append((line_number, error))
+            elif item.get('type', 'transaction') != 'transaction':
+                # Expense rows of a GET /api/export/ file
+                progress['skipped'] += 1
+            else:
+                items.append(item)
+                lines.append(line_number)
+
+        validated, invalid = validate_items(items)
+        errors.extend((lines[index], json.dumps(detail)) for index, detail in invalid.items())
+        for line_number, error in sorted(errors):
+            self.report_error(progress, line_number, error)
+        if validated:
+            outcome = insert(user, validated)
+            created = sum(1 for status, _ in outcome.values() if status == STATUS_CREATED)
+            progress['created'] += created
+            progress['duplicates'] += len(outcome) - created
+        progress['records'] += len(batch)
+
+    def report_error(self, progress, line_number, error):
+        progress['invalid'] += 1
+        if progress['invalid'] <= MAX_REPORTED_ERRORS:
+            self.stderr.write(f"Line {line_number}: {error}")
+        elif progress['invalid'] == MAX_REPORTED_ERRORS + 1:
+            self.stderr.write("Further errors are only counted")
+
+    def report(self, progress, imported, elapsed):
+        rate = imported / elapsed if elapsed > 0 else 0
+        return (
+            f"{progress['records']} row(s) read, {progress['created']} created, "
+            f"{progress['duplicates']} duplicate(s), {progress['invalid']} invalid, "
+            f"{progress['skipped']} skipped; {rate:,.0f} rows/s"
+        )
+
+    def read_checkpoint(self, checkpoint, user):
+        try:
+            with open(checkpoint) as handle:
+                saved = json.load(handle)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as exc:
+            raise CommandError(f"Cannot read checkpoint {checkpoint}: {exc}")
+        if saved.pop('user', None) != user.id:
+            raise CommandError(f"Checkpoint {checkpoint} belongs to a different user")
+        return saved
+
+    def write_checkpoint(self, checkpoint, user, progress):
+        # Written after the batch commits; replaced atomically so a crash
+        # never leaves a half-written file behind
+        temporary = f'{checkpoint}.tmp'
+        with open(temporary, 'w') as handle:
+            json.dump({'user': user.id, **progress}, handle)
+        os.replace(temporary, checkpoint)
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+
+from transactions.idempotency import key_ttl, pending_lease
+from transactions.models import IdempotencyKey
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete stored Idempotency-Key responses older than IDEMPOTENCY_KEY_TTL_HOURS, and "
+        "reservations abandoned for longer than IDEMPOTENCY_PENDING_LEASE_SECONDS"
+    )
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        deleted, _ = IdempotencyKey.objects.filter(
+            Q(created_at__lt=now - key_ttl()) | Q(response_status__isnull=True, created_at__lt=now - pending_lease())
+        ).delete()
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} expired idempotency keys"))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from transactions.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = "Recompute the DailyRollup table from the raw Transaction and Expense rows"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', dest='user_ids',
+                            help='Only rebuild rollups for this user id (repeatable)')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        count = rebuild_rollups(options['user_ids'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {count} daily rollup rows"))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from transactions.rollups import find_debt_mismatches, rebuild_debt_balances
+
+
+class Command(BaseCommand):
+    help = "Verify the PlatformDebtBalance ledger against the raw Transaction rows"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', dest='user_ids',
+                            help='Only check balances for this user id (repeatable)')
+        parser.add_argument('--repair', action='store_true',
+                            help='Rebuild the balances of the users with mismatches')
+
+    def handle(self, *args, **options):
+        mismatches = find_debt_mismatches(options['user_ids'])
+        for user_id, platform, stored, expected in mismatches:
+            self.stdout.write(f"user={user_id} platform={platform}: stored={stored} expected={expected}")
+        if not mismatches:
+            self.stdout.write(self.style.SUCCESS("Platform debt ledger is consistent"))
+            return
+        if not options['repair']:
+            raise CommandError(f"{len(mismatches)} debt ledger mismatch(es); run with --repair to rebuild")
+        user_ids = sorted({user_id for user_id, _, _, _ in mismatches})
+        rebuild_debt_balances(user_ids)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt the debt ledger for {len(user_ids)} user(s)"))
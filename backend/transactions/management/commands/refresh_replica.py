@@ -0,0 +1,41 @@
+import sqlite3
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from transactions.replicas import replica_aliases
+
+
+class Command(BaseCommand):
+    help = (
+        "Copy the primary SQLite database into its SQLite read replicas, standing in for "
+        "replication when trying the replica router locally"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--alias', action='append', dest='aliases',
+                            help='Replica alias to refresh (repeatable; default: all of them)')
+
+    def handle(self, *args, **options):
+        aliases = options['aliases'] or replica_aliases()
+        if not aliases:
+            raise CommandError("No replicas configured; set DATABASE_REPLICA_URLS")
+        primary = settings.DATABASES[DEFAULT_DB_ALIAS]
+        for alias in aliases:
+            if alias not in replica_aliases():
+                raise CommandError(f"{alias} is not a configured replica")
+            replica = settings.DATABASES[alias]
+            if 'sqlite3' not in primary['ENGINE'] or 'sqlite3' not in replica['ENGINE']:
+                raise CommandError(f"{alias}: only SQLite files can be copied; use the database's own replication")
+            # Readers of the old copy must not keep its pages open
+            connections[alias].close()
+            source = sqlite3.connect(primary['NAME'])
+            target = sqlite3.connect(replica['NAME'])
+            try:
+                # The online backup API copies a consistent snapshot even while the primary is written to
+                source.backup(target)
+            finally:
+                target.close()
+                source.close()
+            self.stdout.write(self.style.SUCCESS(f"Copied {primary['NAME']} to {alias} ({replica['NAME']})"))
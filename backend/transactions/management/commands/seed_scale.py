@@ -0,0 +1,158 @@
+import random
+import time
+from datetime import timedelta
+from decimal import Decimal
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from transactions.models import Expense, Transaction
+from transactions.rollups import rebuild_debt_balances, rebuild_rollups
+
+PLATFORMS = (('YANGO', 50), ('BOLT', 35), ('PRIVATE', 15))
+# Share of the fare owed to the platform
+COMMISSION = {'YANGO': Decimal('0.20'), 'BOLT': Decimal('0.15'), 'PRIVATE': Decimal('0')}
+# (category, weight, smallest amount, largest amount) in cedis
+EXPENSES = (
+    ('FUEL', 45, 30, 250),
+    ('FOOD', 25, 10, 60),
+    ('DATA', 15, 5, 50),
+    ('OTHER', 10, 5, 100),
+    ('REPAIRS', 5, 50, 800),
+)
+# Trips per hour of the day: morning and evening rush
+HOUR_WEIGHTS = (1, 1, 1, 1, 2, 4, 8, 10, 9, 6, 5, 5, 6, 5, 5, 6, 8, 10, 10, 8, 6, 4, 3, 2)
+CENT = Decimal('0.01')
+
+
+class Command(BaseCommand):
+    help = (
+        "Bulk-generate users with realistic transaction and expense histories for load tests "
+        "(daily rollups and the debt ledger are rebuilt for them afterwards)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1, help='Users to create (default 1)')
+        parser.add_argument('--transactions', type=int, default=100000, help='Transactions per user (default 100000)')
+        parser.add_argument('--expenses', type=int, help='Expenses per user (default: transactions / 20)')
+        parser.add_argument('--days', type=int, default=365, help='History length in days (default 365)')
+        parser.add_argument('--prefix', default='scale', help="Username and tx_id prefix (default 'scale')")
+        parser.add_argument('--password', default='password123', help='Password of every seeded user')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=0, help='Random seed, for repeatable data sets')
+        parser.add_argument('--replace', action='store_true', help='Delete existing users with the prefix first')
+
+    def handle(self, *args, **options):
+        prefix = options['prefix']
+        existing = User.objects.filter(username__startswith=f'{prefix}-')
+        if existing.exists():
+            if not options['replace']:
+                raise CommandError(f"Users named {prefix}-* already exist; pass --replace or another --prefix")
+            deleted = existing.count()
+            existing.delete()
+            self.stdout.write(f"Deleted {deleted} existing {prefix}-* user(s)")
+
+        expenses = options['expenses']
+        if expenses is None:
+            expenses = options['transactions'] // 20
+        rng = random.Random(options['seed'])
+        end = timezone.now()
+        start = end - timedelta(days=options['days'])
+
+        started = time.monotonic()
+        # Hashing is deliberately slow; every seeded user shares one hash
+        password = make_password(options['password'])
+        users = User.objects.bulk_create([
+            User(username=f'{prefix}-{i}', email=f'{prefix}-{i}@example.com', password=password)
+            for i in range(options['users'])
+        ])
+        # bulk_create only returns primary keys on some backends
+        users = list(User.objects.filter(username__in=[user.username for user in users]).order_by('id'))
+
+        rows = 0
+        for user in users:
+            rows += self.insert(Transaction, self.transactions(user, options['transactions'], start, end, rng),
+                                options['batch_size'])
+            rows += self.insert(Expense, self.expenses(user, expenses, start, end, rng), options['batch_size'])
+            self.stdout.write(f"Seeded {user.username}: {options['transactions']} transactions, {expenses} expenses")
+
+        user_ids = [user.id for user in users]
+        rebuild_rollups(user_ids)
+        rebuild_debt_balances(user_ids)
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded {len(users)} user(s), {rows} rows in {elapsed:.1f}s ({rows / elapsed:,.0f} rows/s); "
+            f"password: {options['password']}"
+        ))
+
+    def insert(self, model, rows, batch_size):
+        """
+        executemany() of plain tuples: several times faster than bulk_create,
+        which spends most of its time preparing each field of each instance.
+        """
+        columns = next(rows)
+        quote = connection.ops.quote_name
+        sql = (
+            f"INSERT INTO {quote(model._meta.db_table)} ({', '.join(quote(column) for column in columns)}) "
+            f"VALUES ({', '.join(['%s'] * len(columns))})"
+        )
+        count = 0
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                return count
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.executemany(sql, batch)
+            count += len(batch)
+
+    def timestamps(self, count, start, end, rng):
+        days = max((end - start).days, 1)
+        hours = range(24)
+        for _ in range(count):
+            hour = rng.choices(hours, HOUR_WEIGHTS)[0]
+            moment = start + timedelta(days=rng.randrange(days), hours=hour, seconds=rng.randrange(3600))
+            yield min(moment, end)
+
+    def transactions(self, user, count, start, end, rng):
+        """Column names, then one value tuple per transaction."""
+        yield (
+            'user_id', 'tx_id', 'amount_received', 'trip_price', 'bonuses', 'system_fees', 'gross_total',
+            'rider_profit', 'platform_debt', 'platform', 'department', 'is_tip', 'tip_amount',
+            'created_at', 'updated_at',
+        )
+        decimal = connection.ops.adapt_decimalfield_value
+        moment = connection.ops.adapt_datetimefield_value
+        platforms = [platform for platform, _ in PLATFORMS]
+        weights = [weight for _, weight in PLATFORMS]
+        zero = decimal(Decimal('0.00'))
+        for i, created_at in enumerate(self.timestamps(count, start, end, rng)):
+            platform = rng.choices(platforms, weights)[0]
+            trip_price = Decimal(rng.randrange(1500, 12000)) * CENT
+            bonuses = Decimal(rng.randrange(500, 2000)) * CENT if rng.random() < 0.05 else Decimal('0.00')
+            amount = trip_price + bonuses
+            debt = (trip_price * COMMISSION[platform]).quantize(CENT)
+            is_tip = rng.random() < 0.03
+            created_at = moment(created_at)
+            yield (
+                user.id, f'{user.username}-{i:07d}', decimal(amount), decimal(trip_price), decimal(bonuses),
+                decimal(debt), decimal(amount), decimal(amount - debt), decimal(debt),
+                platform, Transaction.department_for(platform), is_tip,
+                decimal(Decimal(rng.randrange(2, 11))) if is_tip else zero,
+                created_at, created_at,
+            )
+
+    def expenses(self, user, count, start, end, rng):
+        """Column names, then one value tuple per expense."""
+        yield ('user_id', 'amount', 'category', 'description', 'created_at', 'updated_at')
+        weights = [weight for _, weight, _, _ in EXPENSES]
+        for created_at in self.timestamps(count, start, end, rng):
+            category, _, low, high = rng.choices(EXPENSES, weights)[0]
+            created_at = connection.ops.adapt_datetimefield_value(created_at)
+            yield (
+                user.id, connection.ops.adapt_decimalfield_value(Decimal(rng.randrange(low * 100, high * 100)) * CENT),
+                category, '', created_at, created_at,
+            )
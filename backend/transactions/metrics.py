@@ -0,0 +1,311 @@
+"""
+Prometheus metrics (GET /api/metrics/).
+
+Counters and histograms live in the memory of each worker process. With
+METRICS['DIRECTORY'] set, a background thread in every worker writes a
+snapshot of them to <DIRECTORY>/<pid>-<id>.json every FLUSH_INTERVAL
+seconds, and a scrape (answered by any one worker) sums the snapshots of
+all workers, past and present, so counters keep growing across worker
+restarts. The directory must be emptied before the server starts (see
+start.sh). Without it, a scrape only sees the worker that answered it.
+
+Collectors registered with register_collector() are read at snapshot
+time; they export counts other modules already keep (the summary cache,
+the tx_id filter) without touching their hot paths.
+"""
+import atexit
+import hmac
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from bisect import bisect_left
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from rest_framework.authentication import BaseAuthentication
+from rest_framework.permissions import BasePermission
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# request.auth of a scrape made with METRICS['TOKEN']
+SCRAPER = 'metrics-scraper'
+
+_lock = threading.Lock()
+_metrics = {}
+_collectors = []
+
+
+def metrics_config():
+    return getattr(settings, 'METRICS', {})
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # label values tuple -> value
+        self.values = {}
+        _metrics[name] = self
+
+    def key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=()):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        # Per-bucket (not yet cumulative) counts, the +Inf bucket, then the sum
+        index = bisect_left(self.buckets, value)
+        with _lock:
+            series = self.values.get(key)
+            if series is None:
+                series = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+
+def register_collector(collect):
+    """collect() returns (metric name, labels dict, value) triples for counters declared here."""
+    _collectors.append(collect)
+
+
+http_requests = Counter(
+    'sidekick_http_requests_total', 'HTTP requests by route, method and status code.',
+    ('route', 'method', 'status'),
+)
+http_request_duration = Histogram(
+    'sidekick_http_request_duration_seconds', 'Time to produce the response, by route and method.',
+    ('route', 'method'), buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+db_query_duration = Histogram(
+    'sidekick_db_query_duration_seconds', 'SQL statement execution time, by database alias.',
+    ('database',), buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1),
+)
+transactions_ingested = Counter(
+    'sidekick_transactions_ingested_total', 'Transactions stored, by ingest path (single or bulk).',
+    ('path',),
+)
+transaction_duplicates = Counter(
+    'sidekick_transaction_duplicates_total',
+    'Submitted transactions whose tx_id was already stored, by ingest path.',
+    ('path',),
+)
+expenses_ingested = Counter('sidekick_expenses_ingested_total', 'Expenses stored.')
+hmac_failures = Counter(
+    'sidekick_hmac_failures_total', 'SMS transactions and expenses whose request_hash did not verify.',
+    ('rejected',),
+)
+cache_requests = Counter(
+    'sidekick_cache_requests_total',
+    'Summary cache lookups and conditional GETs (etag; a hit is a 304), by result.',
+    ('cache', 'result'),
+)
+tx_id_filter_lookups = Counter(
+    'sidekick_tx_id_filter_lookups_total',
+    'tx_id Bloom filter answers: negative skips the duplicate lookup, positive needs it.',
+    ('result',),
+)
+tx_id_filter_false_positives = Counter(
+    'sidekick_tx_id_filter_false_positives_total', 'Positive tx_id filter answers the database disproved.',
+)
+
+
+def observe_query(execute, sql, params, many, context):
+    """connection.execute_wrapper() hook installed on every connection (see signals.py)."""
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        db_query_duration.observe(time.perf_counter() - started, database=context['connection'].alias)
+
+
+def snapshot():
+    """{name: [[label values, value], ...]} for every metric of this process."""
+    collected = []
+    for collect in _collectors:
+        try:
+            collected.extend(collect())
+        except Exception:
+            logger.exception("Metrics collector failed")
+    with _lock:
+        data = {
+            name: [[list(key), list(value) if isinstance(value, list) else value]
+                   for key, value in metric.values.items()]
+            for name, metric in _metrics.items()
+        }
+    for name, labels, value in collected:
+        metric = _metrics[name]
+        data[name].append([list(metric.key(labels)), value])
+    return data
+
+
+def merge(snapshots):
+    """Sum snapshots into {name: {label values: value}}."""
+    merged = {name: {} for name in _metrics}
+    for data in snapshots:
+        for name, series in data.items():
+            if name not in merged:
+                # Written by an older release of the code
+                continue
+            values = merged[name]
+            for key, value in series:
+                key = tuple(key)
+                current = values.get(key)
+                if current is None:
+                    values[key] = list(value) if isinstance(value, list) else value
+                elif isinstance(value, list):
+                    values[key] = [a + b for a, b in zip(current, value)]
+                else:
+                    values[key] = current + value
+    return merged
+
+
+class _Flusher:
+    """Writes this process's snapshot to the metrics directory on a timer."""
+
+    def __init__(self):
+        self.pid = None
+        self.path = None
+        self.lock = threading.Lock()
+
+    def ensure_started(self, directory):
+        # Checked per process: a forked worker needs its own file and thread
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            os.makedirs(directory, exist_ok=True)
+            self.path = os.path.join(directory, f'{os.getpid()}-{uuid.uuid4().hex[:8]}.json')
+            self.pid = os.getpid()
+            interval = metrics_config().get('FLUSH_INTERVAL', 5)
+            thread = threading.Thread(target=self.run, args=(interval,), name='metrics-flush', daemon=True)
+            thread.start()
+            atexit.register(self.flush)
+
+    def run(self, interval):
+        while True:
+            time.sleep(interval)
+            self.flush()
+
+    def flush(self):
+        # Nothing to do before the first request, or once the directory is gone
+        if self.path is None or not os.path.isdir(os.path.dirname(self.path)):
+            return
+        temporary = f'{self.path}.tmp'
+        try:
+            with open(temporary, 'w') as handle:
+                json.dump(snapshot(), handle, separators=(',', ':'))
+            os.replace(temporary, self.path)
+        except OSError as exc:
+            logger.warning(f"Could not write metrics snapshot {self.path}: {exc}")
+
+
+_flusher = _Flusher()
+
+
+def start_flushing():
+    """Called per request; starts this worker's snapshot thread once a directory is configured."""
+    directory = metrics_config().get('DIRECTORY')
+    if directory:
+        _flusher.ensure_started(directory)
+
+
+def collect():
+    """Metrics of every worker process (or just this one without a directory), merged."""
+    directory = metrics_config().get('DIRECTORY')
+    if not directory:
+        return merge([snapshot()])
+    start_flushing()
+    snapshots = [snapshot()]
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if not name.endswith('.json') or path == _flusher.path:
+            continue
+        try:
+            with open(path) as handle:
+                snapshots.append(json.load(handle))
+        except (OSError, ValueError) as exc:
+            # Replaced atomically, so only a vanished or foreign file ends up here
+            logger.warning(f"Skipping metrics snapshot {path}: {exc}")
+    return merge(snapshots)
+
+
+def _escape(value):
+    return value.replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def render(merged):
+    """Prometheus text exposition format (version 0.0.4)."""
+    lines = []
+    for name, metric in _metrics.items():
+        lines.append(f'# HELP {name} {metric.documentation}')
+        lines.append(f'# TYPE {name} {metric.kind}')
+        for key, value in sorted(merged.get(name, {}).items()):
+            if metric.kind == 'counter':
+                lines.append(f'{name}{_labels(metric.labelnames, key)} {_number(value)}')
+                continue
+            cumulative = 0
+            bounds = [_number(float(bound)) for bound in metric.buckets] + ['+Inf']
+            for bound, count in zip(bounds, value):
+                cumulative += count
+                lines.append(f'{name}_bucket{_labels(metric.labelnames, key, [("le", bound)])} {cumulative}')
+            lines.append(f'{name}_sum{_labels(metric.labelnames, key)} {_number(float(value[-1]))}')
+            lines.append(f'{name}_count{_labels(metric.labelnames, key)} {cumulative}')
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsTokenAuthentication(BaseAuthentication):
+    """'Authorization: Bearer <METRICS['TOKEN']>', for Prometheus; other tokens fall through to JWT."""
+
+    def authenticate(self, request):
+        token = metrics_config().get('TOKEN')
+        header = request.META.get('HTTP_AUTHORIZATION', '')
+        if token and header.startswith('Bearer ') and hmac.compare_digest(
+            header[7:].encode('utf-8'), token.encode('utf-8')
+        ):
+            return AnonymousUser(), SCRAPER
+        return None
+
+    def authenticate_header(self, request):
+        return 'Bearer realm="metrics"'
+
+
+class CanScrapeMetrics(BasePermission):
+    def has_permission(self, request, view):
+        return request.auth == SCRAPER or bool(request.user and request.user.is_staff)
@@ -0,0 +1,203 @@
+"""
+API middleware.
+
+CompressionMiddleware: response compression (brotli or gzip).
+
+Replaces django.middleware.gzip.GZipMiddleware for our needs: brotli when
+the client accepts it and the brotli package is installed, a configurable
+size threshold, and streaming responses (the summary SSE stream, exports)
+are left alone so every chunk reaches the client as soon as it is written.
+
+ServerTimingMiddleware: per-phase timings (transactions.timing) of a
+sample of requests, as a Server-Timing header and optionally a log line.
+
+MetricsMiddleware: request counts and latency per route for
+GET /api/metrics/ (transactions.metrics).
+"""
+import gzip
+import json
+import logging
+import random
+import re
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.utils.cache import patch_vary_headers
+
+from . import metrics
+from .timing import Timings, current
+
+try:
+    import brotli
+except ImportError:  # optional dependency, see requirements.txt
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Request methods labelled as themselves in metrics; anything else is 'other'
+METRIC_METHODS = {'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'}
+# Server-Timing metrics in header order; total is always last
+TIMING_PHASES = ('auth', 'view', 'serializer', 'sql', 'render')
+COMPRESSIBLE_TYPES = re.compile(r'^(application/(json|msgpack|javascript|xml)|text/)', re.I)
+
+
+def accepted_encodings(header):
+    """Codings named in an Accept-Encoding header with a non-zero q-value."""
+    encodings = set()
+    for part in header.split(','):
+        coding, _, params = part.strip().partition(';')
+        quality = 1.0
+        match = re.search(r'q\s*=\s*([0-9.]+)', params)
+        if match:
+            try:
+                quality = float(match.group(1))
+            except ValueError:
+                continue
+        if coding and quality > 0:
+            encodings.add(coding.strip().lower())
+    return encodings
+
+
+class CompressionMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+        config = getattr(settings, 'RESPONSE_COMPRESSION', {})
+        self.enabled = config.get('ENABLED', True)
+        self.min_size = config.get('MIN_SIZE', 1024)
+        self.gzip_level = config.get('GZIP_LEVEL', 6)
+        self.brotli_quality = config.get('BROTLI_QUALITY', 4)
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if not self.enabled or response.streaming or response.has_header('Content-Encoding'):
+            return response
+        if not COMPRESSIBLE_TYPES.match(response.get('Content-Type', '')):
+            return response
+        if len(response.content) < self.min_size:
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encodings = accepted_encodings(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if brotli is not None and 'br' in encodings:
+            encoding = 'br'
+            compressed = brotli.compress(response.content, quality=self.brotli_quality)
+        elif 'gzip' in encodings:
+            encoding = 'gzip'
+            compressed = gzip.compress(response.content, compresslevel=self.gzip_level, mtime=0)
+        else:
+            return response
+
+        if len(compressed) >= len(response.content):
+            return response
+        response.content = compressed
+        response['Content-Length'] = str(len(compressed))
+        response['Content-Encoding'] = encoding
+        # The bytes differ per coding, so a strong ETag must become weak
+        # (see conditional.etag_matches, which compares weakly)
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        return response
+
+
+class ServerTimingMiddleware:
+    """
+    Times a sample of requests (SERVER_TIMING['SAMPLE_RATE']) phase by phase:
+    authentication, the view, serialization, SQL (count and time) and
+    rendering. Unsampled requests pass straight through. Listed at the top
+    of MIDDLEWARE so total covers the other middleware too.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        config = getattr(settings, 'SERVER_TIMING', {})
+        self.sample_rate = config.get('SAMPLE_RATE', 0.0)
+        self.log = config.get('LOG', False)
+
+    def __call__(self, request):
+        if not self.sample_rate or random.random() >= self.sample_rate:
+            return self.get_response(request)
+
+        timings = Timings()
+        token = timings.activate()
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(timings.execute_wrapper))
+                response = self.get_response(request)
+        finally:
+            timings.deactivate(token)
+        # Plain HttpResponses (and errors) never reach process_template_response
+        timings.end_view()
+        timings.add('total', time.perf_counter() - started)
+
+        response['Server-Timing'] = self.header(timings)
+        if self.log:
+            self.log_timings(request, response, timings)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        timings = current()
+        if timings is not None:
+            timings.start_view()
+
+    def process_template_response(self, request, response):
+        # DRF responses render after the view returns and before the
+        # response comes back through the middleware
+        timings = current()
+        if timings is not None:
+            timings.end_view()
+            render = timings.phase('render')
+            render.__enter__()
+            response.add_post_render_callback(lambda response: render.__exit__(None, None, None))
+        return response
+
+    def header(self, timings):
+        metrics = []
+        for name in TIMING_PHASES + ('total',):
+            if name not in timings.durations and name != 'sql':
+                continue
+            metric = f'{name};dur={timings.durations.get(name, 0.0) * 1000:.1f}'
+            if name == 'sql':
+                unit = 'query' if timings.queries == 1 else 'queries'
+                metric += f';desc="{timings.queries} {unit}"'
+            metrics.append(metric)
+        return ', '.join(metrics)
+
+    def log_timings(self, request, response, timings):
+        match = request.resolver_match
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'route': match.route if match else None,
+            'status': response.status_code,
+            'queries': timings.queries,
+        }
+        record.update(
+            (f'{name}_ms', round(seconds * 1000, 1)) for name, seconds in timings.durations.items()
+        )
+        logger.info(f"server-timing {json.dumps(record, separators=(',', ':'))}")
+
+
+class MetricsMiddleware:
+    """Listed first in MIDDLEWARE, so latency includes every other middleware."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics.start_flushing()
+        started = time.perf_counter()
+        response = self.get_response(request)
+        elapsed = time.perf_counter() - started
+
+        match = request.resolver_match
+        # The URL pattern, not the path, so ids do not multiply the series
+        route = match.route if match else 'unmatched'
+        method = request.method if request.method in METRIC_METHODS else 'other'
+        metrics.http_request_duration.observe(elapsed, route=route, method=method)
+        metrics.http_requests.inc(route=route, method=method, status=response.status_code)
+        return response
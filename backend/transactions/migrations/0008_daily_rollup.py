@@ -0,0 +1,85 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:52
+
+from datetime import timezone as dt_timezone
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+
+EXPENSE_COLUMNS = {
+    "FUEL": "fuel_expenses",
+    "DATA": "data_expenses",
+    "FOOD": "food_expenses",
+    "REPAIRS": "repairs_expenses",
+    "OTHER": "other_expenses",
+}
+
+
+def backfill_rollups(apps, schema_editor):
+    Transaction = apps.get_model("transactions", "Transaction")
+    Expense = apps.get_model("transactions", "Expense")
+    DailyRollup = apps.get_model("transactions", "DailyRollup")
+
+    rollups = {}
+    for row in Transaction.objects.annotate(
+        day=TruncDate("created_at", tzinfo=dt_timezone.utc)
+    ).values("user_id", "day", "platform").annotate(
+        profit=Sum("rider_profit"), debt=Sum("platform_debt"), tips=Sum("tip_amount"), count=Count("id")
+    ).order_by():
+        rollup = rollups.setdefault(
+            (row["user_id"], row["day"], row["platform"]),
+            DailyRollup(user_id=row["user_id"], day=row["day"], platform=row["platform"]),
+        )
+        rollup.rider_profit = row["profit"] or 0
+        rollup.platform_debt = row["debt"] or 0
+        rollup.tip_amount = row["tips"] or 0
+        rollup.transaction_count = row["count"]
+
+    for row in Expense.objects.annotate(
+        day=TruncDate("created_at", tzinfo=dt_timezone.utc)
+    ).values("user_id", "day", "category").annotate(total=Sum("amount"), count=Count("id")).order_by():
+        rollup = rollups.setdefault(
+            (row["user_id"], row["day"], ""),
+            DailyRollup(user_id=row["user_id"], day=row["day"], platform=""),
+        )
+        column = EXPENSE_COLUMNS.get(row["category"], "other_expenses")
+        setattr(rollup, column, getattr(rollup, column) + (row["total"] or 0))
+        rollup.expense_count += row["count"]
+
+    DailyRollup.objects.bulk_create(rollups.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0007_transaction_tip_amount'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('platform', models.CharField(blank=True, max_length=10)),
+                ('rider_profit', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('platform_debt', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('tip_amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('transaction_count', models.IntegerField(default=0)),
+                ('fuel_expenses', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('data_expenses', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('food_expenses', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('repairs_expenses', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('other_expenses', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('expense_count', models.IntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_rollups', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'day', 'platform'), name='unique_daily_rollup')],
+            },
+        ),
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:23
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def backfill_balances(apps, schema_editor):
+    Transaction = apps.get_model("transactions", "Transaction")
+    PlatformDebtBalance = apps.get_model("transactions", "PlatformDebtBalance")
+    PlatformDebtBalance.objects.bulk_create(
+        [
+            PlatformDebtBalance(user_id=row["user_id"], platform=row["platform"], balance=row["debt"] or 0)
+            for row in Transaction.objects.values("user_id", "platform").annotate(debt=Sum("platform_debt")).order_by()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0011_delta_sync'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlatformDebtBalance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('platform', models.CharField(choices=[('YANGO', 'Yango'), ('BOLT', 'Bolt'), ('PRIVATE', 'Private')], max_length=10)),
+                ('balance', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='debt_balances', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'platform'), name='unique_platform_debt_balance')],
+            },
+        ),
+        migrations.RunPython(backfill_balances, migrations.RunPython.noop),
+    ]
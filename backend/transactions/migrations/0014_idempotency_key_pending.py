@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-17 05:00
+
+import django.core.serializers.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0013_driver_profile'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='idempotencykey',
+            name='response_body',
+            field=models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder, null=True),
+        ),
+        migrations.AlterField(
+            model_name='idempotencykey',
+            name='response_status',
+            field=models.PositiveSmallIntegerField(null=True),
+        ),
+    ]
@@ -1,7 +1,75 @@
-from django.db import models
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, connections, models, transaction
+from django.db.models import signals
 from django.contrib.auth.models import User
 
 
+class TransactionManager(models.Manager):
+    def insert_or_get(self, **fields):
+        """
+        Insert a transaction unless its tx_id already exists.
+
+        Returns (transaction, created). Safe under concurrent retries: the
+        unique tx_id is resolved by the database (ON CONFLICT) instead of a
+        read-then-write, so a race never surfaces as an IntegrityError.
+        PostgreSQL answers in a single statement; SQLite needs a second
+        lookup only when the tx_id was already stored.
+        """
+        obj = self.model(**fields)
+        obj.department = self.model.department_for(obj.platform)
+        connection = connections[self.db]
+
+        if connection.vendor == 'postgresql' or (
+            connection.vendor == 'sqlite' and connection.Database.sqlite_version_info >= (3, 35)
+        ):
+            opts = self.model._meta
+            qn = connection.ops.quote_name
+            insert_fields = [f for f in opts.concrete_fields if not f.primary_key]
+            columns = ', '.join(qn(f.column) for f in insert_fields)
+            returning = ', '.join(qn(f.column) for f in opts.concrete_fields)
+            placeholders = ', '.join(['%s'] * len(insert_fields))
+            table = qn(opts.db_table)
+            tx_id_column = qn(opts.get_field('tx_id').column)
+            params = [f.get_db_prep_save(f.pre_save(obj, True), connection) for f in insert_fields]
+
+            insert = (
+                f"INSERT INTO {table} ({columns}) VALUES ({placeholders}) "
+                f"ON CONFLICT ({tx_id_column}) DO NOTHING RETURNING {returning}"
+            )
+            if connection.vendor == 'postgresql':
+                sql = (
+                    f"WITH ins AS ({insert}, TRUE AS created) "
+                    f"SELECT {returning}, created FROM ins UNION ALL "
+                    f"SELECT {returning}, FALSE FROM {table} "
+                    f"WHERE {tx_id_column} = %s AND NOT EXISTS (SELECT 1 FROM ins)"
+                )
+                params.append(obj.tx_id)
+            else:
+                sql = f"{insert}, 1 AS created"
+
+            rows = list(self.raw(sql, params).using(self.db))
+            if rows:
+                created = bool(rows[0].created)
+                if created:
+                    # Keep post_save receivers (cache invalidation) working
+                    # as they would for Model.save()
+                    signals.post_save.send(
+                        sender=self.model, instance=rows[0], created=True,
+                        update_fields=None, raw=False, using=self.db,
+                    )
+                return rows[0], created
+            # SQLite conflict, or a PostgreSQL conflict with a row committed
+            # after this statement's snapshot was taken
+            return self.get(tx_id=obj.tx_id), False
+
+        try:
+            with transaction.atomic(using=self.db):
+                obj.save(force_insert=True, using=self.db)
+            return obj, True
+        except IntegrityError:
+            return self.get(tx_id=obj.tx_id), False
+
+
 class Transaction(models.Model):
     PLATFORM_CHOICES = [
         ("YANGO", "Yango"),
@@ -41,14 +109,30 @@ class Transaction(models.Model):
     tip_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
 
     created_at = models.DateTimeField(db_index=True)
+    # Drives delta sync (GET /api/sync/)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = TransactionManager()
+
+    class Meta:
+        indexes = [
+            # Lists, keyset pages and date-range summaries: user, then created_at
+            models.Index(fields=['user', 'created_at', 'id'], name='tx_user_created_idx'),
+            # Per-platform debt totals (debt ledger reconciliation)
+            models.Index(fields=['user', 'platform'], name='tx_user_platform_idx'),
+            models.Index(fields=['user', 'updated_at', 'id'], name='tx_user_updated_idx'),
+        ]
+
+    @staticmethod
+    def department_for(platform):
+        if platform == 'YANGO':
+            return 'INVESTMENT'
+        elif platform == 'BOLT':
+            return 'REVENUE'
+        return 'OTHER'
 
     def save(self, *args, **kwargs):
-        if self.platform == 'YANGO':
-            self.department = 'INVESTMENT'
-        elif self.platform == 'BOLT':
-            self.department = 'REVENUE'
-        else:
-            self.department = 'OTHER'
+        self.department = self.department_for(self.platform)
         super().save(*args, **kwargs)
 
     def __str__(self):
@@ -71,6 +155,142 @@ class Expense(models.Model):
     category = models.CharField(max_length=10, choices=CATEGORY_CHOICES, db_index=True)
     description = models.TextField(blank=True)
     created_at = models.DateTimeField(db_index=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'created_at', 'id'], name='exp_user_created_idx'),
+            models.Index(fields=['user', 'updated_at', 'id'], name='exp_user_updated_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.category} - GHS {self.amount}"
+
+
+class DailyRollup(models.Model):
+    """
+    Running totals per user, per UTC day, per platform.
+
+    Maintained incrementally by transactions.rollups on every write so that
+    summaries cost O(days) instead of O(transactions). Expenses are not tied
+    to a platform and are accumulated on the row with an empty platform.
+    """
+    EXPENSES_PLATFORM = ""
+
+    # Maps Expense.category to the rollup column holding its total
+    EXPENSE_COLUMNS = {
+        "FUEL": "fuel_expenses",
+        "DATA": "data_expenses",
+        "FOOD": "food_expenses",
+        "REPAIRS": "repairs_expenses",
+        "OTHER": "other_expenses",
+    }
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='daily_rollups')
+    day = models.DateField()
+    platform = models.CharField(max_length=10, blank=True)
+
+    rider_profit = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    platform_debt = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    tip_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    transaction_count = models.IntegerField(default=0)
+
+    fuel_expenses = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    data_expenses = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    food_expenses = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    repairs_expenses = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    other_expenses = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    expense_count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'day', 'platform'], name='unique_daily_rollup'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} - {self.day} - {self.platform or 'EXPENSES'}"
+
+
+class PlatformDebtBalance(models.Model):
+    """
+    Outstanding platform debt per user and platform: the running sum of
+    Transaction.platform_debt.
+
+    Updated with F() increments by transactions.rollups alongside every
+    Transaction write, so debt clearing and the dashboard read a handful of
+    rows instead of aggregating the whole history.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='debt_balances')
+    platform = models.CharField(max_length=10, choices=Transaction.PLATFORM_CHOICES)
+    balance = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'platform'], name='unique_platform_debt_balance'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} - {self.platform} - GHS {self.balance}"
+
+
+class DriverProfile(models.Model):
+    """
+    Per-driver preferences. Created on first change; drivers without one
+    use the DEFAULT_USER_TIMEZONE setting (see transactions.periods).
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='driver_profile')
+    # IANA name; local day, week and month boundaries for summaries
+    timezone = models.CharField(max_length=64)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.user_id} - {self.timezone}"
+
+
+class IdempotencyKey(models.Model):
+    """
+    Stored response for a write made with an Idempotency-Key header, replayed
+    when the client retries the same request. response_status is null while
+    the first request is still running.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='idempotency_keys')
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64)
+    response_status = models.PositiveSmallIntegerField(null=True)
+    response_body = models.JSONField(encoder=DjangoJSONEncoder, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='unique_idempotency_key'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} - {self.key}"
+
+
+class Tombstone(models.Model):
+    """
+    Record of a deleted Transaction or Expense, so delta sync clients can
+    drop it from their local replica.
+    """
+    TRANSACTION = "transaction"
+    EXPENSE = "expense"
+    MODEL_CHOICES = [
+        (TRANSACTION, "Transaction"),
+        (EXPENSE, "Expense"),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='tombstones')
+    model = models.CharField(max_length=20, choices=MODEL_CHOICES)
+    object_id = models.BigIntegerField()
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'deleted_at', 'id'], name='tombstone_user_deleted_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} - {self.model} {self.object_id}"
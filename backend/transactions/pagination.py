@@ -0,0 +1,113 @@
+import base64
+import json
+import logging
+from datetime import datetime
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+logger = logging.getLogger(__name__)
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination keyed on (created_at, id), newest first.
+
+    Each page is a single index range scan starting after the last row of the
+    previous page, so the cost of a page does not grow with the size of the
+    user's history (unlike OFFSET based pagination).
+
+    Old clients that still expect a plain list can opt out with
+    ?page_size=all.
+    """
+    page_size = api_settings.PAGE_SIZE or 50
+    max_page_size = 500
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    unpaginated_value = 'all'
+    ordering = ('-created_at', '-id')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        if page_size is None:
+            # Legacy mode: the view serializes the whole (ordered) queryset
+            return None
+
+        queryset = queryset.order_by(*self.ordering)
+        position = self.decode_cursor(request)
+        if position is not None:
+            created_at, pk = position
+            queryset = queryset.filter(
+                Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk)
+            )
+
+        # Fetch one extra row to find out whether there is a next page
+        rows = list(queryset[:page_size + 1])
+        self.has_next = len(rows) > page_size
+        self.page = rows[:page_size]
+        self.next_position = None
+        if self.has_next:
+            # Model instances or named value rows (see transactions.rows)
+            last = self.page[-1]
+            self.next_position = (last.created_at, last.id)
+        return self.page
+
+    def get_page_size(self, request):
+        value = request.query_params.get(self.page_size_query_param)
+        if value is None:
+            return self.page_size
+        if value == self.unpaginated_value:
+            return None
+        try:
+            size = int(value)
+        except ValueError:
+            return self.page_size
+        if size <= 0:
+            return self.page_size
+        return min(size, self.max_page_size)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            padded = encoded + '=' * (-len(encoded) % 4)
+            created_at, pk = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+            return datetime.fromisoformat(created_at), int(pk)
+        except (TypeError, ValueError, UnicodeError):
+            logger.warning(f"KeysetPagination received invalid cursor: {encoded}")
+            raise NotFound('Invalid cursor')
+
+    def encode_cursor(self, position):
+        created_at, pk = position
+        raw = json.dumps([created_at.isoformat(), pk]).encode('utf-8')
+        return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.next_position))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'next_cursor': self.encode_cursor(self.next_position) if self.has_next else None,
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'next_cursor': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
@@ -0,0 +1,23 @@
+"""
+Request parsers.
+
+MessagePackParser accepts Content-Type: application/msgpack bodies (e.g.
+bulk ingestion from the mobile app). Integer money and timestamps in the
+body are converted by serializers.WireFormatMixin, as for responses.
+"""
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+from .renderers import MSGPACK_MEDIA_TYPE, msgpack
+
+
+class MessagePackParser(BaseParser):
+    media_type = MSGPACK_MEDIA_TYPE
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        if msgpack is None:
+            raise ParseError('MessagePack requests are not supported on this server')
+        try:
+            return msgpack.unpackb(stream.read(), raw=False)
+        except (ValueError, TypeError) as exc:
+            raise ParseError(f'MessagePack parse error - {exc or type(exc).__name__}')
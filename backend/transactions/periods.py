@@ -0,0 +1,89 @@
+"""
+Local calendar periods as half-open created_at ranges.
+
+Summaries never filter on created_at__date: that casts the indexed column
+(no index range scan) and uses the server's UTC date. Instead "today",
+"this week" and friends are resolved here, in the driver's own timezone
+(DriverProfile.timezone), to a [start, end) pair of aware datetimes that
+queries compare created_at against directly.
+"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import DriverProfile
+
+# Named periods and the calendar unit they cover
+PERIODS = {
+    'today': 'day',
+    'yesterday': 'day',
+    'this_week': 'week',
+    'last_week': 'week',
+    'this_month': 'month',
+    'last_month': 'month',
+}
+
+
+def default_timezone_name():
+    return getattr(settings, 'DEFAULT_USER_TIMEZONE', 'Africa/Accra')
+
+
+def get_timezone(name):
+    """ZoneInfo for an IANA name; raises ValueError for unknown names."""
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ValueError(f'Unknown timezone: {name}')
+
+
+def user_timezone(user):
+    """The driver's timezone, or DEFAULT_USER_TIMEZONE if they never set one."""
+    name = DriverProfile.objects.filter(user=user).values_list('timezone', flat=True).first()
+    return get_timezone(name or default_timezone_name())
+
+
+def bucket_start(value, bucket, tz):
+    """Start of the day/week/month (or hour) containing aware datetime `value`, in tz."""
+    local = value.astimezone(tz)
+    if bucket == 'hour':
+        return local.replace(minute=0, second=0, microsecond=0)
+    day = datetime(local.year, local.month, local.day, tzinfo=tz)
+    if bucket == 'day':
+        return day
+    if bucket == 'week':
+        # Monday, as Trunc('week') does
+        start = day.date() - timedelta(days=day.weekday())
+        return datetime(start.year, start.month, start.day, tzinfo=tz)
+    return datetime(local.year, local.month, 1, tzinfo=tz)
+
+
+def next_bucket(start, bucket, tz):
+    if bucket == 'hour':
+        # Step in absolute time so DST changes neither skip nor repeat an hour
+        return (start.astimezone(dt_timezone.utc) + timedelta(hours=1)).astimezone(tz)
+    if bucket == 'day':
+        following = start.date() + timedelta(days=1)
+    elif bucket == 'week':
+        following = start.date() + timedelta(weeks=1)
+    else:
+        following = (start.replace(day=28) + timedelta(days=4)).replace(day=1).date()
+    return datetime(following.year, following.month, following.day, tzinfo=tz)
+
+
+def day_range(day, tz):
+    """[start, end) of local calendar date `day` in tz (23 or 25 hours long on DST changes)."""
+    start = datetime(day.year, day.month, day.day, tzinfo=tz)
+    return start, next_bucket(start, 'day', tz)
+
+
+def period_range(period, tz, now=None):
+    """[start, end) of a named period (a key of PERIODS) in tz, relative to now."""
+    unit = PERIODS[period]
+    start = bucket_start(now or timezone.now(), unit, tz)
+    if period in ('yesterday', 'last_week', 'last_month'):
+        end = start
+        start = bucket_start(start - timedelta(microseconds=1), unit, tz)
+        return start, end
+    return start, next_bucket(start, unit, tz)
@@ -0,0 +1,115 @@
+"""
+Response renderers.
+
+FastJSONRenderer is a drop-in replacement for DRF's JSONRenderer: same media type and output
+shape. datetime and UUID values are encoded by orjson itself, Decimal as a
+float (as DRF's encoder does) and anything else (lazy strings, timedeltas,
+querysets, ...) by DRF's encoder. Pretty-printed output (?indent= in
+Accept, the browsable API) and installs without orjson go through DRF's
+renderer unchanged.
+
+MessagePackRenderer (Accept: application/msgpack) is for mobile clients on
+metered data: money is sent as integer minor units (pesewas) and
+timestamps as integer milliseconds since the Unix epoch.
+"""
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from decimal import ROUND_HALF_EVEN, Decimal
+
+from django.utils import timezone
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:  # optional dependency, see requirements.txt
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # optional dependency, see requirements.txt
+    msgpack = None
+
+MSGPACK_MEDIA_TYPE = 'application/msgpack'
+# Every Decimal the API returns is an amount of money in GHS
+MONEY_DECIMAL_PLACES = 2
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+MILLISECOND = timedelta(milliseconds=1)
+
+LINE_SEPARATOR = '\u2028'.encode('utf-8')
+PARAGRAPH_SEPARATOR = '\u2029'.encode('utf-8')
+
+
+class FastJSONRenderer(JSONRenderer):
+    # OPT_UTC_Z: "2024-01-15T10:30:00Z" like DRF, rather than "+00:00"
+    options = orjson.OPT_NON_STR_KEYS | orjson.OPT_UTC_Z if orjson else 0
+    fallback_encoder = JSONEncoder()
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None:
+            return super().render(data, accepted_media_type, renderer_context)
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            ret = orjson.dumps(data, default=self.default, option=self.options)
+        except orjson.JSONEncodeError:
+            # e.g. integers beyond 64 bits, which the json module handles
+            return super().render(data, accepted_media_type, renderer_context)
+        # Same as JSONRenderer: keep the output a strict JavaScript subset
+        if LINE_SEPARATOR in ret or PARAGRAPH_SEPARATOR in ret:
+            ret = ret.replace(LINE_SEPARATOR, b'\\u2028').replace(PARAGRAPH_SEPARATOR, b'\\u2029')
+        return ret
+
+    def default(self, obj):
+        if isinstance(obj, Decimal):
+            return float(obj)
+        return self.fallback_encoder.default(obj)
+
+
+def to_minor_units(value):
+    """Decimal('12.50') -> 1250"""
+    return int(value.scaleb(MONEY_DECIMAL_PLACES).to_integral_value(ROUND_HALF_EVEN))
+
+
+def from_minor_units(value):
+    """1250 -> Decimal('12.50')"""
+    return Decimal(value).scaleb(-MONEY_DECIMAL_PLACES)
+
+
+def to_epoch_ms(value):
+    if timezone.is_naive(value):
+        value = timezone.make_aware(value)
+    return (value - EPOCH) // MILLISECOND
+
+
+def from_epoch_ms(value):
+    return EPOCH + value * MILLISECOND
+
+
+class MessagePackRenderer(BaseRenderer):
+    media_type = MSGPACK_MEDIA_TYPE
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+    # Serializers check this to emit integer money and timestamps
+    # (serializers.WireFormatMixin, rows.row_encoder_for)
+    integer_values = True
+    fallback_encoder = JSONEncoder()
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if msgpack is None:
+            raise RuntimeError('The msgpack package is required for application/msgpack responses')
+        return msgpack.packb(data, default=self.default, use_bin_type=True)
+
+    def default(self, obj):
+        # Values views return directly (summaries); serializer output is
+        # already converted
+        if isinstance(obj, Decimal):
+            return to_minor_units(obj)
+        if isinstance(obj, datetime):
+            return to_epoch_ms(obj)
+        if isinstance(obj, date):
+            return obj.isoformat()
+        return self.fallback_encoder.default(obj)
@@ -0,0 +1,186 @@
+"""
+Read replicas for summary, list, export and analytics traffic.
+
+Views with ReplicaReadMixin serve GET/HEAD requests from one of the aliases
+in DATABASE_REPLICAS['ALIASES'] (picked at random among the healthy ones);
+everything else, writes and SMS ingestion included, stays on the primary
+('default'). ReplicaRouter sends a query to the alias chosen for the
+current request, or to the primary when none was.
+
+Read-your-writes: notify_change() marks the owner of changed data, in the
+default cache, for STICKY_SECONDS; their reads stay on the primary until
+the replicas have caught up. All data is per user, so nobody else can
+read it stale. Set REDIS_URL with several workers so the mark reaches all
+of them.
+
+A replica that cannot be reached (or, on PostgreSQL, lags by more than
+STICKY_SECONDS) is skipped for RETRY_SECONDS, and its reads fall back to
+the other replicas or the primary.
+"""
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from rest_framework.permissions import SAFE_METHODS
+
+logger = logging.getLogger(__name__)
+
+STICKY_KEY = 'replicas:sticky:{user_id}'
+# Connecting alone proves little: SQLite creates an empty file at a missing path
+HEALTH_QUERY = 'SELECT 1 FROM django_migrations LIMIT 1'
+
+_read_alias = ContextVar('read_alias', default=None)
+
+
+def replica_config():
+    return getattr(settings, 'DATABASE_REPLICAS', {})
+
+
+def replica_aliases():
+    return replica_config().get('ALIASES', [])
+
+
+def sticky_seconds():
+    return replica_config().get('STICKY_SECONDS', 10)
+
+
+def current_alias():
+    """The replica serving the current request's reads, or None for the primary."""
+    return _read_alias.get()
+
+
+def mark_recent_write(user_id):
+    """Keep user_id's reads on the primary while the replicas catch up."""
+    if replica_aliases():
+        cache.set(STICKY_KEY.format(user_id=user_id), True, timeout=sticky_seconds())
+
+
+def has_recent_write(user_id):
+    return cache.get(STICKY_KEY.format(user_id=user_id)) is not None
+
+
+class ReplicaHealth:
+    """Per-process view of which replicas are usable; a failed one rests for RETRY_SECONDS."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._down_until = {}
+        self._checked_at = {}
+
+    def is_up(self, alias):
+        down_until = self._down_until.get(alias)
+        return down_until is None or down_until <= time.monotonic()
+
+    def mark_down(self, alias, reason):
+        retry = replica_config().get('RETRY_SECONDS', 30)
+        with self._lock:
+            self._down_until[alias] = time.monotonic() + retry
+        logger.warning(f"Replica {alias} unavailable ({reason}); reading from the primary for {retry}s")
+
+    def check(self, alias):
+        """Query (and on PostgreSQL, measure replay lag) at most every CHECK_INTERVAL seconds."""
+        now = time.monotonic()
+        if now - self._checked_at.get(alias, float('-inf')) < replica_config().get('CHECK_INTERVAL', 5):
+            return self.is_up(alias)
+        self._checked_at[alias] = now
+        connection = connections[alias]
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(HEALTH_QUERY)
+            if connection.vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        'SELECT EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) '
+                        'WHERE pg_is_in_recovery()'
+                    )
+                    row = cursor.fetchone()
+                # No row on a primary; NULL before anything was replayed
+                lag = row[0] if row else None
+                if lag is not None and lag > sticky_seconds():
+                    self.mark_down(alias, f'{lag:.1f}s behind')
+                    return False
+        except DatabaseError as exc:
+            self.mark_down(alias, exc)
+            return False
+        return self.is_up(alias)
+
+
+health = ReplicaHealth()
+
+
+def choose_alias(user):
+    """A healthy replica for user's reads, or None when they must stay on the primary."""
+    aliases = replica_aliases()
+    if not aliases or not user.is_authenticated or has_recent_write(user.id):
+        return None
+    candidates = [alias for alias in aliases if health.is_up(alias)]
+    random.shuffle(candidates)
+    for alias in candidates:
+        if health.check(alias):
+            return alias
+    return None
+
+
+@contextmanager
+def reads_from(alias):
+    """Route the reads inside the block to alias (None: the primary)."""
+    token = _read_alias.set(alias)
+    try:
+        yield
+    except DatabaseError as exc:
+        if alias is not None:
+            health.mark_down(alias, exc)
+        raise
+    finally:
+        _read_alias.reset(token)
+
+
+class ReplicaRouter:
+    """Reads go where the current request was routed; writes and migrations to the primary."""
+
+    def db_for_read(self, model, **hints):
+        return _read_alias.get() or DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get the schema through replication (or refresh_replica)
+        return db not in replica_aliases()
+
+
+class ReplicaReadMixin:
+    """
+    Serve this view's GET and HEAD requests from a read replica. The
+    choice is made after authentication (which always reads the primary)
+    and lasts until the response is returned; streaming views must bind
+    their querysets to current_alias() themselves. A read that fails on a
+    replica rests it and is retried on another replica or the primary.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        with reads_from(None):
+            while True:
+                try:
+                    return super().dispatch(request, *args, **kwargs)
+                except DatabaseError as exc:
+                    alias = current_alias()
+                    if alias is None:
+                        raise
+                    # choose_alias() skips it from now on, so this ends on the primary at the latest
+                    health.mark_down(alias, exc)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if request.method in SAFE_METHODS:
+            _read_alias.set(choose_alias(request.user))
@@ -0,0 +1,359 @@
+"""
+Incrementally maintained daily rollups and platform debt ledger.
+
+Every Transaction/Expense write made through the API applies its delta to the
+matching DailyRollup row, and a transaction's platform_debt to the user's
+PlatformDebtBalance, inside the same database transaction. Summaries then
+read whole days from the rollups and only touch raw rows for the partial days
+at the edges of the requested range; outstanding debt is read straight from
+the ledger.
+"""
+import logging
+from collections import defaultdict
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+from django.db import models, transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import DailyRollup, Expense, PlatformDebtBalance, Transaction
+
+logger = logging.getLogger(__name__)
+
+ZERO = Decimal('0.00')
+
+TRANSACTION_COLUMNS = ('rider_profit', 'platform_debt', 'tip_amount', 'transaction_count')
+EXPENSE_COLUMNS = tuple(DailyRollup.EXPENSE_COLUMNS.values()) + ('expense_count',)
+
+
+def _decimal(value):
+    if value is None:
+        return ZERO
+    if isinstance(value, Decimal):
+        return value
+    return Decimal(str(value))
+
+
+def _money(value):
+    # SQLite sums decimal columns as floats (8904.51000000001); stored totals have two places
+    return _decimal(value).quantize(ZERO)
+
+
+def rollup_day(created_at):
+    """UTC calendar day a row is accumulated under."""
+    if timezone.is_naive(created_at):
+        created_at = timezone.make_aware(created_at)
+    return created_at.astimezone(dt_timezone.utc).date()
+
+
+def _day_start(day):
+    return datetime.combine(day, time.min, tzinfo=dt_timezone.utc)
+
+
+def _bump(user_id, day, platform, deltas):
+    rollup, _ = DailyRollup.objects.get_or_create(user_id=user_id, day=day, platform=platform)
+    DailyRollup.objects.filter(pk=rollup.pk).update(
+        **{column: F(column) + delta for column, delta in deltas.items()}
+    )
+
+
+def _bump_debt(user_id, platform, delta):
+    if not delta:
+        return
+    # Existing balance: a single UPDATE, which also row-locks it until commit
+    balances = PlatformDebtBalance.objects.filter(user_id=user_id, platform=platform)
+    increment = {'balance': F('balance') + delta, 'updated_at': timezone.now()}
+    if not balances.update(**increment):
+        PlatformDebtBalance.objects.get_or_create(user_id=user_id, platform=platform)
+        balances.update(**increment)
+
+
+def apply_transaction(tx, sign=1):
+    """Add (sign=1) or remove (sign=-1) a transaction from its daily rollup and the debt ledger."""
+    _bump(tx.user_id, rollup_day(tx.created_at), tx.platform, {
+        'rider_profit': sign * _decimal(tx.rider_profit),
+        'platform_debt': sign * _decimal(tx.platform_debt),
+        'tip_amount': sign * _decimal(tx.tip_amount),
+        'transaction_count': sign,
+    })
+    _bump_debt(tx.user_id, tx.platform, sign * _decimal(tx.platform_debt))
+
+
+def apply_transactions(transactions):
+    """
+    Add many new transactions to their rollups and the debt ledger, one
+    update per (user, day, platform) and (user, platform) rather than one
+    per row.
+    """
+    deltas = {}
+    debts = defaultdict(Decimal)
+    for tx in transactions:
+        key = (tx.user_id, rollup_day(tx.created_at), tx.platform)
+        delta = deltas.setdefault(key, {
+            'rider_profit': ZERO, 'platform_debt': ZERO, 'tip_amount': ZERO, 'transaction_count': 0,
+        })
+        delta['rider_profit'] += _decimal(tx.rider_profit)
+        delta['platform_debt'] += _decimal(tx.platform_debt)
+        delta['tip_amount'] += _decimal(tx.tip_amount)
+        delta['transaction_count'] += 1
+        debts[(tx.user_id, tx.platform)] += _decimal(tx.platform_debt)
+    for (user_id, day, platform), delta in deltas.items():
+        _bump(user_id, day, platform, delta)
+    for (user_id, platform), delta in debts.items():
+        _bump_debt(user_id, platform, delta)
+
+
+def apply_expense(expense, sign=1):
+    """Add (sign=1) or remove (sign=-1) an expense from its daily rollup."""
+    column = DailyRollup.EXPENSE_COLUMNS.get(expense.category, 'other_expenses')
+    _bump(expense.user_id, rollup_day(expense.created_at), DailyRollup.EXPENSES_PLATFORM, {
+        column: sign * _decimal(expense.amount),
+        'expense_count': sign,
+    })
+
+
+def _total_expenses():
+    total = None
+    for column in DailyRollup.EXPENSE_COLUMNS.values():
+        total = F(column) if total is None else total + F(column)
+    return total
+
+
+def _empty_summary():
+    return {
+        'total_profit': ZERO,
+        'total_debt': ZERO,
+        'yango_income': ZERO,
+        'bolt_income': ZERO,
+        'yango_debt': ZERO,
+        'bolt_debt': ZERO,
+        'tips': ZERO,
+        'expenses': ZERO,
+        'transaction_count': 0,
+        'expense_count': 0,
+    }
+
+
+def _add(summary, values):
+    for key, value in values.items():
+        if value:
+            summary[key] += value
+
+
+def summarize(user, start, end):
+    """
+    Totals for user's transactions and expenses with start <= created_at < end.
+
+    Whole UTC days come from DailyRollup (one query); the partial days at
+    either edge are aggregated from the raw rows (at most two more queries).
+    """
+    summary = _empty_summary()
+    if end <= start:
+        return summary
+
+    first_full_day = rollup_day(start)
+    if _day_start(first_full_day) < start:
+        first_full_day += timedelta(days=1)
+    end_day = rollup_day(end)
+
+    edges = Q(created_at__gte=start, created_at__lt=end)
+    if first_full_day < end_day:
+        _add(summary, DailyRollup.objects.filter(
+            user=user, day__gte=first_full_day, day__lt=end_day
+        ).aggregate(
+            total_profit=Sum('rider_profit'),
+            total_debt=Sum('platform_debt'),
+            yango_income=Sum('rider_profit', filter=Q(platform='YANGO')),
+            bolt_income=Sum('rider_profit', filter=Q(platform='BOLT')),
+            yango_debt=Sum('platform_debt', filter=Q(platform='YANGO')),
+            bolt_debt=Sum('platform_debt', filter=Q(platform='BOLT')),
+            tips=Sum('tip_amount'),
+            expenses=Sum(_total_expenses(), output_field=models.DecimalField()),
+            transaction_count=Sum('transaction_count'),
+            expense_count=Sum('expense_count'),
+        ))
+        edges = (
+            Q(created_at__gte=start, created_at__lt=_day_start(first_full_day))
+            | Q(created_at__gte=_day_start(end_day), created_at__lt=end)
+        )
+        if start == _day_start(first_full_day) and end == _day_start(end_day):
+            return summary
+
+    _add(summary, Transaction.objects.filter(edges, user=user).aggregate(
+        total_profit=Sum('rider_profit'),
+        total_debt=Sum('platform_debt'),
+        yango_income=Sum('rider_profit', filter=Q(platform='YANGO')),
+        bolt_income=Sum('rider_profit', filter=Q(platform='BOLT')),
+        yango_debt=Sum('platform_debt', filter=Q(platform='YANGO')),
+        bolt_debt=Sum('platform_debt', filter=Q(platform='BOLT')),
+        tips=Sum('tip_amount'),
+        transaction_count=Count('id'),
+    ))
+    _add(summary, Expense.objects.filter(edges, user=user).aggregate(
+        expenses=Sum('amount'),
+        expense_count=Count('id'),
+    ))
+    return summary
+
+
+def debt_by_platform(user, lock=False):
+    """
+    Outstanding platform debt per platform, from the ledger (one query over
+    at most one row per platform). Platforms without a balance are omitted.
+
+    lock=True selects the rows FOR UPDATE; use it inside transaction.atomic()
+    when the result decides a write (debt clearing).
+    """
+    balances = PlatformDebtBalance.objects.filter(user=user)
+    if lock:
+        balances = balances.select_for_update()
+    return dict(balances.order_by('platform').values_list('platform', 'balance'))
+
+
+def compute_rollups(user_ids=None):
+    """
+    Rollup values recomputed from the raw rows, keyed by (user_id, day, platform).
+
+    Runs two grouped queries regardless of how many rows are covered.
+    """
+    transactions = Transaction.objects.all()
+    expenses = Expense.objects.all()
+    if user_ids is not None:
+        transactions = transactions.filter(user_id__in=user_ids)
+        expenses = expenses.filter(user_id__in=user_ids)
+
+    rollups = defaultdict(dict)
+    for row in transactions.annotate(
+        day=TruncDate('created_at', tzinfo=dt_timezone.utc)
+    ).values('user_id', 'day', 'platform').annotate(
+        profit=Sum('rider_profit'),
+        debt=Sum('platform_debt'),
+        tips=Sum('tip_amount'),
+        count=Count('id'),
+    ).order_by():
+        rollups[(row['user_id'], row['day'], row['platform'])].update({
+            'rider_profit': _money(row['profit']),
+            'platform_debt': _money(row['debt']),
+            'tip_amount': _money(row['tips']),
+            'transaction_count': row['count'],
+        })
+
+    for row in expenses.annotate(
+        day=TruncDate('created_at', tzinfo=dt_timezone.utc)
+    ).values('user_id', 'day', 'category').annotate(
+        total=Sum('amount'),
+        count=Count('id'),
+    ).order_by():
+        values = rollups[(row['user_id'], row['day'], DailyRollup.EXPENSES_PLATFORM)]
+        column = DailyRollup.EXPENSE_COLUMNS.get(row['category'], 'other_expenses')
+        values[column] = values.get(column, ZERO) + _money(row['total'])
+        values['expense_count'] = values.get('expense_count', 0) + row['count']
+    return rollups
+
+
+def rebuild_rollups(user_ids=None, batch_size=1000):
+    """Replace stored rollups with values recomputed from the raw rows."""
+    rollups = compute_rollups(user_ids)
+    with transaction.atomic():
+        existing = DailyRollup.objects.all()
+        if user_ids is not None:
+            existing = existing.filter(user_id__in=user_ids)
+        existing.delete()
+        DailyRollup.objects.bulk_create(
+            [
+                DailyRollup(user_id=user_id, day=day, platform=platform, **values)
+                for (user_id, day, platform), values in rollups.items()
+            ],
+            batch_size=batch_size,
+        )
+    logger.info(f"Rebuilt {len(rollups)} daily rollups")
+    return len(rollups)
+
+
+def find_rollup_mismatches(user_ids=None):
+    """
+    Compare stored rollups against the raw rows.
+
+    Returns a list of (user_id, day, platform, column, stored, expected) tuples;
+    an empty list means the rollups are consistent.
+    """
+    expected = compute_rollups(user_ids)
+    stored = DailyRollup.objects.all()
+    if user_ids is not None:
+        stored = stored.filter(user_id__in=user_ids)
+
+    columns = TRANSACTION_COLUMNS + EXPENSE_COLUMNS
+    mismatches = []
+    seen = set()
+    for rollup in stored:
+        key = (rollup.user_id, rollup.day, rollup.platform)
+        seen.add(key)
+        values = expected.get(key, {})
+        for column in columns:
+            stored_value = getattr(rollup, column)
+            expected_value = values.get(column, 0)
+            if stored_value != expected_value:
+                mismatches.append(key + (column, stored_value, expected_value))
+
+    for key, values in expected.items():
+        if key in seen:
+            continue
+        for column, expected_value in values.items():
+            if expected_value:
+                mismatches.append(key + (column, 0, expected_value))
+    return mismatches
+
+
+def compute_debt_balances(user_ids=None):
+    """Ledger balances recomputed from the raw rows, keyed by (user_id, platform)."""
+    transactions = Transaction.objects.all()
+    if user_ids is not None:
+        transactions = transactions.filter(user_id__in=user_ids)
+    return {
+        (row['user_id'], row['platform']): _money(row['debt'])
+        for row in transactions.values('user_id', 'platform').annotate(debt=Sum('platform_debt')).order_by()
+    }
+
+
+def rebuild_debt_balances(user_ids=None, batch_size=1000):
+    """Replace the stored debt ledger with balances recomputed from the raw rows."""
+    balances = compute_debt_balances(user_ids)
+    with transaction.atomic():
+        existing = PlatformDebtBalance.objects.all()
+        if user_ids is not None:
+            existing = existing.filter(user_id__in=user_ids)
+        existing.delete()
+        PlatformDebtBalance.objects.bulk_create(
+            [
+                PlatformDebtBalance(user_id=user_id, platform=platform, balance=balance)
+                for (user_id, platform), balance in balances.items()
+            ],
+            batch_size=batch_size,
+        )
+    logger.info(f"Rebuilt {len(balances)} platform debt balances")
+    return len(balances)
+
+
+def find_debt_mismatches(user_ids=None):
+    """
+    Compare the debt ledger against the raw rows.
+
+    Returns a list of (user_id, platform, stored, expected) tuples; an empty
+    list means the ledger is consistent.
+    """
+    expected = compute_debt_balances(user_ids)
+    stored = PlatformDebtBalance.objects.all()
+    if user_ids is not None:
+        stored = stored.filter(user_id__in=user_ids)
+
+    mismatches = []
+    for user_id, platform, balance in stored.values_list('user_id', 'platform', 'balance'):
+        expected_balance = expected.pop((user_id, platform), ZERO)
+        if balance != expected_balance:
+            mismatches.append((user_id, platform, balance, expected_balance))
+    for (user_id, platform), expected_balance in expected.items():
+        if expected_balance:
+            mismatches.append((user_id, platform, ZERO, expected_balance))
+    return mismatches
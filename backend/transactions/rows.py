@@ -0,0 +1,125 @@
+"""
+Fast read path for list endpoints.
+
+Instead of building a model instance per row and walking DRF field objects,
+list views fetch values_list() tuples and hand them to a RowEncoder compiled
+once per (serializer, fields) pair. The encoder mirrors the serializer's own
+to_representation for the field types our serializers use, so the output is
+identical; a serializer with any other field type gets no encoder and the
+view falls back to the serializer.
+"""
+import logging
+from functools import lru_cache
+
+from django.utils import timezone
+from rest_framework import fields as drf_fields
+from rest_framework.settings import api_settings
+
+from .renderers import to_epoch_ms, to_minor_units
+
+logger = logging.getLogger(__name__)
+
+# Fields whose representation of a database value is the value itself
+PASSTHROUGH_FIELDS = (
+    drf_fields.BooleanField,
+    drf_fields.CharField,
+    drf_fields.ChoiceField,
+    drf_fields.IntegerField,
+)
+
+
+def _decimal_converter(field):
+    if not getattr(field, 'coerce_to_string', api_settings.COERCE_DECIMAL_TO_STRING):
+        return None
+    if field.normalize_output or field.localize:
+        return None
+    if field.decimal_places is None:
+        convert = '{:f}'.format
+    elif field.rounding is None:
+        # Fixed-point formatting rounds half-even like quantize() in the
+        # default context, and database values already fit max_digits
+        convert = ('{:.%df}' % field.decimal_places).format
+    else:
+        return None
+    return lambda: convert
+
+
+def _datetime_converter(field):
+    if getattr(field, 'format', api_settings.DATETIME_FORMAT).lower() != drf_fields.ISO_8601:
+        return None
+
+    def bind():
+        # Once per encode() call: the current timezone may be activated per request
+        field_timezone = field.timezone if hasattr(field, 'timezone') else field.default_timezone()
+        if field_timezone is None:
+            return field.to_representation
+
+        def convert(value):
+            if timezone.is_naive(value):
+                return field.to_representation(value)
+            value = value.astimezone(field_timezone).isoformat()
+            if value.endswith('+00:00'):
+                value = value[:-6] + 'Z'
+            return value
+        return convert
+    return bind
+
+
+class RowEncoder:
+    """
+    Converts value tuples (in `columns` order) into the dicts the serializer
+    would have produced for the same rows.
+
+    `converters` holds, per rendered column, None for pass-through values or
+    a callable returning the value converter for the current request.
+    """
+
+    def __init__(self, names, columns, converters):
+        self.names = names
+        self.columns = columns
+        self.converters = converters
+
+    def encode(self, rows):
+        names = self.names
+        converters = tuple(bind() if bind else None for bind in self.converters)
+        return [
+            {
+                name: value if convert is None or value is None else convert(value)
+                for name, convert, value in zip(names, converters, row)
+            }
+            for row in rows
+        ]
+
+
+@lru_cache(maxsize=None)
+def row_encoder_for(serializer_class, names, extra_columns=(), integer_values=False):
+    """
+    RowEncoder rendering `names` of serializer_class, or None if one of them
+    cannot be rendered from a plain column value.
+
+    extra_columns are fetched after the rendered ones (e.g. pagination keys)
+    and ignored by the encoder. integer_values matches
+    serializers.WireFormatMixin for MessagePack responses.
+    """
+    fields = serializer_class().fields
+    columns, converters = [], []
+    for name in names:
+        field = fields[name]
+        if field.source == '*' or isinstance(field, drf_fields.SerializerMethodField):
+            return None
+        if isinstance(field, drf_fields.DecimalField):
+            convert = (lambda: to_minor_units) if integer_values else _decimal_converter(field)
+        elif isinstance(field, drf_fields.DateTimeField):
+            convert = (lambda: to_epoch_ms) if integer_values else _datetime_converter(field)
+        elif isinstance(field, PASSTHROUGH_FIELDS):
+            convert = None
+        else:
+            logger.info(f"No fast row encoder for {serializer_class.__name__}.{name} ({type(field).__name__})")
+            return None
+        if convert is None and not isinstance(field, PASSTHROUGH_FIELDS):
+            return None
+        columns.append('__'.join(field.source.split('.')))
+        converters.append(convert)
+
+    columns.extend(column for column in extra_columns if column not in columns)
+    return RowEncoder(tuple(names), tuple(columns), tuple(converters))
@@ -5,7 +5,12 @@ import logging
 from django.utils import timezone
 from django.conf import settings
 from rest_framework import serializers
-from .models import Transaction, Expense
+from .models import DriverProfile, Transaction, Expense
+from .periods import get_timezone
+from .renderers import MSGPACK_MEDIA_TYPE, from_epoch_ms, from_minor_units, to_epoch_ms, to_minor_units
+from . import metrics
+from .timing import TimedSerializerMixin
+from .txfilter import tx_id_filter
 
 logger = logging.getLogger(__name__)
 
@@ -59,7 +64,123 @@ def verify_request_hash(tx_id, amount, platform, provided_hash, secret_key=None)
     return hmac.compare_digest(expected_hash, provided_hash)
 
 
-class TransactionSerializer(serializers.ModelSerializer):
+class SparseFieldsetMixin:
+    """
+    Lets readers ask for a subset of fields with ?fields=a,b or ?exclude=a,b.
+
+    The view resolves the selection once (selected_fields) and passes it in
+    the serializer context as 'fields'; unselected fields are dropped before
+    serialization, and model_columns() gives the columns the view should
+    fetch with .only().
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        selected = self.context.get('fields')
+        if selected is not None:
+            for name in set(self.fields) - set(selected):
+                self.fields.pop(name)
+
+    @classmethod
+    def readable_fields(cls):
+        return [name for name, field in cls().fields.items() if not field.write_only]
+
+    @classmethod
+    def selected_fields(cls, query_params):
+        """Field names chosen by ?fields= / ?exclude=, or None when neither is given."""
+        fields = query_params.get('fields')
+        exclude = query_params.get('exclude')
+        if fields is None and exclude is None:
+            return None
+
+        available = cls.readable_fields()
+        errors = {}
+        requested = {}
+        for param, value in (('fields', fields), ('exclude', exclude)):
+            if value is None:
+                continue
+            names = [name.strip() for name in value.split(',') if name.strip()]
+            unknown = [name for name in names if name not in available]
+            if unknown:
+                errors[param] = [f"Unknown field(s): {', '.join(unknown)}"]
+            requested[param] = set(names)
+        if errors:
+            raise serializers.ValidationError(errors)
+
+        selected = requested.get('fields', set(available)) - requested.get('exclude', set())
+        return [name for name in available if name in selected]
+
+    @classmethod
+    def model_columns(cls, selected):
+        """
+        (columns, related) needed to render `selected`: model field paths for
+        .only() and relations for .select_related().
+        """
+        all_fields = cls().fields
+        columns, related = [], []
+        for name in selected:
+            source = all_fields[name].source
+            if source == '*':
+                continue
+            parts = source.split('.')
+            if len(parts) > 1 and parts[0] not in related:
+                related.append(parts[0])
+            columns.append('__'.join(parts))
+        return columns, related
+
+
+class WireFormatMixin:
+    """
+    Integer money and timestamps for MessagePack clients.
+
+    When the negotiated renderer asks for integer values
+    (renderers.MessagePackRenderer), Decimal fields are rendered as minor
+    units and datetimes as epoch milliseconds. For MessagePack request
+    bodies, integers sent for those fields are read the same way.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        self.integer_values = getattr(getattr(request, 'accepted_renderer', None), 'integer_values', False)
+        if self.integer_values:
+            # Let the fields hand over native values; converted in to_representation
+            for field in self.fields.values():
+                if isinstance(field, serializers.DecimalField):
+                    field.coerce_to_string = False
+                elif isinstance(field, serializers.DateTimeField):
+                    field.format = None
+
+    def to_representation(self, instance):
+        ret = super().to_representation(instance)
+        if self.integer_values:
+            for name, field in self.fields.items():
+                value = ret.get(name)
+                if value is None:
+                    continue
+                if isinstance(field, serializers.DecimalField):
+                    ret[name] = to_minor_units(value)
+                elif isinstance(field, serializers.DateTimeField):
+                    ret[name] = to_epoch_ms(value)
+        return ret
+
+    def to_internal_value(self, data):
+        request = self.context.get('request')
+        content_type = getattr(request, 'content_type', '') or ''
+        if content_type.startswith(MSGPACK_MEDIA_TYPE) and isinstance(data, dict):
+            data = dict(data)
+            for name, field in self.fields.items():
+                value = data.get(name)
+                if not isinstance(value, int) or isinstance(value, bool):
+                    continue
+                if isinstance(field, serializers.DecimalField):
+                    data[name] = from_minor_units(value)
+                elif isinstance(field, serializers.DateTimeField):
+                    data[name] = from_epoch_ms(value)
+        return super().to_internal_value(data)
+
+
+class TransactionSerializer(TimedSerializerMixin, SparseFieldsetMixin, WireFormatMixin, serializers.ModelSerializer):
     username = serializers.CharField(source='user.username', read_only=True)
     request_hash = serializers.CharField(write_only=True, required=False, allow_blank=True)
     
@@ -72,6 +193,15 @@ class TransactionSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['user']
 
+    def get_extra_kwargs(self):
+        extra_kwargs = super().get_extra_kwargs()
+        if self.instance is None:
+            # Duplicate tx_ids on create are resolved by the insert itself (see
+            # create), not by a separate uniqueness query per request; updates
+            # keep the validator so a taken tx_id is a 400, not an IntegrityError
+            extra_kwargs['tx_id'] = {**extra_kwargs.get('tx_id', {}), 'validators': []}
+        return extra_kwargs
+
     def validate_created_at(self, value):
         """Handle both string and datetime inputs for created_at"""
         from datetime import datetime
@@ -106,7 +236,9 @@ class TransactionSerializer(serializers.ModelSerializer):
                 logger.warning(f"[SERIALIZER] Hash validation failed for tx_id: {tx_id}")
                 # In production, you might want to reject invalid hashes
                 # For now, we log and allow (backward compatibility)
-                if getattr(settings, 'SMS_HASH_STRICT_MODE', False):
+                strict = getattr(settings, 'SMS_HASH_STRICT_MODE', False)
+                metrics.hmac_failures.inc(rejected=str(strict).lower())
+                if strict:
                     raise serializers.ValidationError({
                         'request_hash': 'Invalid request hash. Transaction may be tampered.'
                     })
@@ -117,24 +249,9 @@ class TransactionSerializer(serializers.ModelSerializer):
         return data
 
     def create(self, validated_data):
-        # Check for duplicate tx_id across all users
         tx_id = validated_data.get('tx_id')
         current_user = validated_data.get('user')
         logger.info(f"[SERIALIZER] create called with tx_id: {tx_id}, user: {current_user}")
-        
-        if tx_id:
-            try:
-                existing = Transaction.objects.get(tx_id=tx_id)
-                logger.info(f"[SERIALIZER] Duplicate transaction found with tx_id: {tx_id}, existing user: {existing.user.id}")
-                logger.info(f"[SERIALIZER] Returning existing transaction (not creating new one)")
-                return existing
-            except Transaction.DoesNotExist:
-                logger.info(f"[SERIALIZER] No duplicate found for tx_id: {tx_id}, proceeding with creation")
-            except Transaction.MultipleObjectsReturned:
-                logger.warning(f"[SERIALIZER] Multiple transactions found for tx_id: {tx_id}, using first")
-                existing = Transaction.objects.filter(tx_id=tx_id).first()
-                logger.info(f"[SERIALIZER] Returning first existing transaction (not creating new one)")
-                return existing
 
         # Automatically assign user from request if not already set
         if 'user' not in validated_data:
@@ -149,11 +266,33 @@ class TransactionSerializer(serializers.ModelSerializer):
         if 'created_at' not in validated_data or validated_data['created_at'] is None:
             validated_data['created_at'] = timezone.now()
 
-        logger.info(f"[SERIALIZER] Creating new transaction with validated_data: user={validated_data.get('user')}")
-        return super().create(validated_data)
+        # A tx_id the filter has probably seen (e.g. an SMS retry) is confirmed
+        # with a read instead of attempting the insert
+        instance = None
+        if tx_id_filter.enabled and tx_id_filter.might_contain(tx_id):
+            instance = Transaction.objects.filter(tx_id=tx_id).first()
+            if instance is None:
+                tx_id_filter.record_false_positive()
+
+        if instance is not None:
+            created = False
+        else:
+            # Single round-trip insert; a duplicate tx_id returns the stored
+            # row instead of failing on the unique constraint
+            instance, created = Transaction.objects.insert_or_get(**validated_data)
+        user = validated_data['user']
+        if not created and instance.user_id != user.id:
+            logger.warning(f"[SERIALIZER] tx_id {tx_id} already belongs to another user")
+            raise serializers.ValidationError({'tx_id': ['transaction with this tx id already exists.']})
+        instance.user = user
 
+        # Lets the view tell a fresh insert from a returned duplicate
+        self.is_duplicate = not created
+        logger.info(f"[SERIALIZER] {'Created' if created else 'Returning existing'} transaction for tx_id: {tx_id}")
+        return instance
 
-class ExpenseSerializer(serializers.ModelSerializer):
+
+class ExpenseSerializer(TimedSerializerMixin, SparseFieldsetMixin, WireFormatMixin, serializers.ModelSerializer):
     username = serializers.CharField(source='user.username', read_only=True)
     request_hash = serializers.CharField(write_only=True, required=False, allow_blank=True)
     
@@ -198,7 +337,9 @@ class ExpenseSerializer(serializers.ModelSerializer):
             
             if not hmac.compare_digest(expected_hash, provided_hash):
                 logger.warning(f"[SERIALIZER] Expense hash validation failed")
-                if getattr(settings, 'SMS_HASH_STRICT_MODE', False):
+                strict = getattr(settings, 'SMS_HASH_STRICT_MODE', False)
+                metrics.hmac_failures.inc(rejected=str(strict).lower())
+                if strict:
                     raise serializers.ValidationError({
                         'request_hash': 'Invalid request hash.'
                     })
@@ -217,3 +358,16 @@ class ExpenseSerializer(serializers.ModelSerializer):
             validated_data['created_at'] = timezone.now()
             
         return super().create(validated_data)
+
+
+class DriverProfileSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    class Meta:
+        model = DriverProfile
+        fields = ['timezone']
+
+    def validate_timezone(self, value):
+        try:
+            get_timezone(value)
+        except ValueError as exc:
+            raise serializers.ValidationError(str(exc))
+        return value
@@ -0,0 +1,33 @@
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import metrics
+from .events import notify_change
+from .models import Expense, Transaction
+from .txfilter import tx_id_filter
+
+
+@receiver(post_save, sender=Transaction)
+@receiver(post_delete, sender=Transaction)
+@receiver(post_save, sender=Expense)
+@receiver(post_delete, sender=Expense)
+def invalidate_user_summaries(sender, instance, **kwargs):
+    # Notify after commit so a concurrent reader can't cache pre-commit
+    # totals under the new version
+    user_id = instance.user_id
+    transaction.on_commit(lambda: notify_change(user_id))
+
+
+@receiver(post_save, sender=Transaction)
+def remember_tx_id(sender, instance, created, **kwargs):
+    if created:
+        tx_id_filter.add(instance.tx_id)
+
+
+@receiver(connection_created)
+def time_queries(sender, connection, **kwargs):
+    # The wrapper list outlives the socket, so a reconnect must not add it twice
+    if metrics.observe_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(metrics.observe_query)
@@ -0,0 +1,148 @@
+"""
+Server-Sent Events stream of a user's daily summary (GET /api/stream/summary/).
+
+Replaces polling /api/summary/daily/: the stream sends the full summary once,
+then only the fields that changed whenever one of the user's Transactions or
+Expenses changes (see transactions.events). An idle connection costs a
+parked coroutine and a keep-alive comment every SUMMARY_STREAM_HEARTBEAT
+seconds, so it must be served through ASGI (config.asgi).
+
+EventSource clients cannot send an Authorization header. They authenticate
+with ?token= set to a stream token from POST /api/stream/token/: it only
+opens summary streams, lasts SUMMARY_STREAM_TOKEN_LIFETIME seconds and works
+once, so the copy that ends up in proxy and access logs is useless. Access
+tokens are never accepted in the URL.
+"""
+import json
+import logging
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework.views import APIView
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import Token
+
+from .events import get_broker
+from .periods import period_range, user_timezone
+from .views import daily_summary_payload
+
+logger = logging.getLogger(__name__)
+
+USED_TOKEN_KEY = 'stream-token:used:{jti}'
+
+
+def stream_token_lifetime():
+    return timedelta(seconds=getattr(settings, 'SUMMARY_STREAM_TOKEN_LIFETIME', 60))
+
+
+class StreamToken(Token):
+    """Short-lived JWT that can only open a summary stream."""
+    token_type = 'stream'
+
+    @property
+    def lifetime(self):
+        return stream_token_lifetime()
+
+
+class StreamTokenView(APIView):
+    """POST /api/stream/token/: a stream token for ?token= (see module docstring)."""
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        token = StreamToken.for_user(request.user)
+        return Response({'token': str(token), 'expires_in': int(stream_token_lifetime().total_seconds())})
+
+
+def _redeem(raw):
+    """The user a stream token was issued to, or None if it is invalid, expired or used."""
+    auth = JWTAuthentication()
+    try:
+        token = StreamToken(raw)
+        user = auth.get_user(token)
+    except (InvalidToken, TokenError, AuthenticationFailed):
+        return None
+    # Single use: a logged URL cannot open a second stream
+    jti = token[jwt_settings.JTI_CLAIM]
+    timeout = int(stream_token_lifetime().total_seconds()) + 1
+    if not cache.add(USED_TOKEN_KEY.format(jti=jti), True, timeout=timeout):
+        return None
+    return user
+
+
+def _authenticate(request):
+    """JWT from the Authorization header, or a stream token in ?token= for EventSource clients."""
+    auth = JWTAuthentication()
+    try:
+        result = auth.authenticate(request)
+        if result is not None:
+            return result[0]
+    except (InvalidToken, TokenError, AuthenticationFailed):
+        return None
+    token = request.GET.get('token')
+    return _redeem(token) if token else None
+
+
+def _format_event(event, data, event_id=None):
+    lines = [f"event: {event}"]
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"data: {json.dumps(data, cls=JSONEncoder, separators=(',', ':'))}")
+    return '\n'.join(lines) + '\n\n'
+
+
+def _today(user):
+    """[start, end) of the user's local day; re-read after every change, so timezone edits apply."""
+    return period_range('today', user_timezone(user))
+
+
+async def _summary_events(user, subscription):
+    heartbeat = getattr(settings, 'SUMMARY_STREAM_HEARTBEAT', 15)
+    last = {}
+    version = None
+    try:
+        while True:
+            day_start, day_end = await sync_to_async(_today)(user)
+            summary = await sync_to_async(daily_summary_payload)(user, day_start, day_end)
+            delta = {key: value for key, value in summary.items() if last.get(key) != value}
+            if delta or not last:
+                yield _format_event('summary', delta, version)
+            last = summary
+
+            message = await subscription.get(heartbeat)
+            # Local midnight ends the day: send the new day's totals
+            while message is None and timezone.now() < day_end:
+                yield ': keepalive\n\n'
+                message = await subscription.get(heartbeat)
+            version = message['version'] if message else None
+    finally:
+        await subscription.close()
+        logger.info(f"Summary stream closed for user {user.id}")
+
+
+async def summary_stream(request):
+    user = await sync_to_async(_authenticate)(request)
+    if user is None:
+        return JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=401)
+
+    broker = get_broker()
+    max_streams = getattr(settings, 'SUMMARY_STREAM_MAX_PER_USER', 5)
+    if hasattr(broker, 'subscriber_count') and broker.subscriber_count(user.id) >= max_streams:
+        return JsonResponse({'detail': 'Too many open summary streams.'}, status=429)
+
+    subscription = await broker.subscribe(user.id)
+    logger.info(f"Summary stream opened for user {user.id}")
+    response = StreamingHttpResponse(_summary_events(user, subscription), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop reverse proxies from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,119 @@
+"""
+Delta sync (GET /api/sync/).
+
+The cursor holds one (timestamp, id) keyset position per stream: changed
+transactions (updated_at), changed expenses (updated_at) and deletions
+(Tombstone.deleted_at). Each call returns rows strictly after those positions
+and older than a short settle window, so a row whose transaction commits a
+moment after its timestamp was taken is still picked up by the next call.
+"""
+import base64
+import json
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Expense, Tombstone, Transaction
+from .serializers import ExpenseSerializer, TransactionSerializer
+
+STREAMS = ('transactions', 'expenses', 'deleted')
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class CursorExpired(Exception):
+    """The cursor predates the tombstone retention window; a full resync is needed."""
+
+
+def settle_window():
+    return timedelta(seconds=getattr(settings, 'SYNC_SETTLE_SECONDS', 2))
+
+
+def tombstone_retention():
+    return timedelta(days=getattr(settings, 'SYNC_TOMBSTONE_RETENTION_DAYS', 90))
+
+
+def encode_cursor(positions):
+    raw = json.dumps({
+        stream: [position[0].isoformat(), position[1]] if position else None
+        for stream, position in positions.items()
+    }).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(encoded):
+    try:
+        padded = encoded + '=' * (-len(encoded) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        return {
+            stream: (datetime.fromisoformat(data[stream][0]), int(data[stream][1])) if data[stream] else None
+            for stream in STREAMS
+        }
+    except (TypeError, ValueError, KeyError, IndexError, UnicodeError) as exc:
+        raise InvalidCursor(str(exc))
+
+
+def _page(queryset, field, position, upper, limit):
+    queryset = queryset.filter(**{f'{field}__lt': upper})
+    if position is not None:
+        timestamp, pk = position
+        queryset = queryset.filter(
+            Q(**{f'{field}__gt': timestamp}) | Q(**{field: timestamp, 'id__gt': pk})
+        )
+    rows = list(queryset.order_by(field, 'id')[:limit + 1])
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if has_more:
+        position = (getattr(rows[-1], field), rows[-1].pk)
+    else:
+        # Everything before the upper bound has been delivered
+        position = (upper, 0)
+    return rows, position, has_more
+
+
+def delta_sync(user, cursor=None, limit=500, context=None):
+    """
+    Changes for user since cursor (None for a full initial sync).
+
+    Returns a response payload with the changed rows, deleted ids, the next
+    cursor and whether more changes are waiting. context is passed to the
+    serializers (the request, for its negotiated wire format).
+    """
+    now = timezone.now()
+    upper = now - settle_window()
+    if cursor:
+        positions = decode_cursor(cursor)
+        deleted_since = positions['deleted']
+        if deleted_since is None or deleted_since[0] < now - tombstone_retention():
+            raise CursorExpired()
+    else:
+        # A fresh replica has nothing to delete
+        positions = {'transactions': None, 'expenses': None, 'deleted': (upper, 0)}
+
+    transactions, positions['transactions'], more_transactions = _page(
+        Transaction.objects.filter(user=user).select_related('user'),
+        'updated_at', positions['transactions'], upper, limit,
+    )
+    expenses, positions['expenses'], more_expenses = _page(
+        Expense.objects.filter(user=user).select_related('user'),
+        'updated_at', positions['expenses'], upper, limit,
+    )
+    tombstones, positions['deleted'], more_deleted = _page(
+        Tombstone.objects.filter(user=user),
+        'deleted_at', positions['deleted'], upper, limit,
+    )
+
+    return {
+        'transactions': TransactionSerializer(transactions, many=True, context=context or {}).data,
+        'expenses': ExpenseSerializer(expenses, many=True, context=context or {}).data,
+        'deleted': {
+            'transactions': [t.object_id for t in tombstones if t.model == Tombstone.TRANSACTION],
+            'expenses': [t.object_id for t in tombstones if t.model == Tombstone.EXPENSE],
+        },
+        'cursor': encode_cursor(positions),
+        'has_more': more_transactions or more_expenses or more_deleted,
+    }
@@ -1,3 +1,1484 @@
-from django.test import TestCase
+import asyncio
+import copy
+import gzip
+import io
+import json
+import os
+import random
+import re
+import runpy
+import tempfile
+import time
+import uuid
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from unittest import mock, skipUnless
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import OperationalError, connection, transaction
+from django.db.models import F
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import AsyncClient, RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import export, idempotency, replicas, rollups
+from .cache import SummaryCache, cached_summarize, summary_cache
+from .events import get_broker, notify_change
+from .middleware import CompressionMiddleware, brotli
+from .models import Expense, IdempotencyKey, Tombstone, Transaction
+from .pagination import KeysetPagination
+from .periods import day_range, get_timezone, period_range
+from .renderers import MSGPACK_MEDIA_TYPE, FastJSONRenderer, msgpack, orjson, to_epoch_ms
+from .rollups import find_debt_mismatches, rebuild_debt_balances, rebuild_rollups
+from .txfilter import tx_id_filter
+from .views import ExpenseViewSet, TransactionViewSet
+
+
+_primary_only = override_settings(DATABASE_REPLICAS={**settings.DATABASE_REPLICAS, 'ALIASES': []})
+
+
+def setUpModule():
+    # A mirror connection would not see a TestCase's uncommitted rows, so the
+    # suite reads from the primary even with DATABASE_REPLICA_URLS exported
+    _primary_only.enable()
+
+
+def tearDownModule():
+    _primary_only.disable()
+
+
+def seed_user(username, transactions=400, expenses=150, days=90):
+    """Create a user with a spread of transactions and expenses over `days` days."""
+    user = User.objects.create_user(username, f'{username}@example.com', 'password123')
+    rng = random.Random(username)
+    now = timezone.now()
+    platforms = ['YANGO', 'BOLT', 'PRIVATE']
+    categories = ['FUEL', 'DATA', 'FOOD', 'REPAIRS', 'OTHER']
+    Transaction.objects.bulk_create([
+        Transaction(
+            user=user,
+            tx_id=f'{username}-{i}',
+            amount_received=Decimal('50.00'),
+            rider_profit=Decimal('40.00'),
+            platform_debt=Decimal('10.00'),
+            platform=platforms[i % 3],
+            department=Transaction.department_for(platforms[i % 3]),
+            created_at=now - timedelta(minutes=rng.randrange(days * 24 * 60)),
+        )
+        for i in range(transactions)
+    ])
+    Expense.objects.bulk_create([
+        Expense(
+            user=user,
+            amount=Decimal('12.50'),
+            category=categories[i % 5],
+            created_at=now - timedelta(minutes=rng.randrange(days * 24 * 60)),
+        )
+        for i in range(expenses)
+    ])
+    return user
+
+
+class SummaryStreamTests(TestCase):
+    """GET /api/stream/summary/ (transactions.streams), read through the ASGI test client."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('streamer', 'streamer@example.com', 'password123')
+        self.headers = {'authorization': f'Bearer {AccessToken.for_user(self.user)}'}
+        self.client = AsyncClient()
+
+    async def open(self, url='/api/stream/summary/', **kwargs):
+        response = await self.client.get(url, **kwargs)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        return aiter(response.streaming_content)
+
+    async def next_event(self, events):
+        chunk = (await anext(events)).decode()
+        name, data = re.match(r'event: (\w+)\n(?:id: .*\n)?data: (.*)\n\n', chunk).groups()
+        return name, json.loads(data)
+
+    async def disconnect(self, events):
+        """Cancel the stream while it waits for changes, as the ASGI handler does when the client goes away."""
+        pending = asyncio.ensure_future(anext(events))
+        await asyncio.sleep(0.05)
+        pending.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await pending
+
+    def subscribers(self):
+        return get_broker().subscriber_count(self.user.id)
+
+    def record_trip(self):
+        tx = Transaction.objects.create(
+            user=self.user, tx_id='streamed-1', amount_received=Decimal('50.00'), rider_profit=Decimal('40.00'),
+            platform_debt=Decimal('10.00'), platform='BOLT', created_at=timezone.now(),
+        )
+        rollups.apply_transaction(tx)
+        # What the write's on-commit hook does
+        notify_change(self.user.id)
+
+    async def test_full_summary_then_changed_fields(self):
+        events = await self.open(headers=self.headers)
+        name, first = await self.next_event(events)
+        self.assertEqual(name, 'summary')
+        self.assertEqual(set(first), {
+            'net_profit', 'total_debt', 'expenses', 'yango_income', 'bolt_income', 'yango_debt', 'bolt_debt',
+        })
+        self.assertEqual(self.subscribers(), 1)
+
+        await sync_to_async(self.record_trip)()
+        _, delta = await self.next_event(events)
+        self.assertEqual(delta, {'net_profit': 40.0, 'total_debt': 10.0, 'bolt_income': 40.0, 'bolt_debt': 10.0})
+
+        await self.disconnect(events)
+        self.assertEqual(self.subscribers(), 0)
+
+    @override_settings(SUMMARY_STREAM_MAX_PER_USER=1)
+    async def test_streams_per_user_are_limited(self):
+        events = await self.open(headers=self.headers)
+        await self.next_event(events)
+        second = await self.client.get('/api/stream/summary/', headers=self.headers)
+        self.assertEqual(second.status_code, 429)
+
+        await self.disconnect(events)
+        events = await self.open(headers=self.headers)
+        await self.next_event(events)
+        await self.disconnect(events)
+
+    async def test_url_token_is_a_single_use_stream_token(self):
+        access = self.headers['authorization'].split()[1]
+        self.assertEqual((await self.client.get(f'/api/stream/summary/?token={access}')).status_code, 401)
+
+        issued = await self.client.post('/api/stream/token/', headers=self.headers)
+        self.assertEqual(issued.status_code, 200)
+        token = issued.json()['token']
+        # Not an access token either
+        rejected = await self.client.get('/api/summary/daily/', headers={'authorization': f'Bearer {token}'})
+        self.assertEqual(rejected.status_code, 401)
+
+        events = await self.open(f'/api/stream/summary/?token={token}')
+        await self.next_event(events)
+        await self.disconnect(events)
+        self.assertEqual((await self.client.get(f'/api/stream/summary/?token={token}')).status_code, 401)
+
+
+class QueryPlanRegressionTests(TestCase):
+    """
+    Capture the SQL each endpoint runs against a seeded database, EXPLAIN it
+    and fail when a query on one of our tables falls back to a sequential
+    scan (or, for list endpoints, an explicit sort).
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = seed_user('driver')
+        seed_user('other-driver')
+        rebuild_rollups()
+        rebuild_debt_balances()
+        # Warm-up reads the whole tx_id column once per worker; it is startup
+        # cost, not part of any endpoint's per-request plan
+        tx_id_filter.warm()
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        summary_cache.clear()
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                # Small seeded tables would otherwise always be seq-scanned;
+                # with seqscan disabled one only shows up when no index applies
+                cursor.execute('SET LOCAL enable_seqscan = off')
+                cursor.execute(f'EXPLAIN {sql}')
+                return '\n'.join(row[0] for row in cursor.fetchall())
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            return '\n'.join(row[-1] for row in cursor.fetchall())
+
+    def plan_regressions(self, plan):
+        if connection.vendor == 'postgresql':
+            patterns = [r'Seq Scan on transactions_\w+', r'Sort Key: .*created_at']
+        else:
+            patterns = [r'^SCAN transactions_\w+', r'USE TEMP B-TREE FOR (?:RIGHT PART OF )?ORDER BY']
+        return [
+            match.group(0)
+            for pattern in patterns
+            for match in re.finditer(pattern, plan, re.MULTILINE)
+        ]
+
+    def assertIndexedQueries(self, method, url, data=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(url, data, format='json')
+            if response.streaming:
+                # Streaming responses only query while being consumed
+                response.streamed_content = b''.join(response.streaming_content)
+        body = response.streamed_content if response.streaming else response.content
+        self.assertLess(response.status_code, 300, body)
+
+        explained = 0
+        for query in queries.captured_queries:
+            sql = query['sql']
+            if 'transactions_' not in sql or not re.match(r'\s*(SELECT|UPDATE|DELETE|WITH)\b', sql, re.I):
+                continue
+            plan = self.explain(sql)
+            explained += 1
+            regressions = self.plan_regressions(plan)
+            self.assertFalse(
+                regressions,
+                f"{method.upper()} {url} regressed to {regressions}\nSQL: {sql}\nPlan:\n{plan}",
+            )
+        self.assertGreater(explained, 0, f"No queries captured for {url}")
+        return response
+
+    def test_transaction_list(self):
+        first = self.assertIndexedQueries('get', '/api/transactions/')
+        self.assertIndexedQueries('get', f"/api/transactions/?cursor={first.data['next_cursor']}")
+
+    def test_transaction_list_sparse_fields(self):
+        response = self.assertIndexedQueries('get', '/api/transactions/?fields=amount_received,platform,created_at')
+        self.assertEqual(set(response.data['results'][0]), {'amount_received', 'platform', 'created_at'})
+
+    def test_expense_list(self):
+        first = self.assertIndexedQueries('get', '/api/expenses/?page_size=20')
+        self.assertIndexedQueries('get', f"/api/expenses/?page_size=20&cursor={first.data['next_cursor']}")
+
+    def test_transaction_detail(self):
+        tx = Transaction.objects.filter(user=self.user).first()
+        self.assertIndexedQueries('get', f'/api/transactions/{tx.id}/')
+
+    def test_daily_summary(self):
+        self.assertIndexedQueries('get', '/api/summary/daily/')
+
+    def test_period_summary_with_partial_days(self):
+        end = timezone.now()
+        start = end - timedelta(days=30, hours=5)
+        self.assertIndexedQueries('get', '/api/summary/period/', {
+            'start_date': start.isoformat(), 'end_date': end.isoformat(),
+        })
+
+    def test_timeseries(self):
+        end = timezone.now()
+        response = self.assertIndexedQueries('get', '/api/summary/timeseries/', {
+            'start': (end - timedelta(days=30)).isoformat(), 'end': end.isoformat(),
+            'bucket': 'day', 'tz': 'Africa/Accra',
+        })
+        self.assertEqual(len(response.data['series']), 31)
+
+    def test_export(self):
+        response = self.assertIndexedQueries('get', '/api/export/?format=csv')
+        self.assertEqual(response.streamed_content.count(b'\n'), 1 + 400 + 150)
+
+    def test_create_transaction(self):
+        self.assertIndexedQueries('post', '/api/transactions/', {
+            'tx_id': 'driver-0', 'amount_received': '50.00', 'rider_profit': '40.00',
+            'platform_debt': '10.00', 'platform': 'BOLT', 'created_at': timezone.now().isoformat(),
+        })
+
+    def test_bulk_create(self):
+        now = timezone.now().isoformat()
+        self.assertIndexedQueries('post', '/api/transactions/bulk/', [
+            {'tx_id': tx_id, 'amount_received': '50.00', 'rider_profit': '40.00',
+             'platform_debt': '10.00', 'platform': 'YANGO', 'created_at': now}
+            for tx_id in ['driver-1', 'driver-2', 'bulk-new-1', 'bulk-new-2']
+        ])
+
+    def test_clear_debt(self):
+        self.assertIndexedQueries('post', '/api/debt/clear/')
+
+    def test_delta_sync(self):
+        first = self.assertIndexedQueries('get', '/api/sync/?limit=50')
+        self.assertIndexedQueries('get', f"/api/sync/?limit=50&since={first.data['cursor']}")
+
+    def test_dashboard(self):
+        response = self.assertIndexedQueries('get', '/api/dashboard/?limit=10')
+        self.assertEqual(len(response.data['transactions']), 10)
+        self.assertEqual(len(response.data['expenses']), 10)
+
+
+# Per-endpoint SQL budgets: name -> (method, path, payload, max queries,
+# max rows read). Paths and payload strings are formatted with the seeded
+# user's latest transaction and expense ids, a 30-day date range and the
+# current time; rows read are
+# measured by QueryBudgetTests.rows_read. Raise a budget only together with
+# the change that needs it.
+QUERY_BUDGETS = {
+    'transaction-list': ('get', '/api/transactions/', None, 1, 60),
+    'transaction-list-page': ('get', '/api/transactions/?page_size=20&cursor={cursor}', None, 1, 30),
+    'transaction-detail': ('get', '/api/transactions/{transaction}/', None, 1, 5),
+    'transaction-create': ('post', '/api/transactions/', {
+        'tx_id': 'budget-new', 'amount_received': '50.00', 'rider_profit': '40.00',
+        'platform_debt': '10.00', 'platform': 'BOLT', 'created_at': '{now}',
+    }, 5, 10),
+    'transaction-create-duplicate': ('post', '/api/transactions/', {
+        'tx_id': 'budget-0', 'amount_received': '50.00', 'rider_profit': '40.00',
+        'platform_debt': '10.00', 'platform': 'BOLT', 'created_at': '{now}',
+    }, 1, 5),
+    'transaction-update': ('patch', '/api/transactions/{transaction}/', {'amount_received': '55.00'}, 9, 10),
+    'transaction-delete': ('delete', '/api/transactions/{transaction}/', None, 7, 10),
+    'transaction-bulk': ('post', '/api/transactions/bulk/', [
+        {'tx_id': tx_id, 'amount_received': '50.00', 'rider_profit': '40.00',
+         'platform_debt': '10.00', 'platform': 'YANGO', 'created_at': '{now}'}
+        for tx_id in ['budget-1', 'budget-2', 'bulk-new-1', 'bulk-new-2']
+    ], 6, 20),
+    'expense-list': ('get', '/api/expenses/', None, 1, 60),
+    'expense-detail': ('get', '/api/expenses/{expense}/', None, 1, 5),
+    'expense-create': ('post', '/api/expenses/', {'amount': '20.00', 'category': 'FUEL', 'created_at': '{now}'}, 4, 10),
+    'expense-delete': ('delete', '/api/expenses/{expense}/', None, 6, 10),
+    'daily-summary': ('get', '/api/summary/daily/', None, 2, 150),
+    'period-summary': ('get', '/api/summary/period/?start_date={start}&end_date={end}', None, 2, 200),
+    'period-summary-named': ('get', '/api/summary/period/?period=last_month', None, 2, 200),
+    'summary-timeseries': ('get', '/api/summary/timeseries/?start={start}&end={end}&bucket=day', None, 2, 200),
+    'dashboard': ('get', '/api/dashboard/', None, 4, 150),
+    'sync': ('get', '/api/sync/?limit=100', None, 3, 220),
+    'export': ('get', '/api/export/?format=csv&start={start}&end={end}', None, 3, 250),
+    'profile': ('get', '/api/profile/', None, 1, 5),
+    'clear-debt': ('post', '/api/debt/clear/', None, 11, 20),
+}
+
+
+class QueryBudgetTests(TestCase):
+    """
+    Run every endpoint in QUERY_BUDGETS against a seeded database and fail,
+    listing the SQL it ran, when it issues more queries or reads more rows
+    than its budget allows.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = seed_user('budget')
+        seed_user('other-budget')
+        # Seeded rows are only just written; age them so delta sync returns them
+        Transaction.objects.update(updated_at=F('created_at'))
+        Expense.objects.update(updated_at=F('created_at'))
+        rebuild_rollups()
+        rebuild_debt_balances()
+        tx_id_filter.warm()
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        summary_cache.clear()
+
+    def placeholders(self):
+        today = timezone.localdate()
+        transactions = Transaction.objects.filter(user=self.user).order_by('-created_at', '-id')
+        return {
+            'transaction': transactions.values_list('id', flat=True).first(),
+            'expense': Expense.objects.filter(user=self.user).order_by('-created_at', '-id')
+            .values_list('id', flat=True).first(),
+            # A second keyset page, so the cursor filter is covered too
+            'cursor': self.client.get('/api/transactions/?page_size=20').data['next_cursor'],
+            'start': (today - timedelta(days=30)).isoformat(),
+            'end': today.isoformat(),
+            'now': timezone.now().isoformat(),
+        }
+
+    def fill(self, payload, context):
+        if isinstance(payload, str):
+            return payload.format(**context)
+        if isinstance(payload, list):
+            return [self.fill(item, context) for item in payload]
+        if isinstance(payload, dict):
+            return {key: self.fill(value, context) for key, value in payload.items()}
+        return payload
+
+    def rows_read(self, sql):
+        """
+        Rows the database reads for one statement. PostgreSQL reports them:
+        EXPLAIN ANALYZE's actual rows plus the rows filtered out, over every
+        scan node. SQLite does not, so there it is the rows a SELECT returns
+        plus the whole table for each full table or covering-index scan.
+        """
+        select = re.match(r'\s*(SELECT|WITH)\b', sql, re.I)
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute(f"EXPLAIN ({'ANALYZE, ' if select else ''}FORMAT JSON) {sql}")
+                plan = cursor.fetchone()[0]
+                plan = json.loads(plan) if isinstance(plan, str) else plan
+                return sum(self.scanned(node, select) for node in plan)
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            scanned = [
+                match.group(1) for match in (re.match(r'SCAN (\w+)', row[-1]) for row in cursor.fetchall())
+                if match and match.group(1) in connection.introspection.table_names()
+            ]
+            rows = 0
+            for table in scanned:
+                cursor.execute(f'SELECT COUNT(*) FROM {connection.ops.quote_name(table)}')
+                rows += cursor.fetchone()[0]
+            if select:
+                cursor.execute(sql)
+                rows += len(cursor.fetchall())
+            return rows
+
+    def scanned(self, node, analyzed):
+        node = node.get('Plan', node)
+        rows = 0
+        if 'Scan' in node['Node Type']:
+            if analyzed:
+                loops = node.get('Actual Loops', 1)
+                rows += (node.get('Actual Rows', 0) + node.get('Rows Removed by Filter', 0)) * loops
+            elif node['Node Type'] == 'Seq Scan':
+                # Writes are not executed twice; only count the scans the planner expects
+                rows += node.get('Plan Rows', 0)
+        return rows + sum(self.scanned(child, analyzed) for child in node.get('Plans', []))
+
+    def test_budgets(self):
+        context = self.placeholders()
+        for name, (method, path, payload, max_queries, max_rows) in QUERY_BUDGETS.items():
+            with self.subTest(name), transaction.atomic():
+                url = path.format(**context)
+                data = self.fill(payload, context)
+                with CaptureQueriesContext(connection) as captured:
+                    response = getattr(self.client, method)(url, data, format='json')
+                    if response.streaming:
+                        b''.join(response.streaming_content)
+                self.assertLess(response.status_code, 300, getattr(response, 'content', b''))
+                # Savepoints depend on how deeply the test nests atomic blocks
+                queries = [
+                    query['sql'] for query in captured.captured_queries
+                    if not re.match(r'\s*(SAVEPOINT|RELEASE|ROLLBACK)\b', query['sql'], re.I)
+                ]
+                reads = [(self.rows_read(sql), sql) for sql in queries]
+                rows = sum(count for count, _ in reads)
+                listing = '\n'.join(f'  [{count} rows] {sql}' for count, sql in reads)
+                self.assertLessEqual(
+                    len(queries), max_queries,
+                    f"{method.upper()} {url} ran {len(queries)} queries (budget {max_queries}):\n{listing}",
+                )
+                self.assertLessEqual(
+                    rows, max_rows,
+                    f"{method.upper()} {url} read {rows} rows (budget {max_rows}):\n{listing}",
+                )
+                transaction.set_rollback(True)
+
+
+class KeysetPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('paged', 'paged@example.com', 'password123')
+        now = timezone.now()
+        # Runs of identical created_at values straddle the page boundaries
+        Transaction.objects.bulk_create([
+            Transaction(
+                user=cls.user, tx_id=f'paged-{i}', amount_received=Decimal('50.00'), rider_profit=Decimal('40.00'),
+                platform='BOLT', department=Transaction.department_for('BOLT'),
+                created_at=now - timedelta(minutes=i // 4),
+            )
+            for i in range(22)
+        ])
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def expected_ids(self):
+        return list(Transaction.objects.filter(user=self.user).order_by('-created_at', '-id').values_list('id', flat=True))
+
+    def test_cursor_pages_cover_every_row_once(self):
+        seen = []
+        url = '/api/transactions/?page_size=3'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(response.data['results']), 3)
+            seen.extend(row['id'] for row in response.data['results'])
+            cursor = response.data['next_cursor']
+            url = f'/api/transactions/?page_size=3&cursor={cursor}' if cursor else None
+            self.assertEqual(bool(response.data['next']), bool(cursor))
+        self.assertEqual(seen, self.expected_ids())
+
+    def test_page_size_all_returns_a_plain_list(self):
+        response = self.client.get('/api/transactions/?page_size=all')
+        self.assertEqual([row['id'] for row in response.data], self.expected_ids())
+
+    def test_page_size_is_capped(self):
+        with mock.patch.object(KeysetPagination, 'max_page_size', 5):
+            response = self.client.get('/api/transactions/?page_size=100')
+        self.assertEqual(len(response.data['results']), 5)
+        self.assertIsNotNone(response.data['next_cursor'])
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/transactions/?cursor=not-a-cursor')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(str(response.data['detail']), 'Invalid cursor')
+
+
+class SummaryCacheTests(TestCase):
+    def setUp(self):
+        self.user = seed_user('cached', transactions=20, expenses=5, days=3)
+        rebuild_rollups()
+        summary_cache.clear()
+        self.end = timezone.now() + timedelta(minutes=1)
+        self.start = self.end - timedelta(days=7)
+
+    def test_hit_until_the_data_changes(self):
+        first = cached_summarize(self.user, self.start, self.end)
+        with self.assertNumQueries(0):
+            self.assertEqual(cached_summarize(self.user, self.start, self.end), first)
+
+        # The write's on-commit notify_change bumps the user's data version
+        with self.captureOnCommitCallbacks(execute=True):
+            expense = Expense.objects.create(
+                user=self.user, amount=Decimal('7.50'), category='FOOD', created_at=timezone.now(),
+            )
+            rollups.apply_expense(expense)
+        summary = cached_summarize(self.user, self.start, self.end)
+        self.assertEqual(summary['expenses'], first['expenses'] + Decimal('7.50'))
+
+    def test_entries_expire(self):
+        lru = SummaryCache(ttl=10)
+        lru.set('key', 'value')
+        self.assertEqual(lru.get('key'), 'value')
+        with mock.patch('time.monotonic', return_value=time.monotonic() + 11):
+            self.assertIsNone(lru.get('key'))
+        self.assertEqual(lru.stats()['size'], 0)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        lru = SummaryCache(max_entries=2)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        lru.get('a')
+        lru.set('c', 3)
+        self.assertIsNone(lru.get('b'))
+        self.assertEqual((lru.get('a'), lru.get('c')), (1, 3))
+        self.assertEqual(lru.stats()['evictions'], 1)
+
+
+class ConditionalRequestTests(TestCase):
+    """ETag / If-None-Match on list and summary reads (transactions.conditional)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = seed_user('tagged', transactions=30, expenses=5)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_matching_tag_is_not_modified(self):
+        for url in ('/api/transactions/', '/api/summary/daily/'):
+            first = self.client.get(url)
+            self.assertEqual(first['Cache-Control'], 'private, no-cache')
+            again = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+            self.assertEqual(again.status_code, 304)
+            self.assertEqual(again.content, b'')
+            self.assertEqual(again['ETag'], first['ETag'])
+
+    def test_tag_changes_after_a_committed_write(self):
+        first = self.client.get('/api/expenses/')
+        # The data version is bumped on commit; TestCase never commits by itself
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/expenses/', {
+                'amount': '5.00', 'category': 'FOOD', 'created_at': timezone.now().isoformat(),
+            }, format='json')
+        again = self.client.get('/api/expenses/', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(again.status_code, 200)
+        self.assertNotEqual(again['ETag'], first['ETag'])
+        self.assertEqual(len(again.data['results']), 6)
+
+    def test_failed_summary_is_not_tagged(self):
+        self.client.raise_request_exception = False
+        with mock.patch('transactions.views.daily_summary_payload', side_effect=OperationalError('database is locked')):
+            failed = self.client.get('/api/summary/daily/')
+        self.assertEqual(failed.status_code, 500)
+        self.assertNotIn('ETag', failed)
+
+        recovered = self.client.get('/api/summary/daily/')
+        self.assertEqual(recovered.status_code, 200)
+        self.assertIn('ETag', recovered)
+
+    def test_compressed_responses_match_weakly(self):
+        first = self.client.get('/api/transactions/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(first['Content-Encoding'], 'gzip')
+        self.assertTrue(first['ETag'].startswith('W/"'))
+        strong = first['ETag'].removeprefix('W/')
+        for tag in (first['ETag'], strong, f'"other", {first["ETag"]}'):
+            response = self.client.get('/api/transactions/', HTTP_IF_NONE_MATCH=tag, HTTP_ACCEPT_ENCODING='gzip')
+            self.assertEqual(response.status_code, 304, tag)
+        # The uncompressed representation keeps the strong tag
+        plain = self.client.get('/api/transactions/', HTTP_IF_NONE_MATCH='"other"')
+        self.assertEqual((plain.status_code, plain['ETag']), (200, strong))
+
+
+class SparseFieldsetTests(TestCase):
+    def setUp(self):
+        self.user = seed_user('sparse', transactions=5, expenses=0)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.tx = Transaction.objects.filter(user=self.user).first()
+
+    def test_selection_limits_fields_and_columns(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f'/api/transactions/{self.tx.id}/?fields=platform')
+        self.assertEqual(response.data, {'platform': self.tx.platform})
+        sql = queries.captured_queries[-1]['sql']
+        self.assertIn('"platform"', sql)
+        self.assertNotIn('"amount_received"', sql)
+        self.assertNotIn('auth_user', sql)
+
+    def test_empty_selection(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f'/api/transactions/{self.tx.id}/?fields=')
+        self.assertEqual(response.data, {})
+        self.assertNotIn('"platform"', queries.captured_queries[-1]['sql'])
+
+    def test_unknown_field(self):
+        response = self.client.get('/api/transactions/?fields=platform,secret')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('secret', str(response.data['fields']))
+
+
+class FastListEncodingTests(TestCase):
+    """The values_list read path (transactions.rows) must render exactly what the serializers do."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = seed_user('encoder', transactions=60, expenses=30)
+        tx = Transaction.objects.filter(user=cls.user).first()
+        Transaction.objects.filter(pk=tx.pk).update(trip_price=Decimal('12.5'), gross_total=Decimal('-0.004'))
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def assertSameAsSerializer(self, url):
+        fast = self.client.get(url)
+        with override_settings(FAST_LIST_SERIALIZATION=False):
+            slow = self.client.get(url)
+        self.assertEqual(fast.status_code, 200)
+        self.assertEqual(fast.content, slow.content)
+
+    def test_transactions(self):
+        self.assertSameAsSerializer('/api/transactions/?page_size=all')
+        self.assertSameAsSerializer('/api/transactions/?page_size=25&fields=username,platform,created_at')
+        self.assertSameAsSerializer('/api/transactions/?page_size=25&fields=')
+
+    def test_expenses(self):
+        self.assertSameAsSerializer('/api/expenses/?page_size=all')
+
+
+class CompressionTests(TestCase):
+    """CompressionMiddleware, driven directly with a canned response."""
+
+    body = json.dumps([{'tx_id': f'compressed-{i}', 'amount_received': '50.00'} for i in range(100)]).encode()
+
+    def respond(self, accept_encoding, body=None, streaming=False, etag='"abc"', **config):
+        def get_response(request):
+            if streaming:
+                response = StreamingHttpResponse(iter([self.body]), content_type='application/json')
+            else:
+                response = HttpResponse(self.body if body is None else body, content_type='application/json')
+            response['ETag'] = etag
+            return response
+
+        with override_settings(RESPONSE_COMPRESSION={'ENABLED': True, 'MIN_SIZE': 1024, **config}):
+            middleware = CompressionMiddleware(get_response)
+        request = RequestFactory().get('/api/transactions/', HTTP_ACCEPT_ENCODING=accept_encoding)
+        return middleware(request)
+
+    @skipUnless(brotli, 'brotli is not installed')
+    def test_brotli_preferred(self):
+        response = self.respond('gzip, deflate, br')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(brotli.decompress(response.content), self.body)
+        self.assertEqual(response['Content-Length'], str(len(response.content)))
+        self.assertIn('Accept-Encoding', response['Vary'])
+
+    def test_gzip(self):
+        response = self.respond('gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.content), self.body)
+        # Compressed bytes differ per coding: the tag is weakened
+        self.assertEqual(response['ETag'], 'W/"abc"')
+        self.assertEqual(self.respond('gzip', etag='W/"abc"')['ETag'], 'W/"abc"')
+
+    def test_refused_codings(self):
+        response = self.respond('br;q=0, gzip;q=0')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(response['ETag'], '"abc"')
+        self.assertEqual(self.respond('br;q=0, gzip')['Content-Encoding'], 'gzip')
+        self.assertFalse(self.respond('identity').has_header('Content-Encoding'))
+
+    def test_small_responses_are_left_alone(self):
+        response = self.respond('gzip', body=self.body[:1000])
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(self.respond('gzip', body=self.body[:1000], MIN_SIZE=500)['Content-Encoding'], 'gzip')
+
+    def test_streaming_responses_are_left_alone(self):
+        response = self.respond('gzip, br', streaming=True)
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(b''.join(response.streaming_content), self.body)
+
+    @skipUnless(orjson, 'orjson is not installed')
+    def test_fast_json_matches_drf(self):
+        payload = {
+            'amount': Decimal('12.50'), 'tiny': Decimal('-0.004'), 'big': 2 ** 70,
+            'utc': datetime(2026, 3, 4, 12, 0, 0, 123456, tzinfo=dt_timezone.utc),
+            'local': datetime(2026, 3, 4, 12, 0, 1, 500, tzinfo=get_timezone('Africa/Lagos')),
+            'naive': datetime(2026, 3, 4, 12, 0), 'day': date(2026, 3, 4), 'id': uuid.UUID(int=5),
+            'lazy': gettext_lazy('Invalid cursor'), 'text': 'caf\u00e9 \u2028 "q" </script>',
+            'nested': [None, True, 1.5, {'k': []}], 'duration': timedelta(hours=1), 1: 'integer key',
+        }
+        self.assertEqual(FastJSONRenderer().render(payload), JSONRenderer().render(payload))
+        self.assertEqual(FastJSONRenderer().render(payload['big']), JSONRenderer().render(payload['big']))
+
+
+@skipUnless(msgpack, 'msgpack is not installed')
+class MessagePackTests(TestCase):
+    """application/msgpack carries money as integer minor units and timestamps as epoch milliseconds."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = seed_user('packed', transactions=10, expenses=5)
+        # Old enough for delta sync to return them
+        Transaction.objects.update(updated_at=F('created_at'))
+        Expense.objects.update(updated_at=F('created_at'))
+        rebuild_rollups()
+        rebuild_debt_balances()
+
+    def setUp(self):
+        self.client = APIClient(SERVER_NAME='localhost')
+        self.client.force_authenticate(self.user)
+
+    def get(self, url):
+        response = self.client.get(url, HTTP_ACCEPT=MSGPACK_MEDIA_TYPE)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], MSGPACK_MEDIA_TYPE)
+        return msgpack.unpackb(response.content)
+
+    def assertPacked(self, transactions, expenses):
+        stored = {tx.id: tx for tx in Transaction.objects.filter(user=self.user)}
+        self.assertTrue(transactions)
+        for row in transactions:
+            self.assertEqual(row['amount_received'], 5000)
+            self.assertEqual(row['platform_debt'], 1000)
+            self.assertEqual(row['created_at'], to_epoch_ms(stored[row['id']].created_at))
+        self.assertTrue(expenses)
+        for row in expenses:
+            self.assertEqual(row['amount'], 1250)
+            self.assertIsInstance(row['created_at'], int)
+
+    def test_list(self):
+        transactions = self.get('/api/transactions/?page_size=all')
+        expenses = self.get('/api/expenses/?page_size=all')
+        self.assertEqual(len(transactions), 10)
+        self.assertPacked(transactions, expenses)
+
+    def test_dashboard(self):
+        data = self.get('/api/dashboard/')
+        self.assertEqual(data['debt']['total'], 10 * 1000)
+        self.assertIsInstance(data['summary']['net_profit'], int)
+        self.assertPacked(data['transactions'], data['expenses'])
+
+    def test_sync(self):
+        data = self.get('/api/sync/')
+        self.assertEqual(len(data['transactions']), 10)
+        self.assertPacked(data['transactions'], data['expenses'])
+
+    def test_bulk_post(self):
+        created_at = timezone.now().replace(microsecond=0)
+        body = msgpack.packb([
+            {'tx_id': f'packed-new-{i}', 'amount_received': 5550, 'rider_profit': 4000, 'platform_debt': 1550,
+             'platform': 'BOLT', 'created_at': to_epoch_ms(created_at)}
+            for i in range(2)
+        ])
+        response = self.client.post(
+            '/api/transactions/bulk/', body, content_type=MSGPACK_MEDIA_TYPE, HTTP_ACCEPT=MSGPACK_MEDIA_TYPE,
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(msgpack.unpackb(response.content)['created'], 2)
+        stored = Transaction.objects.get(tx_id='packed-new-0')
+        self.assertEqual(stored.amount_received, Decimal('55.50'))
+        self.assertEqual(stored.platform_debt, Decimal('15.50'))
+        self.assertEqual(stored.created_at, created_at)
+
+
+class ServerTimingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = seed_user('timed', transactions=30, expenses=10)
+
+    def get(self, url, **config):
+        # The middleware reads its settings when the client's handler loads
+        with override_settings(SERVER_TIMING={'SAMPLE_RATE': 1.0, **config}):
+            client = APIClient()
+            client.force_authenticate(self.user)
+            return client.get(url)
+
+    def test_sampled_request_reports_phases(self):
+        response = self.get('/api/transactions/?page_size=all')
+        metrics = dict(
+            metric.split(';', 1) for metric in response['Server-Timing'].split(', ')
+        )
+        self.assertEqual(list(metrics), ['view', 'serializer', 'sql', 'render', 'total'])
+        self.assertRegex(metrics['sql'], r'^dur=[0-9.]+;desc="\d+ quer(y|ies)"$')
+
+    def test_api_tree_and_log_line(self):
+        with self.assertLogs('transactions.middleware', 'INFO') as logs:
+            response = self.get('/api/auth/health/', LOG=True)
+        self.assertIn('total;dur=', response['Server-Timing'])
+        record = json.loads(logs.output[-1].split('server-timing ', 1)[1])
+        self.assertEqual(record['route'], 'api/auth/health/')
+        self.assertEqual(record['status'], 200)
+        self.assertIn('view_ms', record)
+
+    def test_unsampled_requests_pass_through(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        with override_settings(SERVER_TIMING={'SAMPLE_RATE': 0}):
+            response = client.get('/api/transactions/')
+        self.assertFalse(response.has_header('Server-Timing'))
+
+
+class MetricsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = seed_user('metered', transactions=20, expenses=5)
+        cls.admin = User.objects.create_user('metrics-admin', 'admin@example.com', 'password123', is_staff=True)
+
+    def scrape(self):
+        client = APIClient()
+        client.force_authenticate(self.admin)
+        response = client.get('/api/metrics/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        return response.content.decode()
+
+    def value(self, text, sample):
+        match = re.search(rf'^{re.escape(sample)} (\S+)$', text, re.MULTILINE)
+        return float(match.group(1)) if match else 0.0
+
+    def test_requests_ingest_and_duplicates(self):
+        before = self.scrape()
+        client = APIClient()
+        client.force_authenticate(self.user)
+        now = timezone.now().isoformat()
+        item = {'amount_received': '50.00', 'rider_profit': '40.00', 'platform_debt': '10.00',
+                'platform': 'BOLT', 'created_at': now}
+        client.post('/api/transactions/', {'tx_id': 'metered-new', **item}, format='json')
+        client.post('/api/transactions/', {'tx_id': 'metered-new', **item}, format='json')
+        client.post('/api/transactions/bulk/', [
+            {'tx_id': tx_id, **item} for tx_id in ['metered-0', 'metered-bulk-1', 'metered-bulk-2']
+        ], format='json')
+        client.post('/api/expenses/', {'amount': '5.00', 'category': 'FOOD', 'created_at': now}, format='json')
+        client.get(f'/api/transactions/{Transaction.objects.get(tx_id="metered-1").id}/')
+        after = self.scrape()
+
+        def delta(sample):
+            return self.value(after, sample) - self.value(before, sample)
+
+        self.assertEqual(delta('sidekick_transactions_ingested_total{path="single"}'), 1)
+        self.assertEqual(delta('sidekick_transaction_duplicates_total{path="single"}'), 1)
+        self.assertEqual(delta('sidekick_transactions_ingested_total{path="bulk"}'), 2)
+        self.assertEqual(delta('sidekick_transaction_duplicates_total{path="bulk"}'), 1)
+        self.assertEqual(delta('sidekick_expenses_ingested_total'), 1)
+        # The detail route is labelled with its pattern, not the id
+        route = r'transactions/(?P<pk>[^/.]+)/$'
+        self.assertEqual(delta(f'sidekick_http_requests_total{{route="api/{route}",method="GET",status="200"}}'), 1)
+        self.assertEqual(delta(f'sidekick_http_request_duration_seconds_count{{route="api/{route}",method="GET"}}'), 1)
+        self.assertGreater(delta('sidekick_db_query_duration_seconds_count{database="default"}'), 0)
+        self.assertIn('# TYPE sidekick_cache_requests_total counter', after)
+
+    def test_hmac_failures_count_expenses(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        now = timezone.now().isoformat()
+        sample = 'sidekick_hmac_failures_total{rejected="false"}'
+        before = self.value(self.scrape(), sample)
+        client.post('/api/transactions/', {
+            'tx_id': 'metered-hash', 'amount_received': '50.00', 'rider_profit': '40.00',
+            'platform_debt': '10.00', 'platform': 'BOLT', 'created_at': now, 'request_hash': 'bad',
+        }, format='json')
+        client.post('/api/expenses/', {
+            'amount': '5.00', 'category': 'FOOD', 'created_at': now, 'request_hash': 'bad',
+        }, format='json')
+        self.assertEqual(self.value(self.scrape(), sample) - before, 2)
+
+    def test_sums_worker_snapshots(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with open(os.path.join(directory, '1-other.json'), 'w') as handle:
+                json.dump({'sidekick_expenses_ingested_total': [[[], 40]]}, handle)
+            alone = self.value(self.scrape(), 'sidekick_expenses_ingested_total')
+            with override_settings(METRICS={'DIRECTORY': directory, 'FLUSH_INTERVAL': 3600}):
+                merged = self.value(self.scrape(), 'sidekick_expenses_ingested_total')
+        self.assertEqual(merged, alone + 40)
+
+    def test_scrape_needs_token_or_staff(self):
+        client = APIClient()
+        self.assertEqual(client.get('/api/metrics/').status_code, 401)
+        client.force_authenticate(self.user)
+        self.assertEqual(client.get('/api/metrics/').status_code, 403)
+        with override_settings(METRICS={'TOKEN': 'scrape-secret'}):
+            client = APIClient()
+            self.assertEqual(client.get('/api/metrics/', HTTP_AUTHORIZATION='Bearer wrong').status_code, 401)
+            self.assertEqual(client.get('/api/metrics/', HTTP_AUTHORIZATION='Bearer scrape-secret').status_code, 200)
+
+
+# The test database stands in for a replica; routing is told apart by
+# the alias the router picks rather than by the connection
+REPLICA_SETTINGS = {'ALIASES': ['default'], 'STICKY_SECONDS': 10, 'RETRY_SECONDS': 30, 'CHECK_INTERVAL': 0}
+
+
+@override_settings(DATABASE_REPLICAS=REPLICA_SETTINGS)
+class ReplicaRoutingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = seed_user('replicated', transactions=20, expenses=5)
+
+    def setUp(self):
+        cache.delete(replicas.STICKY_KEY.format(user_id=self.user.id))
+        self.health = mock.patch.object(replicas, 'health', replicas.ReplicaHealth())
+        self.health.start()
+        self.addCleanup(self.health.stop)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def routed(self, method, url, data=None):
+        """Aliases the router gave each query of the request (None: the primary)."""
+        aliases = []
+
+        def record(execute, sql, params, many, context):
+            # The health probe uses the replica's connection directly, not the router
+            if sql != replicas.HEALTH_QUERY:
+                aliases.append(replicas.current_alias())
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(record):
+            response = getattr(self.client, method)(url, data, format='json')
+            if response.streaming:
+                b''.join(response.streaming_content)
+        self.assertLess(response.status_code, 300)
+        return set(aliases)
+
+    def test_reads_go_to_the_replica_and_writes_to_the_primary(self):
+        self.assertEqual(self.routed('get', '/api/transactions/'), {'default'})
+        self.assertEqual(self.routed('get', '/api/summary/daily/'), {'default'})
+        # Streamed after the view returns, so the export is bound to the replica up front
+        with mock.patch.object(export, 'export_chunks', wraps=export.export_chunks) as export_chunks:
+            self.routed('get', '/api/export/?format=ndjson')
+        self.assertEqual(export_chunks.call_args.kwargs['using'], 'default')
+        self.assertEqual(self.routed('get', '/api/sync/'), {None})
+        self.assertEqual(self.routed('post', '/api/expenses/', {
+            'amount': '5.00', 'category': 'FOOD', 'created_at': timezone.now().isoformat(),
+        }), {None})
+
+    def test_reads_stay_on_the_primary_after_a_write(self):
+        self.assertEqual(replicas.choose_alias(self.user), 'default')
+        notify_change(self.user.id)
+        self.assertIsNone(replicas.choose_alias(self.user))
+        self.assertEqual(self.routed('get', '/api/dashboard/'), {None})
+
+    def test_unhealthy_replica_falls_back_to_the_primary(self):
+        replicas.health.mark_down('default', 'test')
+        self.assertIsNone(replicas.choose_alias(self.user))
+        with mock.patch('time.monotonic', return_value=time.monotonic() + 31):
+            self.assertEqual(replicas.choose_alias(self.user), 'default')
+
+    def test_failed_replica_read_is_retried_on_the_primary(self):
+        def broken_replica(execute, sql, params, many, context):
+            if replicas.current_alias() is not None:
+                raise OperationalError('no such table: transactions_transaction')
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(broken_replica), self.assertLogs('transactions.replicas', 'WARNING'):
+            self.assertEqual(self.client.get('/api/transactions/').status_code, 200)
+            self.assertEqual(self.client.get('/api/summary/daily/').status_code, 200)
+        self.assertFalse(replicas.health.is_up('default'))
+
+    def test_health_check_queries_the_replica(self):
+        def broken_replica(execute, sql, params, many, context):
+            raise OperationalError('no such table: django_migrations')
+
+        with connection.execute_wrapper(broken_replica), self.assertLogs('transactions.replicas', 'WARNING'):
+            self.assertFalse(replicas.health.check('default'))
+
+    def test_router(self):
+        router = replicas.ReplicaRouter()
+        self.assertEqual(router.db_for_read(Transaction), 'default')
+        with replicas.reads_from('replica1'):
+            self.assertEqual(router.db_for_read(Transaction), 'replica1')
+            self.assertEqual(router.db_for_write(Transaction), 'default')
+        self.assertFalse(router.allow_migrate('default', 'transactions'))
+
+
+class TransactionUpsertTests(TestCase):
+    """Creating a transaction is an upsert on tx_id; updates still reject a taken one."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('upsert', 'upsert@example.com', 'password123')
+        self.client = APIClient(SERVER_NAME='localhost')
+        self.client.force_authenticate(self.user)
+
+    def create(self, tx_id):
+        return self.client.post('/api/transactions/', {
+            'tx_id': tx_id, 'amount_received': '50.00', 'rider_profit': '40.00',
+            'platform_debt': '10.00', 'platform': 'BOLT', 'created_at': timezone.now().isoformat(),
+        }, format='json')
+
+    def test_duplicate_create_returns_stored_row(self):
+        first = self.create('upsert-1')
+        again = self.create('upsert-1')
+        self.assertEqual((first.status_code, again.status_code), (201, 200))
+        self.assertEqual(again.data['id'], first.data['id'])
+
+    def test_update_to_taken_tx_id_is_rejected(self):
+        self.create('upsert-1')
+        second = self.create('upsert-2').data['id']
+        response = self.client.patch(f'/api/transactions/{second}/', {'tx_id': 'upsert-1'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('tx_id', response.data)
+        self.assertEqual(Transaction.objects.get(pk=second).tx_id, 'upsert-2')
+
+
+class TxIdFilterTests(TestCase):
+    def setUp(self):
+        self.user = seed_user('filtered', transactions=20, expenses=0)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        tx_id_filter.reset()
+        self.addCleanup(tx_id_filter.reset)
+
+    def create(self, tx_id):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/api/transactions/', {
+                'tx_id': tx_id, 'amount_received': '50.00', 'rider_profit': '40.00',
+                'platform_debt': '10.00', 'platform': 'BOLT', 'created_at': timezone.now().isoformat(),
+            }, format='json')
+        lookups = [
+            query['sql'] for query in queries.captured_queries
+            if re.match(r'\s*SELECT\b.*"tx_id" = ', query['sql'], re.S)
+        ]
+        return response, lookups
+
+    def test_warmed_at_worker_boot(self):
+        hooks = runpy.run_path(os.path.join(settings.BASE_DIR, 'gunicorn.conf.py'))
+        hooks['post_worker_init'](mock.Mock())
+        self.assertTrue(tx_id_filter.stats()['warmed'])
+        self.assertEqual(tx_id_filter.stats()['items'], 20)
+
+    def test_new_tx_id_skips_the_lookup(self):
+        tx_id_filter.preload()
+        negatives = tx_id_filter.negatives
+        response, lookups = self.create('filtered-new')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(lookups, [])
+        self.assertEqual(tx_id_filter.negatives, negatives + 1)
+        self.assertIn('filtered-new', tx_id_filter._bloom)
+
+    def test_known_tx_id_is_confirmed_by_a_read(self):
+        tx_id_filter.preload()
+        false_positives = tx_id_filter.false_positives
+        response, lookups = self.create('filtered-0')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(lookups), 1)
+        self.assertEqual(tx_id_filter.false_positives, false_positives)
+
+    def test_false_positives_are_counted(self):
+        tx_id_filter.preload()
+        false_positives = tx_id_filter.false_positives
+        # Counters are per worker and cumulative
+        with mock.patch('transactions.txfilter.BloomFilter.__contains__', return_value=True):
+            response, lookups = self.create('filtered-new')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(lookups), 1)
+        self.assertEqual(tx_id_filter.false_positives, false_positives + 1)
+
+
+class BulkIngestTests(TestCase):
+    """POST /api/transactions/bulk/: one result per item, in order."""
+
+    def setUp(self):
+        self.user = seed_user('bulk', transactions=5, expenses=0)
+        rebuild_debt_balances()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        tx_id_filter.reset()
+        self.addCleanup(tx_id_filter.reset)
+
+    def item(self, tx_id, **fields):
+        return {'tx_id': tx_id, 'amount_received': '50.00', 'rider_profit': '40.00', 'platform_debt': '10.00',
+                'platform': 'YANGO', 'created_at': timezone.now().isoformat(), **fields}
+
+    def test_results_per_item(self):
+        stored = Transaction.objects.get(tx_id='bulk-0')
+        response = self.client.post('/api/transactions/bulk/', {'transactions': [
+            self.item('bulk-new-1'),
+            self.item('bulk-0'),
+            self.item('bulk-new-2', amount_received='lots'),
+            self.item('bulk-new-1'),
+        ]}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response.data['created'], response.data['duplicates'], response.data['invalid']), (1, 2, 1))
+        results = response.data['results']
+        self.assertEqual([result['status'] for result in results], ['created', 'duplicate', 'invalid', 'duplicate'])
+        created = Transaction.objects.get(tx_id='bulk-new-1')
+        self.assertEqual(results[0]['id'], created.id)
+        self.assertEqual(results[1]['id'], stored.id)
+        self.assertIn('amount_received', results[2]['errors'])
+        # A repeat within the batch points at the row its first occurrence created
+        self.assertEqual(results[3]['id'], created.id)
+        self.assertEqual(Transaction.objects.filter(user=self.user).count(), 6)
+        self.assertEqual(find_debt_mismatches([self.user.id]), [])
+
+    def test_nothing_created(self):
+        response = self.client.post('/api/transactions/bulk/', [self.item('bulk-0')], format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['duplicates'], 1)
+
+    @override_settings(TRANSACTION_BULK_MAX_ITEMS=3)
+    def test_item_limit(self):
+        items = [self.item(f'bulk-new-{i}') for i in range(4)]
+        response = self.client.post('/api/transactions/bulk/', items, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Transaction.objects.filter(tx_id__startswith='bulk-new-').exists())
+        self.assertEqual(self.client.post('/api/transactions/bulk/', items[:3], format='json').status_code, 201)
+
+    def test_insert_race_is_retried(self):
+        tx_id_filter.preload()
+        # Stored by "another worker": the row exists but this worker's filter never saw it
+        Transaction.objects.bulk_create([Transaction(
+            user=self.user, tx_id='bulk-raced', amount_received=Decimal('50.00'), rider_profit=Decimal('40.00'),
+            platform='BOLT', created_at=timezone.now(),
+        )])
+        raced = Transaction.objects.get(tx_id='bulk-raced')
+        with self.assertLogs('transactions.ingest', 'WARNING') as logs:
+            response = self.client.post('/api/transactions/bulk/', [
+                self.item('bulk-new-1'), self.item('bulk-raced'),
+            ], format='json')
+        self.assertIn('raced on tx_id', logs.output[0])
+        self.assertEqual(
+            [(result['status'], result['id']) for result in response.data['results']],
+            [('created', Transaction.objects.get(tx_id='bulk-new-1').id), ('duplicate', raced.id)],
+        )
+
+
+class IdempotencyKeyTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('retrier', 'retrier@example.com', 'password123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.expense = {'amount': '20.00', 'category': 'FUEL', 'created_at': timezone.now().isoformat()}
+
+    def post(self, data, key='retry-1'):
+        return self.client.post('/api/expenses/', data, format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_replays_the_first_response(self):
+        first = self.post(self.expense)
+        again = self.post(self.expense)
+        self.assertEqual((first.status_code, again.status_code), (201, 201))
+        self.assertEqual(again['Idempotent-Replayed'], 'true')
+        self.assertEqual(again.data['id'], first.data['id'])
+        self.assertEqual(Expense.objects.filter(user=self.user).count(), 1)
+
+    def test_key_reused_for_a_different_request(self):
+        self.post(self.expense)
+        response = self.post({**self.expense, 'amount': '25.00'})
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Expense.objects.filter(user=self.user).count(), 1)
+
+    def test_retry_while_the_first_request_runs(self):
+        retries = []
+        perform_create = ExpenseViewSet.perform_create
+
+        def slow_create(view, serializer):
+            # The retry arrives before the first request has written anything
+            retries.append(self.post(self.expense))
+            perform_create(view, serializer)
+
+        with mock.patch.object(ExpenseViewSet, 'perform_create', slow_create):
+            first = self.post(self.expense)
+        self.assertEqual((first.status_code, retries[0].status_code), (201, 409))
+        self.assertEqual(Expense.objects.filter(user=self.user).count(), 1)
+        self.assertEqual(self.post(self.expense).data['id'], first.data['id'])
+
+    def test_expired_and_failed_keys_can_be_reused(self):
+        self.assertEqual(self.post({**self.expense, 'amount': 'lots'}).status_code, 400)
+        first = self.post(self.expense)
+        self.assertEqual(first.status_code, 201)
+        later = timezone.now() + idempotency.key_ttl() + timedelta(minutes=1)
+        with mock.patch('django.utils.timezone.now', return_value=later):
+            again = self.post(self.expense)
+        self.assertEqual(again.status_code, 201)
+        self.assertFalse(again.has_header('Idempotent-Replayed'))
+        self.assertEqual(Expense.objects.filter(user=self.user).count(), 2)
+
+    def test_abandoned_reservation_is_taken_over(self):
+        # A worker died between reserving the key and storing its response
+        with mock.patch.object(ExpenseViewSet, 'perform_create', side_effect=SystemExit):
+            with self.assertRaises(SystemExit):
+                self.post(self.expense)
+        self.assertTrue(IdempotencyKey.objects.filter(user=self.user, response_status=None).exists())
+        self.assertEqual(self.post(self.expense).status_code, 409)
+
+        later = timezone.now() + idempotency.pending_lease() + timedelta(seconds=1)
+        with mock.patch('django.utils.timezone.now', return_value=later):
+            retry = self.post(self.expense)
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(self.post(self.expense).data['id'], retry.data['id'])
+        self.assertEqual(Expense.objects.filter(user=self.user).count(), 1)
+
+
+class DebtLedgerTests(TestCase):
+    """PlatformDebtBalance follows every transaction write and backs debt clearing."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('ledger', 'ledger@example.com', 'password123')
+        self.client = APIClient(SERVER_NAME='localhost')
+        self.client.force_authenticate(self.user)
+
+    def create(self, tx_id, platform, debt):
+        response = self.client.post('/api/transactions/', {
+            'tx_id': tx_id, 'amount_received': '50.00', 'rider_profit': '40.00',
+            'platform_debt': debt, 'platform': platform, 'created_at': timezone.now().isoformat(),
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        return response.data['id']
+
+    def test_ledger_follows_writes(self):
+        first = self.create('ledger-1', 'YANGO', '10.00')
+        self.create('ledger-2', 'BOLT', '7.50')
+        self.client.patch(f'/api/transactions/{first}/', {'platform_debt': '12.00'}, format='json')
+        self.client.post('/api/transactions/bulk/', [
+            {'tx_id': 'ledger-3', 'amount_received': '50.00', 'rider_profit': '40.00',
+             'platform_debt': '3.00', 'platform': 'BOLT', 'created_at': timezone.now().isoformat()},
+        ], format='json')
+        self.client.delete(f'/api/transactions/{first}/')
+
+        self.assertEqual(find_debt_mismatches(), [])
+        self.assertEqual(self.client.get('/api/dashboard/').data['debt']['total'], Decimal('10.50'))
+
+    def test_clear_debt_twice_in_a_row(self):
+        self.create('ledger-1', 'YANGO', '10.00')
+        self.create('ledger-2', 'BOLT', '7.50')
+        response = self.client.post('/api/debt/clear/')
+        self.assertEqual(response.data['amount_cleared'], Decimal('17.50'))
+
+        self.create('ledger-3', 'BOLT', '2.00')
+        # Offsets created within the same second no longer collide on tx_id
+        response = self.client.post('/api/debt/clear/')
+        self.assertEqual(response.data['amount_cleared'], Decimal('2.00'))
+        self.assertEqual(Transaction.objects.filter(user=self.user, tx_id__startswith='debt-clear-').count(), 3)
+        self.assertEqual(find_debt_mismatches(), [])
+        self.assertEqual(self.client.get('/api/dashboard/').data['debt']['total'], Decimal('0.00'))
+
+    def test_concurrent_writes_of_one_transaction(self):
+        first = self.create('ledger-1', 'YANGO', '10.00')
+        self.create('ledger-2', 'BOLT', '7.50')
+        stale = Transaction.objects.get(pk=first)
+        # Every request looked the row up before any of them wrote it
+        with mock.patch.object(TransactionViewSet, 'get_object', side_effect=lambda: copy.copy(stale)):
+            self.client.patch(f'/api/transactions/{first}/', {'platform_debt': '12.00'}, format='json')
+            self.client.patch(f'/api/transactions/{first}/', {'platform_debt': '4.00'}, format='json')
+            self.assertEqual(find_debt_mismatches(), [])
+            self.assertEqual(self.client.delete(f'/api/transactions/{first}/').status_code, 204)
+            self.assertEqual(self.client.delete(f'/api/transactions/{first}/').status_code, 204)
+
+        self.assertEqual(find_debt_mismatches(), [])
+        self.assertEqual(rollups.find_rollup_mismatches([self.user.id]), [])
+        self.assertEqual(self.client.get('/api/dashboard/').data['debt']['total'], Decimal('7.50'))
+
+
+class ExpenseRollupTests(TestCase):
+    """Daily rollups follow expense creates, edits and deletes."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('rollup', 'rollup@example.com', 'password123')
+        self.client = APIClient(SERVER_NAME='localhost')
+        self.client.force_authenticate(self.user)
+
+    def assertConsistent(self):
+        self.assertEqual(rollups.find_rollup_mismatches([self.user.id]), [])
+
+    def test_rollups_follow_expense_writes(self):
+        response = self.client.post('/api/expenses/', {
+            'amount': '20.00', 'category': 'FUEL', 'created_at': timezone.now().isoformat(),
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        expense = response.data['id']
+        self.assertConsistent()
+
+        self.client.patch(f'/api/expenses/{expense}/', {'amount': '35.00'}, format='json')
+        self.assertConsistent()
+
+        moved = (timezone.now() - timedelta(days=3)).isoformat()
+        self.client.patch(f'/api/expenses/{expense}/', {'created_at': moved}, format='json')
+        self.assertConsistent()
+
+        self.client.delete(f'/api/expenses/{expense}/')
+        self.assertConsistent()
+
+    def test_concurrent_writes_of_one_expense(self):
+        expense = self.client.post('/api/expenses/', {
+            'amount': '20.00', 'category': 'FUEL', 'created_at': timezone.now().isoformat(),
+        }, format='json').data['id']
+        stale = Expense.objects.get(pk=expense)
+        # Every request looked the row up before any of them wrote it
+        with mock.patch.object(ExpenseViewSet, 'get_object', side_effect=lambda: copy.copy(stale)):
+            self.client.patch(f'/api/expenses/{expense}/', {'amount': '35.00'}, format='json')
+            self.client.patch(f'/api/expenses/{expense}/', {'amount': '50.00'}, format='json')
+            self.assertConsistent()
+            self.assertEqual(self.client.delete(f'/api/expenses/{expense}/').status_code, 204)
+            self.assertEqual(self.client.delete(f'/api/expenses/{expense}/').status_code, 204)
+        self.assertConsistent()
+        self.assertEqual(Tombstone.objects.filter(object_id=expense).count(), 1)
+
+    def test_sample_data_script_keeps_rollups(self):
+        script = runpy.run_path(os.path.join(settings.BASE_DIR, 'create_sample_data.py'))
+        with mock.patch('builtins.print'):
+            script['create_sample_data']()
+        self.assertEqual(rollups.find_rollup_mismatches(), [])
+        self.assertEqual(find_debt_mismatches(), [])
+
+
+class LocalDayTests(TestCase):
+    """'Today' and named periods follow the driver's timezone, as half-open created_at ranges."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('kiritimati', 'kiritimati@example.com', 'password123')
+        self.client = APIClient(SERVER_NAME='localhost')
+        self.client.force_authenticate(self.user)
+
+    def test_period_ranges(self):
+        accra = get_timezone('Africa/Accra')
+        now = datetime(2026, 3, 4, 12, 0, tzinfo=accra)
+        self.assertEqual(period_range('this_week', accra, now), (
+            datetime(2026, 3, 2, tzinfo=accra), datetime(2026, 3, 9, tzinfo=accra),
+        ))
+        self.assertEqual(period_range('last_month', accra, now), (
+            datetime(2026, 2, 1, tzinfo=accra), datetime(2026, 3, 1, tzinfo=accra),
+        ))
+        # A spring-forward day is 23 hours long
+        start, end = day_range(date(2026, 3, 29), get_timezone('Europe/London'))
+        self.assertEqual(end.timestamp() - start.timestamp(), 23 * 3600)
+
+    def test_daily_summary_uses_local_day(self):
+        response = self.client.put('/api/profile/', {'timezone': 'Pacific/Kiritimati'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.put('/api/profile/', {'timezone': 'Mars/Olympus'}, format='json').status_code, 400)
+
+        # UTC+14: the local day starts ten hours before the UTC one
+        start, _ = period_range('today', get_timezone('Pacific/Kiritimati'))
+        for tx_id, created_at, profit in (
+            ('local-today', start + timedelta(minutes=1), '40.00'),
+            ('local-yesterday', start - timedelta(minutes=1), '25.00'),
+        ):
+            self.client.post('/api/transactions/', {
+                'tx_id': tx_id, 'amount_received': profit, 'rider_profit': profit,
+                'platform': 'YANGO', 'created_at': created_at.isoformat(),
+            }, format='json')
+
+        self.assertEqual(self.client.get('/api/summary/daily/').data['yango_income'], Decimal('40.00'))
+        yesterday = (start - timedelta(days=1)).date().isoformat()
+        self.assertEqual(
+            self.client.get(f'/api/summary/daily/?date={yesterday}').data['yango_income'], Decimal('25.00'),
+        )
+        self.assertEqual(
+            self.client.get('/api/summary/period/?period=yesterday').data['yango_income'], Decimal('25.00'),
+        )
+
+    def test_named_period_etag_rolls_over_with_the_day(self):
+        url = '/api/summary/period/?period=today'
+        first = self.client.get(url)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag']).status_code, 304)
+        # No writes in between: only the clock moved on
+        with mock.patch('django.utils.timezone.now', return_value=timezone.now() + timedelta(days=1)):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], first['ETag'])
+
+
+class ExportTests(TestCase):
+    """GET /api/export/ date bounds."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('exporter', 'exporter@example.com', 'password123')
+        self.client = APIClient(SERVER_NAME='localhost')
+        self.client.force_authenticate(self.user)
+
+    def test_naive_bounds_use_the_local_day(self):
+        self.client.put('/api/profile/', {'timezone': 'Pacific/Kiritimati'}, format='json')
+        start, _ = day_range(date(2026, 3, 4), get_timezone('Pacific/Kiritimati'))
+        for tx_id, created_at in (('export-inside', start + timedelta(minutes=1)),
+                                  ('export-before', start - timedelta(minutes=1))):
+            self.client.post('/api/transactions/', {
+                'tx_id': tx_id, 'amount_received': '40.00', 'rider_profit': '40.00',
+                'platform': 'YANGO', 'created_at': created_at.isoformat(),
+            }, format='json')
+
+        response = self.client.get('/api/export/?format=ndjson&start=2026-03-04T00:00:00&end=2026-03-05T00:00:00')
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([row['tx_id'] for row in rows], ['export-inside'])
+
+
+class ImportTransactionsTests(TestCase):
+    """manage.py import_transactions: batched, de-duplicated and resumable."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('importer', 'importer@example.com', 'password123')
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path = os.path.join(self.directory.name, 'history.csv')
+        now = timezone.now()
+        with open(self.path, 'w') as handle:
+            handle.write('type,tx_id,amount_received,rider_profit,platform_debt,platform,trip_price,created_at\n')
+            for i in range(10):
+                platform = ['YANGO', 'BOLT', 'PRIVATE'][i % 3]
+                created_at = (now - timedelta(hours=i)).isoformat()
+                handle.write(f'transaction,import-{i},50.00,40.00,10.00,{platform},,{created_at}\n')
+            handle.write(f'expense,,,,,,,{now.isoformat()}\n')
+            handle.write(f'transaction,import-bad,abc,40.00,10.00,BOLT,,{now.isoformat()}\n')
+
+    def run_import(self, *args):
+        call_command('import_transactions', self.path, '--user', 'importer', '--batch-size', '4', *args,
+                     stdout=io.StringIO(), stderr=io.StringIO())
+
+    def test_import_is_idempotent(self):
+        self.run_import()
+        imported = Transaction.objects.filter(user=self.user)
+        self.assertEqual(imported.count(), 10)
+        self.assertEqual(imported.get(tx_id='import-0').department, 'INVESTMENT')
+        self.assertIsNone(imported.get(tx_id='import-0').trip_price)
+        self.assertFalse(os.path.exists(f'{self.path}.progress'))
+
+        self.run_import()
+        self.assertEqual(imported.count(), 10)
+        # Rollups were updated alongside the inserts (raises on mismatch)
+        call_command('check_rollups', '--user', str(self.user.id), stdout=io.StringIO())
+        self.assertEqual(find_debt_mismatches([self.user.id]), [])
+
+    def test_resume_skips_committed_rows(self):
+        with open(f'{self.path}.progress', 'w') as handle:
+            json.dump({'user': self.user.id, 'records': 8, 'created': 0, 'duplicates': 0,
+                       'invalid': 0, 'skipped': 0}, handle)
+        self.run_import('--resume')
+        self.assertEqual(
+            sorted(Transaction.objects.filter(user=self.user).values_list('tx_id', flat=True)),
+            ['import-8', 'import-9'],
+        )
+
+
+class SeedScaleTests(TestCase):
+    def test_seeded_history_is_consistent(self):
+        call_command('seed_scale', '--users', '2', '--transactions', '300', '--days', '30', stdout=io.StringIO())
+        users = User.objects.filter(username__startswith='scale-')
+        self.assertEqual(users.count(), 2)
+        self.assertEqual(Transaction.objects.filter(user__in=users).count(), 600)
+        self.assertEqual(Expense.objects.filter(user__in=users).count(), 30)
+        self.assertTrue(self.client.login(username='scale-0', password='password123'))
+        call_command('check_rollups', stdout=io.StringIO())
+        self.assertEqual(find_debt_mismatches(), [])
 
-# Create your tests here.
@@ -0,0 +1,115 @@
+"""
+Per-bucket earnings series for charts (GET /api/summary/timeseries/).
+
+Transactions and expenses in [start, end) are grouped by Trunc(created_at)
+in the requested timezone, per platform, in a single UNION ALL query; the
+buckets with no activity are zero-filled in Python so charts always get a
+contiguous series.
+"""
+from decimal import Decimal
+
+from django.db.models import CharField, Count, DecimalField, IntegerField, Sum, Value
+from django.db.models.functions import Trunc
+
+from .models import Expense, Transaction
+from .periods import bucket_start, next_bucket
+
+BUCKETS = ('hour', 'day', 'week', 'month')
+PLATFORMS = [platform for platform, _ in Transaction.PLATFORM_CHOICES]
+CENT = Decimal('0.01')
+ZERO = Decimal('0.00')
+MONEY = DecimalField(max_digits=14, decimal_places=2)
+
+
+def bucket_starts(start, end, bucket, tz):
+    current = bucket_start(start, bucket, tz)
+    while current < end:
+        yield current
+        current = next_bucket(current, bucket, tz)
+
+
+def count_buckets(start, end, bucket, tz, limit):
+    """Number of buckets in [start, end), counting no further than limit + 1."""
+    count = 0
+    for _ in bucket_starts(start, end, bucket, tz):
+        count += 1
+        if count > limit:
+            break
+    return count
+
+
+def _empty_bucket(start):
+    return {
+        'start': start,
+        'profit': ZERO,
+        'debt': ZERO,
+        'tips': ZERO,
+        'expenses': ZERO,
+        'net_profit': ZERO,
+        'transaction_count': 0,
+        'expense_count': 0,
+        'platforms': {
+            platform: {'profit': ZERO, 'debt': ZERO, 'transaction_count': 0}
+            for platform in PLATFORMS
+        },
+    }
+
+
+def timeseries(user, start, end, bucket, tz):
+    """
+    One entry per bucket in [start, end): totals plus a per-platform split.
+
+    start and end are aware datetimes; tz is a tzinfo the buckets are
+    aligned to (local days, weeks starting Monday, calendar months).
+    """
+    truncated = Trunc('created_at', bucket, tzinfo=tz)
+    transactions = Transaction.objects.filter(
+        user=user, created_at__gte=start, created_at__lt=end,
+    ).annotate(bucket=truncated).values('bucket', 'platform').annotate(
+        profit=Sum('rider_profit'),
+        debt=Sum('platform_debt'),
+        tips=Sum('tip_amount'),
+        expenses=Value(ZERO, output_field=MONEY),
+        transaction_count=Count('id'),
+        expense_count=Value(0, output_field=IntegerField()),
+    ).order_by()
+    expenses = Expense.objects.filter(
+        user=user, created_at__gte=start, created_at__lt=end,
+    ).annotate(
+        bucket=truncated, platform=Value('', output_field=CharField()),
+    ).values('bucket', 'platform').annotate(
+        profit=Value(ZERO, output_field=MONEY),
+        debt=Value(ZERO, output_field=MONEY),
+        tips=Value(ZERO, output_field=MONEY),
+        expenses=Sum('amount'),
+        transaction_count=Value(0, output_field=IntegerField()),
+        expense_count=Count('id'),
+    ).order_by()
+
+    series = {starts: _empty_bucket(starts) for starts in bucket_starts(start, end, bucket, tz)}
+    for row in transactions.union(expenses, all=True):
+        entry = series.get(row['bucket'])
+        if entry is None:
+            # Only possible if the database's timezone rules disagree with ours
+            entry = series.setdefault(row['bucket'], _empty_bucket(row['bucket']))
+        for key in ('profit', 'debt', 'tips', 'expenses'):
+            entry[key] += Decimal(row[key] or 0)
+        entry['transaction_count'] += row['transaction_count']
+        entry['expense_count'] += row['expense_count']
+        if row['platform'] in entry['platforms']:
+            platform = entry['platforms'][row['platform']]
+            platform['profit'] += Decimal(row['profit'] or 0)
+            platform['debt'] += Decimal(row['debt'] or 0)
+            platform['transaction_count'] += row['transaction_count']
+
+    result = []
+    for starts in sorted(series):
+        entry = series[starts]
+        for key in ('profit', 'debt', 'tips', 'expenses'):
+            entry[key] = entry[key].quantize(CENT)
+        entry['net_profit'] = entry['profit'] - entry['expenses']
+        for platform in entry['platforms'].values():
+            platform['profit'] = platform['profit'].quantize(CENT)
+            platform['debt'] = platform['debt'].quantize(CENT)
+        result.append(entry)
+    return result
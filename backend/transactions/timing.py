@@ -0,0 +1,112 @@
+"""
+Per-request phase timings for the Server-Timing header.
+
+ServerTimingMiddleware (transactions.middleware) starts a Timings for a
+sampled request and makes it current; code then reports the time it spends
+in a phase with `with phase('serializer'): ...`. Outside a sampled request
+phase() returns a shared no-op context manager, so the instrumentation
+costs one context variable lookup.
+
+Phases nest: auth, serializer and sql time is also part of view time.
+"""
+import time
+from contextlib import nullcontext
+from contextvars import ContextVar
+
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+_current = ContextVar('server_timing', default=None)
+_NOT_SAMPLED = nullcontext()
+
+
+class Timings:
+    """Seconds spent per phase, plus the number of SQL queries, for one request."""
+
+    def __init__(self):
+        self.durations = {}
+        self.queries = 0
+        self.active = set()
+        self.view_started = None
+
+    def add(self, name, seconds):
+        self.durations[name] = self.durations.get(name, 0.0) + seconds
+
+    def phase(self, name):
+        return _Phase(self, name)
+
+    def start_view(self):
+        self.view_started = time.perf_counter()
+
+    def end_view(self):
+        if self.view_started is not None:
+            self.add('view', time.perf_counter() - self.view_started)
+            self.view_started = None
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        """connection.execute_wrapper() hook counting and timing every query."""
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.add('sql', time.perf_counter() - started)
+
+    def activate(self):
+        return _current.set(self)
+
+    @staticmethod
+    def deactivate(token):
+        _current.reset(token)
+
+
+class _Phase:
+    __slots__ = ('timings', 'name', 'started')
+
+    def __init__(self, timings, name):
+        self.timings = timings
+        self.name = name
+        self.started = None
+
+    def __enter__(self):
+        # A phase re-entered from inside itself (a nested serializer) is
+        # already being timed by the outer one
+        if self.name not in self.timings.active:
+            self.timings.active.add(self.name)
+            self.started = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        if self.started is not None:
+            self.timings.add(self.name, time.perf_counter() - self.started)
+            self.timings.active.discard(self.name)
+
+
+def current():
+    """The Timings of the request being sampled, or None."""
+    return _current.get()
+
+
+def phase(name):
+    timings = _current.get()
+    if timings is None:
+        return _NOT_SAMPLED
+    return timings.phase(name)
+
+
+class TimedSerializerMixin:
+    """Reports (de)serialization as the 'serializer' phase."""
+
+    def to_representation(self, instance):
+        with phase('serializer'):
+            return super().to_representation(instance)
+
+    def to_internal_value(self, data):
+        with phase('serializer'):
+            return super().to_internal_value(data)
+
+
+class TimedJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication, reporting token checks as the 'auth' phase."""
+
+    def authenticate(self, request):
+        with phase('auth'):
+            return super().authenticate(request)
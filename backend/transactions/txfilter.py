@@ -0,0 +1,156 @@
+"""
+In-process Bloom filter over stored tx_ids.
+
+Each worker keeps a compact bit array of every tx_id it knows about, warmed
+from the Transaction table when the worker boots (gunicorn.conf.py; on first
+use elsewhere, e.g. runserver) and updated on insert. A
+negative answer is definitive, so a brand new tx_id skips the duplicate
+lookup; a positive answer only means "probably stored" and is confirmed
+against the database with a read instead of attempting an INSERT.
+
+The filter is never authoritative: tx_ids inserted by other workers after
+this worker warmed up are simply misses, and the unique constraint on tx_id
+(see TransactionManager.insert_or_get) still catches them.
+"""
+import hashlib
+import logging
+import math
+import threading
+import time
+
+from django.conf import settings
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter using double hashing over one blake2b digest."""
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = max(int(capacity), 1)
+        self.error_rate = error_rate
+        self.num_bits = max(int(math.ceil(-self.capacity * math.log(error_rate) / (math.log(2) ** 2))), 8)
+        self.num_hashes = max(int(round(self.num_bits / self.capacity * math.log(2))), 1)
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, item):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+    @property
+    def memory_bytes(self):
+        return len(self.bits)
+
+    def estimated_false_positive_rate(self):
+        return (1 - math.exp(-self.num_hashes * self.count / self.num_bits)) ** self.num_hashes
+
+
+class TxIdFilter:
+    """Per-worker tx_id membership filter with hit/false-positive counters."""
+
+    def __init__(self, capacity=1_000_000, error_rate=0.001, enabled=True):
+        self.min_capacity = capacity
+        self.error_rate = error_rate
+        self.enabled = enabled
+        self._bloom = None
+        self._lock = threading.Lock()
+        self.warm_seconds = None
+        self.lookups = 0
+        self.negatives = 0
+        self.false_positives = 0
+
+    def warm(self):
+        """Load every stored tx_id; sized for at least twice the current table."""
+        from .models import Transaction
+
+        started = time.monotonic()
+        stored = Transaction.objects.count()
+        bloom = BloomFilter(max(self.min_capacity, stored * 2), self.error_rate)
+        for tx_id in Transaction.objects.values_list('tx_id', flat=True).iterator(chunk_size=10000):
+            bloom.add(tx_id)
+        self._bloom = bloom
+        self.warm_seconds = time.monotonic() - started
+        logger.info(
+            f"tx_id filter warmed with {bloom.count} ids in {self.warm_seconds:.2f}s "
+            f"({bloom.memory_bytes} bytes, {bloom.num_hashes} hashes)"
+        )
+
+    def preload(self):
+        """Warm the filter now, ahead of the first lookup (worker boot)."""
+        self._ready()
+
+    def _ready(self):
+        if not self.enabled:
+            return False
+        if self._bloom is None:
+            with self._lock:
+                if self._bloom is None:
+                    self.warm()
+        return True
+
+    def might_contain(self, tx_id):
+        """False means tx_id is definitely not stored (as far as this worker knows)."""
+        if not self._ready():
+            return True
+        self.lookups += 1
+        if tx_id in self._bloom:
+            return True
+        self.negatives += 1
+        return False
+
+    def add(self, tx_id):
+        # Before warm-up there is nothing to update; warm() reads the table
+        if self.enabled and self._bloom is not None:
+            self._bloom.add(tx_id)
+
+    def record_false_positive(self):
+        self.false_positives += 1
+
+    def reset(self):
+        with self._lock:
+            self._bloom = None
+
+    def stats(self):
+        bloom = self._bloom
+        positives = self.lookups - self.negatives
+        return {
+            'enabled': self.enabled,
+            'warmed': bloom is not None,
+            'items': bloom.count if bloom else 0,
+            'capacity': bloom.capacity if bloom else 0,
+            'memory_bytes': bloom.memory_bytes if bloom else 0,
+            'hashes': bloom.num_hashes if bloom else 0,
+            'estimated_false_positive_rate': bloom.estimated_false_positive_rate() if bloom else 0.0,
+            'lookups': self.lookups,
+            'negatives': self.negatives,
+            'positives': positives,
+            'false_positives': self.false_positives,
+            'observed_false_positive_rate': self.false_positives / positives if positives else 0.0,
+            'warm_seconds': self.warm_seconds,
+        }
+
+
+_config = getattr(settings, 'TX_ID_FILTER', {})
+tx_id_filter = TxIdFilter(
+    capacity=_config.get('CAPACITY', 1_000_000),
+    error_rate=_config.get('ERROR_RATE', 0.001),
+    enabled=_config.get('ENABLED', True),
+)
+metrics.register_collector(lambda: [
+    ('sidekick_tx_id_filter_lookups_total', {'result': 'negative'}, tx_id_filter.negatives),
+    ('sidekick_tx_id_filter_lookups_total', {'result': 'positive'}, tx_id_filter.lookups - tx_id_filter.negatives),
+    ('sidekick_tx_id_filter_false_positives_total', {}, tx_id_filter.false_positives),
+])
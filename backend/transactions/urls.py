@@ -1,6 +1,7 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import TransactionViewSet, ExpenseViewSet, DailySummaryView, PeriodSummaryView, ClearDebtView
+from .streams import StreamTokenView, summary_stream
+from .views import TransactionViewSet, ExpenseViewSet, DailySummaryView, PeriodSummaryView, ClearDebtView, DashboardView, ExportView, MetricsView, ProfileView, StatsView, TimeSeriesView, SyncView
 
 router = DefaultRouter()
 router.register(r'transactions', TransactionViewSet, basename='transaction')
@@ -10,5 +11,14 @@ urlpatterns = [
     path('', include(router.urls)),
     path('summary/daily/', DailySummaryView.as_view(), name='daily-summary'),
     path('summary/period/', PeriodSummaryView.as_view(), name='period-summary'),
+    path('summary/timeseries/', TimeSeriesView.as_view(), name='summary-timeseries'),
     path('debt/clear/', ClearDebtView.as_view(), name='clear-debt'),
+    path('dashboard/', DashboardView.as_view(), name='dashboard'),
+    path('profile/', ProfileView.as_view(), name='profile'),
+    path('export/', ExportView.as_view(), name='export'),
+    path('sync/', SyncView.as_view(), name='sync'),
+    path('stream/summary/', summary_stream, name='summary-stream'),
+    path('stream/token/', StreamTokenView.as_view(), name='stream-token'),
+    path('stats/', StatsView.as_view(), name='stats'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
 ]
\ No newline at end of file
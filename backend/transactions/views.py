@@ -1,14 +1,34 @@
+import copy
 import logging
+import uuid
 from rest_framework import viewsets
+from rest_framework.decorators import action
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated, BasePermission, AllowAny
-from django.db.models import Sum
-from django.db import models
+from rest_framework.permissions import IsAuthenticated, IsAdminUser, BasePermission, AllowAny
+from rest_framework.negotiation import DefaultContentNegotiation
+from django.db import transaction
+from django.conf import settings
 from django.contrib.auth.models import User
-from .models import Transaction, Expense
-from .serializers import TransactionSerializer, ExpenseSerializer
-from datetime import date, datetime
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.utils import timezone
+from .models import DriverProfile, Transaction, Expense, Tombstone
+from .serializers import DriverProfileSerializer, TransactionSerializer, ExpenseSerializer
+from . import export, metrics, rollups, timeseries
+from .cache import cached_summarize, summary_cache
+from .conditional import conditional_response
+from .events import notify_change
+from .idempotency import idempotent_response
+from .metrics import CanScrapeMetrics, MetricsTokenAuthentication
+from .ingest import bulk_ingest_transactions, STATUS_CREATED, STATUS_DUPLICATE, STATUS_INVALID
+from .periods import PERIODS, day_range, get_timezone, period_range, user_timezone
+from .replicas import ReplicaReadMixin, current_alias
+from .rows import row_encoder_for
+from .sync import delta_sync, CursorExpired, InvalidCursor
+from .timing import TimedJWTAuthentication, phase
+from .txfilter import tx_id_filter
+from datetime import date, datetime, timedelta
 
 logger = logging.getLogger(__name__)
 
@@ -22,50 +42,230 @@ class IsAuthenticatedOrSMSBridge(BasePermission):
         return request.user and request.user.is_authenticated
 
 
-class TransactionViewSet(viewsets.ModelViewSet):
+class SparseFieldsetsViewMixin:
+    """
+    ?fields= / ?exclude= on GET: pass the selection to the serializer and
+    fetch only the columns it renders (plus the keyset ordering columns).
+    """
+    always_fetched = ('id', 'created_at')
+
+    def get_field_selection(self):
+        if self.request.method != 'GET':
+            return None
+        if not hasattr(self, '_field_selection'):
+            self._field_selection = self.get_serializer_class().selected_fields(self.request.query_params)
+        return self._field_selection
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['fields'] = self.get_field_selection()
+        return context
+
+    def project_queryset(self, queryset):
+        serializer_class = self.get_serializer_class()
+        selection = self.get_field_selection()
+        # An empty ?fields= selects nothing: no columns beyond the keyset ones
+        columns, related = serializer_class.model_columns(
+            serializer_class.readable_fields() if selection is None else selection
+        )
+        if related:
+            # select_related() without arguments would follow every foreign key
+            queryset = queryset.select_related(*related)
+        if selection is not None:
+            queryset = queryset.only(*self.always_fetched, *columns)
+        return queryset
+
+
+class FastListMixin:
+    """
+    list() through transactions.rows: value tuples are encoded straight into
+    the serializer's output, without model instances or per-field lookups.
+    Falls back to the serializer when the fields cannot be encoded that way.
+    """
+    keyset_columns = ('created_at', 'id')
+
+    def get_row_encoder(self):
+        if not getattr(settings, 'FAST_LIST_SERIALIZATION', True):
+            return None
+        serializer_class = self.get_serializer_class()
+        selection = self.get_field_selection()
+        # An empty ?fields= selects nothing, as in the serializer
+        names = serializer_class.readable_fields() if selection is None else selection
+        integer_values = getattr(self.request.accepted_renderer, 'integer_values', False)
+        return row_encoder_for(serializer_class, tuple(names), self.keyset_columns, integer_values)
+
+    def list(self, request, *args, **kwargs):
+        encoder = self.get_row_encoder()
+        if encoder is None:
+            return super().list(request, *args, **kwargs)
+
+        rows = self.filter_queryset(self.get_queryset()).values_list(*encoder.columns, named=True)
+        page = self.paginate_queryset(rows)
+        with phase('serializer'):
+            data = encoder.encode(rows if page is None else page)
+        if page is not None:
+            return self.get_paginated_response(data)
+        return Response(data)
+
+
+class LockedRollupWriteMixin:
+    """
+    perform_update()/perform_destroy() that keep the rollups in step when the
+    same row is written concurrently: the row is re-read under a lock inside
+    the write's transaction, so each request takes back what is stored rather
+    than what it read earlier, and only a delete that removed the row does.
+    """
+    tombstone_model = None
+
+    def apply_rollup(self, instance, sign=1):
+        raise NotImplementedError
+
+    def lock_instance(self, instance):
+        current = type(instance).objects.select_for_update().filter(pk=instance.pk).first()
+        if current is not None and current.user_id == instance.user_id:
+            # The owner get_object() already loaded, rather than another query for it
+            current.user = instance.user
+        return current
+
+    def perform_update(self, serializer):
+        with transaction.atomic():
+            current = self.lock_instance(serializer.instance)
+            if current is None:
+                raise Http404
+            previous = copy.copy(current)
+            serializer.instance = current
+            instance = serializer.save()
+            self.apply_rollup(previous, sign=-1)
+            self.apply_rollup(instance)
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            current = self.lock_instance(instance)
+            # Gone already: the request that deleted it took it out of the rollups
+            if current is None or not current.delete()[0]:
+                return
+            self.apply_rollup(current, sign=-1)
+            Tombstone.objects.create(user_id=instance.user_id, model=self.tombstone_model, object_id=instance.pk)
+
+
+class TransactionViewSet(ReplicaReadMixin, SparseFieldsetsViewMixin, FastListMixin, LockedRollupWriteMixin, viewsets.ModelViewSet):
     queryset = Transaction.objects.all()
     serializer_class = TransactionSerializer
     permission_classes = [IsAuthenticatedOrSMSBridge]
+    tombstone_model = Tombstone.TRANSACTION
 
     def get_queryset(self):
         # Filter transactions by current user only
+        # Stable (created_at, id) ordering so keyset pagination never skips or repeats rows
         logger.info(f"TransactionViewSet get_queryset called by user: {self.request.user}")
-        queryset = Transaction.objects.filter(user=self.request.user)
-        count = queryset.count()
-        logger.info(f"TransactionViewSet returning {count} transactions for user {self.request.user.id}")
-        return queryset
+        return self.project_queryset(Transaction.objects.filter(user=self.request.user).order_by('-created_at', '-id'))
 
     def list(self, request, *args, **kwargs):
-        response = super().list(request, *args, **kwargs)
-        logger.info(f"TransactionViewSet list response data: {response.data}")
-        return response
+        return conditional_response(request, 'transactions', lambda: super(TransactionViewSet, self).list(request, *args, **kwargs))
 
-    def perform_create(self, serializer):
+    def get_owner(self):
+        if hasattr(self, '_owner'):
+            return self._owner
         # Automatically assign user on creation
         if self.request.user.is_authenticated:
-            logger.info(f"perform_create: Saving transaction for user: {self.request.user.id} ({self.request.user.username})")
-            serializer.save(user=self.request.user)
+            logger.info(f"Saving transaction for user: {self.request.user.id} ({self.request.user.username})")
+            self._owner = self.request.user
         else:
             # For SMS bridge, assign to first user (for testing)
-            first_user = User.objects.first()
-            logger.warning(f"perform_create: No authenticated user, assigning to first user: {first_user.id if first_user else 'None'}")
-            serializer.save(user=first_user)
+            self._owner = User.objects.first()
+            logger.warning(f"No authenticated user, assigning to first user: {self._owner.id if self._owner else 'None'}")
+        return self._owner
+
+    def create(self, request, *args, **kwargs):
+        return idempotent_response(request, self.get_owner(), lambda: self._create(request))
+
+    def _create(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        self.perform_create(serializer)
+        headers = self.get_success_headers(serializer.data)
+        # A retried tx_id returns the stored row rather than a new resource
+        status = 200 if serializer.is_duplicate else 201
+        return Response(serializer.data, status=status, headers=headers)
+
+    def perform_create(self, serializer):
+        user = self.get_owner()
+        with transaction.atomic():
+            instance = serializer.save(user=user)
+            if not serializer.is_duplicate:
+                rollups.apply_transaction(instance)
+        if serializer.is_duplicate:
+            metrics.transaction_duplicates.inc(path='single')
+        else:
+            metrics.transactions_ingested.inc(path='single')
+
+    def apply_rollup(self, instance, sign=1):
+        # Daily rollups and the PlatformDebtBalance ledger
+        rollups.apply_transaction(instance, sign)
+
+    @action(detail=False, methods=['post'], url_path='bulk')
+    def bulk(self, request):
+        """
+        Ingest a batch of transactions (SMS backlog sync).
+
+        Accepts a JSON list, or {"transactions": [...]}, and returns a status
+        per item: created, duplicate (tx_id already stored) or invalid.
+        """
+        return idempotent_response(request, self.get_owner(), lambda: self._bulk(request))
+
+    def _bulk(self, request):
+        items = request.data.get('transactions') if isinstance(request.data, dict) else request.data
+        if not isinstance(items, list):
+            return Response({'error': 'Expected a list of transactions'}, status=400)
+
+        max_items = getattr(settings, 'TRANSACTION_BULK_MAX_ITEMS', 5000)
+        if len(items) > max_items:
+            return Response({'error': f'At most {max_items} transactions per request'}, status=400)
+
+        user = self.get_owner()
+        if user is None:
+            return Response({'error': 'Unable to determine user for transactions'}, status=400)
+
+        results = bulk_ingest_transactions(user, items, context=self.get_serializer_context())
+        counts = {STATUS_CREATED: 0, STATUS_DUPLICATE: 0, STATUS_INVALID: 0}
+        for result in results:
+            counts[result['status']] += 1
+
+        return Response({
+            'created': counts[STATUS_CREATED],
+            'duplicates': counts[STATUS_DUPLICATE],
+            'invalid': counts[STATUS_INVALID],
+            'results': results,
+        }, status=201 if counts[STATUS_CREATED] else 200)
 
 
-class ExpenseViewSet(viewsets.ModelViewSet):
+class ExpenseViewSet(ReplicaReadMixin, SparseFieldsetsViewMixin, FastListMixin, LockedRollupWriteMixin, viewsets.ModelViewSet):
     queryset = Expense.objects.all()
     serializer_class = ExpenseSerializer
     permission_classes = [IsAuthenticated]
+    tombstone_model = Tombstone.EXPENSE
+
+    def create(self, request, *args, **kwargs):
+        return idempotent_response(request, request.user, lambda: super(ExpenseViewSet, self).create(request, *args, **kwargs))
 
     def get_queryset(self):
         # Filter expenses by current user only
         logger.info(f"ExpenseViewSet get_queryset called by user: {self.request.user}")
-        return Expense.objects.filter(user=self.request.user)
+        return self.project_queryset(Expense.objects.filter(user=self.request.user).order_by('-created_at', '-id'))
+
+    def list(self, request, *args, **kwargs):
+        return conditional_response(request, 'expenses', lambda: super(ExpenseViewSet, self).list(request, *args, **kwargs))
 
     def perform_create(self, serializer):
         # Automatically assign user on creation
         logger.info(f"ExpenseViewSet perform_create called by user: {self.request.user}")
-        serializer.save(user=self.request.user)
+        with transaction.atomic():
+            instance = serializer.save(user=self.request.user)
+            rollups.apply_expense(instance)
+        metrics.expenses_ingested.inc()
+
+    def apply_rollup(self, instance, sign=1):
+        rollups.apply_expense(instance, sign)
 
 
 class ClearDebtView(APIView):
@@ -79,69 +279,9 @@ class ClearDebtView(APIView):
         logger.info(f"ClearDebtView called by user: {user.id}")
 
         try:
-            # Get current total debt
-            current_debt = Transaction.objects.filter(user=user).aggregate(
-                total_debt=Sum('platform_debt')
-            )['total_debt'] or 0
-
-            if current_debt == 0:
-                return Response({
-                    'success': True,
-                    'message': 'No debt to clear',
-                    'amount_cleared': 0
-                })
-
-            # Create offset transactions for each platform
-            yango_debt = Transaction.objects.filter(
-                user=user, platform='YANGO'
-            ).aggregate(total=Sum('platform_debt'))['total'] or 0
-
-            bolt_debt = Transaction.objects.filter(
-                user=user, platform='BOLT'
-            ).aggregate(total=Sum('platform_debt'))['total'] or 0
-
-            cleared_count = 0
-
-            # Create Yango debt offset if there's Yango debt
-            if yango_debt > 0:
-                Transaction.objects.create(
-                    user=user,
-                    tx_id=f'debt-clear-yango-{int(datetime.now().timestamp())}',
-                    amount_received=0,
-                    rider_profit=0,
-                    platform_debt=-yango_debt,  # Negative debt to offset
-                    platform='YANGO',
-                    department='INVESTMENT',
-                    is_tip=False,
-                    tip_amount=0,
-                    created_at=datetime.now()
-                )
-                cleared_count += 1
-                logger.info(f"Created Yango debt offset: {yango_debt}")
-
-            # Create Bolt debt offset if there's Bolt debt
-            if bolt_debt > 0:
-                Transaction.objects.create(
-                    user=user,
-                    tx_id=f'debt-clear-bolt-{int(datetime.now().timestamp())}',
-                    amount_received=0,
-                    rider_profit=0,
-                    platform_debt=-bolt_debt,  # Negative debt to offset
-                    platform='BOLT',
-                    department='REVENUE',
-                    is_tip=False,
-                    tip_amount=0,
-                    created_at=datetime.now()
-                )
-                cleared_count += 1
-                logger.info(f"Created Bolt debt offset: {bolt_debt}")
-
-            return Response({
-                'success': True,
-                'message': f'Debt cleared with {cleared_count} offset transaction(s)',
-                'amount_cleared': float(current_debt)
-            })
-
+            # Offsets and their rollup updates land together or not at all
+            with transaction.atomic():
+                return self._clear_debt(user)
         except Exception as e:
             logger.error(f"Error clearing debt: {e}")
             return Response({
@@ -149,8 +289,75 @@ class ClearDebtView(APIView):
                 'message': f'Error clearing debt: {str(e)}'
             }, status=400)
 
+    def _clear_debt(self, user):
+        # Current debt from the ledger; the row locks keep a concurrent clear
+        # (or a new transaction) from changing it until the offsets commit
+        debts = rollups.debt_by_platform(user, lock=True)
+        current_debt = sum(debts.values(), rollups.ZERO)
 
-class DailySummaryView(APIView):
+        if current_debt == 0:
+            return Response({
+                'success': True,
+                'message': 'No debt to clear',
+                'amount_cleared': 0
+            })
+
+        cleared_count = 0
+        now = timezone.now()
+
+        # Create an offset transaction for each platform with debt
+        for platform in ('YANGO', 'BOLT'):
+            platform_debt = debts.get(platform, rollups.ZERO)
+            if platform_debt <= 0:
+                continue
+            offset = Transaction.objects.create(
+                user=user,
+                # Unique even for clears within the same second
+                tx_id=f'debt-clear-{platform.lower()}-{int(now.timestamp())}-{uuid.uuid4().hex[:12]}',
+                amount_received=0,
+                rider_profit=0,
+                platform_debt=-platform_debt,  # Negative debt to offset
+                platform=platform,
+                is_tip=False,
+                tip_amount=0,
+                created_at=now
+            )
+            rollups.apply_transaction(offset)
+            cleared_count += 1
+            logger.info(f"Created {platform} debt offset: {platform_debt}")
+
+        return Response({
+            'success': True,
+            'message': f'Debt cleared with {cleared_count} offset transaction(s)',
+            'amount_cleared': current_debt
+        })
+
+
+def daily_summary_payload(user, day_start, day_end):
+    """A local day's totals as returned by DailySummaryView (and pushed by the summary stream)."""
+    # Half-open created_at range (see transactions.periods), answered from the
+    # summary cache, the daily rollups or an index range scan
+    summary = cached_summarize(user, day_start, day_end)
+
+    total_profit = summary["total_profit"]
+    total_debt = summary["total_debt"]
+    total_expenses = summary["expenses"]
+    net_profit = total_profit - total_expenses
+
+    logger.info(f"[CALC_DEBUG] DailySummary - Final calculations: net_profit={net_profit}, total_debt={total_debt}, expenses={total_expenses}")
+    # Decimals throughout: JSON renders them as numbers, MessagePack as minor units
+    return {
+        "net_profit": net_profit,
+        "total_debt": total_debt,
+        "expenses": total_expenses,
+        "yango_income": summary["yango_income"],
+        "bolt_income": summary["bolt_income"],
+        "yango_debt": summary["yango_debt"],
+        "bolt_debt": summary["bolt_debt"],
+    }
+
+
+class DailySummaryView(ReplicaReadMixin, APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
@@ -168,131 +375,317 @@ class DailySummaryView(APIView):
                 "bolt_debt": 0,
             })
         
-        today = date.today()
-        user = request.user
+        tz = user_timezone(request.user)
+        if request.query_params.get('date'):
+            try:
+                day_start, day_end = day_range(date.fromisoformat(request.query_params['date']), tz)
+            except ValueError:
+                return Response({'error': 'date must be YYYY-MM-DD'}, status=400)
+        else:
+            day_start, day_end = period_range('today', tz)
+        # The day (with its UTC offset) is part of the ETag so a new day, or a
+        # new timezone, never matches an old tag
+        return conditional_response(
+            request, 'daily-summary', lambda: self._summary(request.user, day_start, day_end), day_start.isoformat()
+        )
 
-        try:
-            # OPTIMIZED: Single query for all transaction aggregates with platform grouping
-            # This replaces 6 separate queries with 1 query using conditional aggregation
-            transaction_aggs = Transaction.objects.filter(
-                user=user, 
-                created_at__date=today
-            ).aggregate(
-                total_profit=Sum("rider_profit"),
-                total_debt=Sum("platform_debt"),
-                yango_profit=Sum("rider_profit", filter=models.Q(platform='YANGO')),
-                bolt_profit=Sum("rider_profit", filter=models.Q(platform='BOLT')),
-                yango_debt=Sum("platform_debt", filter=models.Q(platform='YANGO')),
-                bolt_debt=Sum("platform_debt", filter=models.Q(platform='BOLT')),
-            )
-            
-            total_profit = transaction_aggs["total_profit"] or 0
-            total_debt = transaction_aggs["total_debt"] or 0
-            yango_income = transaction_aggs["yango_profit"] or 0
-            bolt_income = transaction_aggs["bolt_profit"] or 0
-            yango_debt = transaction_aggs["yango_debt"] or 0
-            bolt_debt = transaction_aggs["bolt_debt"] or 0
-
-            # Single query for expenses
-            expenses_aggs = Expense.objects.filter(
-                user=user, 
-                created_at__date=today
-            ).aggregate(total_expenses=Sum("amount"))
-            total_expenses = expenses_aggs["total_expenses"] or 0
-
-            net_profit = float(total_profit - total_expenses)
-            
-            logger.info(f"[CALC_DEBUG] DailySummary - Final calculations: net_profit={net_profit}, total_debt={float(total_debt)}, expenses={float(total_expenses)}")
-            return Response({
-                "net_profit": net_profit,
-                "total_debt": float(total_debt),
-                "expenses": float(total_expenses),
-                "yango_income": float(yango_income),
-                "bolt_income": float(bolt_income),
-                "yango_debt": float(yango_debt),
-                "bolt_debt": float(bolt_debt),
-            })
-        except Exception as e:
-            logger.error(f"[CALC_DEBUG] DailySummary - Error: {e}")
-            return Response({
-                "net_profit": 0,
-                "total_debt": 0,
-                "expenses": 0,
-                "yango_income": 0,
-                "bolt_income": 0,
-                "yango_debt": 0,
-                "bolt_debt": 0,
-            })
+    def _summary(self, user, day_start, day_end):
+        # No all-zero fallback on errors: it would be tagged, and then
+        # revalidated, as if it were the real summary
+        return Response(daily_summary_payload(user, day_start, day_end))
 
 
-class PeriodSummaryView(APIView):
+class PeriodSummaryView(ReplicaReadMixin, APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
+        tz = user_timezone(request.user)
+        period = request.query_params.get('period')
+        if period:
+            if period not in PERIODS:
+                return Response({'error': f"period must be one of {', '.join(PERIODS)}"}, status=400)
+            start, end = period_range(period, tz)
+            # The URL stays the same when the day rolls over; the resolved
+            # range keeps yesterday's "today" from matching
+            return conditional_response(
+                request, 'period-summary', lambda: self._summary(request, start, end),
+                start.isoformat(), end.isoformat(),
+            )
+
         start_date = request.query_params.get('start_date')
         end_date = request.query_params.get('end_date')
 
         if not start_date or not end_date:
-            return Response({'error': 'start_date and end_date are required'}, status=400)
+            return Response({'error': 'period, or start_date and end_date, are required'}, status=400)
 
         try:
             start = datetime.fromisoformat(start_date.replace('Z', '+00:00'))
-            end = datetime.fromisoformat(end_date.replace('Z', '+00:00'))
+            if len(end_date) == 10:
+                # A plain date ends with its (local) day
+                end = day_range(date.fromisoformat(end_date), tz)[1]
+            else:
+                # end_date is inclusive; summaries take a half-open range
+                end = datetime.fromisoformat(end_date.replace('Z', '+00:00')) + timedelta(microseconds=1)
         except ValueError:
             return Response({'error': 'Invalid date format'}, status=400)
 
+        # Dates and datetimes without an offset are local to the driver
+        if timezone.is_naive(start):
+            start = timezone.make_aware(start, tz)
+        if timezone.is_naive(end):
+            end = timezone.make_aware(end, tz)
+
+        return conditional_response(
+            request, 'period-summary', lambda: self._summary(request, start, end), start.isoformat(), end.isoformat(),
+        )
+
+    def _summary(self, request, start, end):
         logger.info(f"[PERIOD_DEBUG] PeriodSummary request by user: {request.user.id}")
         logger.info(f"[PERIOD_DEBUG] Date range: start={start}, end={end}")
 
-        # Check total transactions for user
-        total_user_transactions = Transaction.objects.filter(user=request.user).count()
-        logger.info(f"[PERIOD_DEBUG] Total transactions for user: {total_user_transactions}")
+        summary = cached_summarize(request.user, start, end)
+
+        total_profit = summary["total_profit"]
+        total_expenses = summary["expenses"]
+        total_debt = summary["total_debt"]
+        yango_income = summary["yango_income"]
+        bolt_income = summary["bolt_income"]
+        yango_debt = summary["yango_debt"]
+        bolt_debt = summary["bolt_debt"]
+        logger.info(f"[CALC_DEBUG] PeriodSummary - Yango income: {yango_income}, Bolt income: {bolt_income}")
+        logger.info(f"[CALC_DEBUG] PeriodSummary - Yango debt: {yango_debt}, Bolt debt: {bolt_debt}")
+
+        net_profit = total_profit - total_expenses
+        logger.info(f"[CALC_DEBUG] PeriodSummary - Final calculations: net_profit={net_profit}, total_debt={total_debt}, expenses={total_expenses}")
+        return Response({
+            "yango_income": yango_income,
+            "bolt_income": bolt_income,
+            "expenses": total_expenses,
+            "yango_debt": yango_debt,
+            "bolt_debt": bolt_debt,
+            "net_profit": net_profit,
+            "total_debt": total_debt,
+        })
+
+
+class TimeSeriesView(ReplicaReadMixin, APIView):
+    """
+    Chart data: ?start=&end=&bucket=hour|day|week|month&tz=<IANA name>.
+
+    Returns one entry per bucket in [start, end), zero-filled, with totals
+    and a per-platform split. Naive start/end are read in tz, which defaults
+    to the driver's own timezone.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        params = request.query_params
+        bucket = params.get('bucket', 'day')
+        if bucket not in timeseries.BUCKETS:
+            return Response({'error': f"bucket must be one of {', '.join(timeseries.BUCKETS)}"}, status=400)
+
+        try:
+            tz = get_timezone(params['tz']) if params.get('tz') else user_timezone(request.user)
+        except ValueError as exc:
+            return Response({'error': str(exc)}, status=400)
+
+        if not params.get('start') or not params.get('end'):
+            return Response({'error': 'start and end are required'}, status=400)
+        try:
+            start = datetime.fromisoformat(params['start'].replace('Z', '+00:00'))
+            end = datetime.fromisoformat(params['end'].replace('Z', '+00:00'))
+        except ValueError:
+            return Response({'error': 'Invalid date format'}, status=400)
+        if timezone.is_naive(start):
+            start = timezone.make_aware(start, tz)
+        if timezone.is_naive(end):
+            end = timezone.make_aware(end, tz)
+        if end <= start:
+            return Response({'error': 'end must be after start'}, status=400)
+
+        max_buckets = getattr(settings, 'TIMESERIES_MAX_BUCKETS', 1000)
+        if timeseries.count_buckets(start, end, bucket, tz, max_buckets) > max_buckets:
+            return Response({'error': f'At most {max_buckets} buckets per request; use a larger bucket'}, status=400)
+
+        return conditional_response(request, 'timeseries', lambda: self._series(request.user, start, end, bucket, tz))
+
+    def _series(self, user, start, end, bucket, tz):
+        logger.info(f"TimeSeriesView for user {user.id}: {start} - {end} by {bucket} in {tz.key}")
+        return Response({
+            'start': start,
+            'end': end,
+            'bucket': bucket,
+            'tz': tz.key,
+            'series': timeseries.timeseries(user, start, end, bucket, tz),
+        })
+
+
+class ProfileView(APIView):
+    """The driver's preferences: GET, or PUT/PATCH {"timezone": "<IANA name>"}."""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        return Response({'timezone': user_timezone(request.user).key})
+
+    def put(self, request):
+        profile = DriverProfile.objects.filter(user=request.user).first() or DriverProfile(user=request.user)
+        serializer = DriverProfileSerializer(profile, data=request.data)
+        serializer.is_valid(raise_exception=True)
+        with transaction.atomic():
+            serializer.save()
+            # Day boundaries moved: drop cached summaries and ETags, and let
+            # open summary streams re-read the timezone
+            transaction.on_commit(lambda: notify_change(request.user.id))
+        logger.info(f"ProfileView: user {request.user.id} timezone set to {serializer.instance.timezone}")
+        return Response(serializer.data)
+
+    patch = put
+
 
-        # Check transactions in date range
-        transactions_in_range = Transaction.objects.filter(user=request.user, created_at__range=(start, end))
-        logger.info(f"[PERIOD_DEBUG] Transactions in range: {transactions_in_range.count()}")
+class DashboardView(ReplicaReadMixin, APIView):
+    """
+    Everything the dashboard screen needs in one request: today's summary,
+    the most recent transactions and expenses (?limit=, default
+    DASHBOARD_RECENT_ITEMS) and outstanding debt per platform.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        try:
+            limit = int(request.query_params.get('limit', getattr(settings, 'DASHBOARD_RECENT_ITEMS', 20)))
+        except ValueError:
+            return Response({'error': 'limit must be an integer'}, status=400)
+        limit = max(0, min(limit, getattr(settings, 'DASHBOARD_MAX_RECENT_ITEMS', 100)))
 
-        # Calculate Total Profit from Trips
-        profit_query = Transaction.objects.filter(user=request.user, created_at__range=(start, end)).aggregate(
-            Sum("rider_profit")
+        day_start, day_end = period_range('today', user_timezone(request.user))
+        return conditional_response(
+            request, 'dashboard', lambda: self._dashboard(request, day_start, day_end, limit), day_start.isoformat()
         )
-        total_profit = profit_query["rider_profit__sum"] or 0
-        logger.info(f"[PERIOD_DEBUG] Total profit query result: {profit_query}, total_profit: {total_profit}")
 
-        # Calculate Total Expenses
-        expenses_query = Expense.objects.filter(user=request.user, created_at__range=(start, end)).aggregate(Sum("amount"))
-        total_expenses = expenses_query["amount__sum"] or 0
-        logger.info(f"[CALC_DEBUG] PeriodSummary - Total expenses query result: {expenses_query}, total_expenses: {total_expenses}")
+    def _dashboard(self, request, day_start, day_end, limit):
+        user = request.user
+        logger.info(f"DashboardView for user {user.id}, limit={limit}")
+        transactions = Transaction.objects.filter(user=user).select_related('user').order_by('-created_at', '-id')[:limit]
+        expenses = Expense.objects.filter(user=user).select_related('user').order_by('-created_at', '-id')[:limit]
 
-        # Calculate Total Debt
-        debt_query = Transaction.objects.filter(user=request.user, created_at__range=(start, end)).aggregate(
-            Sum("platform_debt")
+        debts = rollups.debt_by_platform(user)
+        debt = {platform: debts.get(platform, rollups.ZERO) for platform, _ in Transaction.PLATFORM_CHOICES}
+        debt['total'] = sum(debts.values(), rollups.ZERO)
+
+        return Response({
+            'date': day_start.date().isoformat(),
+            'summary': daily_summary_payload(user, day_start, day_end),
+            'debt': debt,
+            # The request carries the negotiated renderer (MessagePack: integer values)
+            'transactions': TransactionSerializer(transactions, many=True, context={'request': request}).data,
+            'expenses': ExpenseSerializer(expenses, many=True, context={'request': request}).data,
+        })
+
+
+class IgnoreFormatParamNegotiation(DefaultContentNegotiation):
+    """Content negotiation that leaves ?format= to the view."""
+
+    def filter_renderers(self, renderers, format):
+        # Error responses still follow the Accept header
+        return renderers
+
+
+class ExportView(ReplicaReadMixin, APIView):
+    """
+    Full ledger download: ?format=csv|ndjson&start=&end= (half-open range,
+    both optional; bounds without an offset are in the driver's timezone).
+    Streamed straight from server-side cursors.
+    """
+    permission_classes = [IsAuthenticated]
+    content_negotiation_class = IgnoreFormatParamNegotiation
+
+    def get(self, request):
+        fmt = request.query_params.get('format', 'csv')
+        if fmt not in export.FORMATS:
+            return Response({'error': f"format must be one of {', '.join(export.FORMATS)}"}, status=400)
+
+        tz = None
+        bounds = {}
+        for name in ('start', 'end'):
+            value = request.query_params.get(name)
+            if not value:
+                continue
+            try:
+                bounds[name] = datetime.fromisoformat(value.replace('Z', '+00:00'))
+            except ValueError:
+                return Response({'error': 'Invalid date format'}, status=400)
+            if timezone.is_naive(bounds[name]):
+                tz = tz or user_timezone(request.user)
+                bounds[name] = timezone.make_aware(bounds[name], tz)
+
+        logger.info(f"ExportView for user {request.user.id}: format={fmt}, {bounds}")
+        # The body is read after the view returns, outside the routed block
+        chunks = export.export_chunks(
+            request.user, fmt, bounds.get('start'), bounds.get('end'), using=current_alias(),
         )
-        total_debt = debt_query["platform_debt__sum"] or 0
-        logger.info(f"[CALC_DEBUG] PeriodSummary - Total debt query result: {debt_query}, total_debt: {total_debt}")
-
-        # Calculate incomes per platform
-        yango_income_query = Transaction.objects.filter(user=request.user, platform='YANGO', created_at__range=(start, end)).aggregate(Sum("rider_profit"))
-        yango_income = yango_income_query["rider_profit__sum"] or 0
-        bolt_income_query = Transaction.objects.filter(user=request.user, platform='BOLT', created_at__range=(start, end)).aggregate(Sum("rider_profit"))
-        bolt_income = bolt_income_query["rider_profit__sum"] or 0
-        logger.info(f"[CALC_DEBUG] PeriodSummary - Yango income: {yango_income}, Bolt income: {bolt_income}")
+        if isinstance(request._request, ASGIRequest):
+            chunks = export.aiter_chunks(chunks)
+        response = StreamingHttpResponse(chunks, content_type=export.FORMATS[fmt])
+        filename = f"sidekick-ledger-{timezone.now():%Y%m%d}.{fmt}"
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        response['X-Accel-Buffering'] = 'no'
+        return response
 
-        # Calculate debts per platform
-        yango_debt_query = Transaction.objects.filter(user=request.user, platform='YANGO', created_at__range=(start, end)).aggregate(Sum("platform_debt"))
-        yango_debt = yango_debt_query["platform_debt__sum"] or 0
-        bolt_debt_query = Transaction.objects.filter(user=request.user, platform='BOLT', created_at__range=(start, end)).aggregate(Sum("platform_debt"))
-        bolt_debt = bolt_debt_query["platform_debt__sum"] or 0
-        logger.info(f"[CALC_DEBUG] PeriodSummary - Yango debt: {yango_debt}, Bolt debt: {bolt_debt}")
 
-        net_profit = float(total_profit - total_expenses)
-        logger.info(f"[CALC_DEBUG] PeriodSummary - Final calculations: net_profit={net_profit}, total_debt={float(total_debt)}, expenses={float(total_expenses)}")
+class SyncView(APIView):
+    """
+    Delta sync: rows created, updated or deleted since ?since=<cursor>.
+
+    Omit since for a full initial sync. Keep calling with the returned cursor
+    while has_more is true.
+
+    Always reads the primary: rows a lagging replica has not received yet
+    could fall behind a cursor and never be sent.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        try:
+            limit = int(request.query_params.get('limit', getattr(settings, 'SYNC_PAGE_SIZE', 500)))
+        except ValueError:
+            return Response({'error': 'limit must be an integer'}, status=400)
+        limit = max(1, min(limit, getattr(settings, 'SYNC_MAX_PAGE_SIZE', 5000)))
+
+        try:
+            payload = delta_sync(request.user, request.query_params.get('since'), limit, context={'request': request})
+        except InvalidCursor:
+            return Response({'error': 'Invalid sync cursor'}, status=400)
+        except CursorExpired:
+            return Response({'error': 'Sync cursor expired, perform a full sync'}, status=410)
+
+        logger.info(
+            f"SyncView for user {request.user.id}: {len(payload['transactions'])} transactions, "
+            f"{len(payload['expenses'])} expenses, has_more={payload['has_more']}"
+        )
+        return Response(payload)
+
+
+class StatsView(APIView):
+    """
+    Per-worker cache and tx_id filter statistics (staff only).
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
         return Response({
-            "yango_income": float(yango_income),
-            "bolt_income": float(bolt_income),
-            "expenses": float(total_expenses),
-            "yango_debt": float(yango_debt),
-            "bolt_debt": float(bolt_debt),
-            "net_profit": net_profit,
-            "total_debt": float(total_debt),
+            'summary_cache': summary_cache.stats(),
+            'tx_id_filter': tx_id_filter.stats(),
         })
+
+
+class MetricsView(APIView):
+    """
+    Prometheus text exposition of request, database and ingest metrics,
+    summed over every worker process (see transactions.metrics).
+    """
+    authentication_classes = [MetricsTokenAuthentication, TimedJWTAuthentication]
+    permission_classes = [CanScrapeMetrics]
+
+    def get(self, request):
+        body = metrics.render(metrics.collect())
+        return HttpResponse(body, content_type=metrics.CONTENT_TYPE)
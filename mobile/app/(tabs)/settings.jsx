@@ -189,8 +189,9 @@ export default function Settings() {
 
       const [summaryRes, transactionsRes, expensesRes] = await Promise.all([
         apiCall("/api/summary/daily/"),
-        apiCall("/api/transactions/"),
-        apiCall("/api/expenses/"),
+        // page_size=all: whole lists as plain arrays, as the store expects
+        apiCall("/api/transactions/?page_size=all"),
+        apiCall("/api/expenses/?page_size=all"),
       ]);
 
       if (!summaryRes.ok || !transactionsRes.ok || !expensesRes.ok) {
@@ -6,11 +6,12 @@ import { triggerSessionExpired } from './usePeriodSummary';
 import React from 'react';
 
 // Fetch all dashboard data in parallel with caching
+// Lists are paginated by default; page_size=all returns the whole list as a plain array
 const fetchDashboardData = async () => {
   const [summaryRes, transactionsRes, expensesRes] = await Promise.all([
     apiCall('/api/summary/daily/'),
-    apiCall('/api/transactions/'),
-    apiCall('/api/expenses/')
+    apiCall('/api/transactions/?page_size=all'),
+    apiCall('/api/expenses/?page_size=all')
   ]);
 
   const result = {};
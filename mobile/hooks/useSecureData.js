@@ -5,7 +5,7 @@ export const useSecureTransactions = () => {
   return useQuery({
     queryKey: ['transactions'],
     queryFn: async () => {
-      const response = await apiCall('/api/transactions/', {
+      const response = await apiCall('/api/transactions/?page_size=all', {
         method: 'GET',
       });
       if (!response.ok) {
@@ -21,7 +21,7 @@ export const useSecureExpenses = () => {
   return useQuery({
     queryKey: ['expenses'],
     queryFn: async () => {
-      const response = await apiCall('/api/expenses/', {
+      const response = await apiCall('/api/expenses/?page_size=all', {
         method: 'GET',
       });
       if (!response.ok) {
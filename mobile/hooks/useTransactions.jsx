@@ -215,10 +215,11 @@ export const useDeleteExpense = () => {
 };
 
 // Data fetching hooks for history screen
+// Lists are paginated by default; page_size=all returns the whole list as a plain array
 const fetchHistoryData = async () => {
   const [transactionsRes, expensesRes] = await Promise.all([
-    apiCall('/api/transactions/'),
-    apiCall('/api/expenses/')
+    apiCall('/api/transactions/?page_size=all'),
+    apiCall('/api/expenses/?page_size=all')
   ]);
 
   const result = {};